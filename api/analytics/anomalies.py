@@ -0,0 +1,252 @@
+import collections
+import threading
+import warnings
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+from decouple import config
+from api.analytics.columns import load_expense_columns
+from api.events.bus import bus
+from api.events.versions import event_fits, load_at_version, versions
+from api.utils.money import to_cents
+
+ANOMALY_CACHE_USERS = config("ANOMALY_CACHE_USERS", default=256, cast=int)
+
+COLUMNS = ("id", "date", "amount_cents", "idcategory", "idpayment")
+GROUPS = {"category": "idcategory", "payment": "idpayment"}
+# 0.6745 makes the MAD comparable to a standard deviation for normal data
+MAD_SCALE = 0.6745
+MIN_HISTORY = 5
+# Largest baseline; every value holds a window-wide view of its history
+MAX_WINDOW = 90
+# Longest range of dates analysed per request
+MAX_RANGE_DAYS = 366
+# Cached (group, window, range) baselines per user before they're cleared
+BASELINES_PER_USER = 512
+
+
+def rolling_robust_z(values, window):
+    """
+    Robust z-score of every value against the `window` values before it.
+
+    values is 1-D (one series) or 2-D (one series per row). Positions with
+    fewer than MIN_HISTORY prior values get nan.
+    """
+    values = np.atleast_2d(np.asarray(values, dtype=np.float64))
+    padding = np.full((values.shape[0], window), np.nan)
+    history = sliding_window_view(np.concatenate([padding, values], axis=1)[:, :-1], window, axis=1)
+
+    with np.errstate(all="ignore"), warnings.catch_warnings():
+        # All-nan windows (no history yet) are expected
+        warnings.simplefilter("ignore", category=RuntimeWarning)
+        median = np.nanmedian(history, axis=2)
+        deviation = np.abs(history - median[..., None])
+        scale = np.nanmedian(deviation, axis=2) / MAD_SCALE
+        # Mostly-constant history (e.g. days without spending): fall back
+        # to the mean absolute deviation, scaled the same way
+        scale = np.where(scale > 0, scale, np.nanmean(deviation, axis=2) * 1.2533)
+        z = (values - median) / scale
+        z = np.where((scale == 0) & (values == median), 0.0, z)
+
+    enough = np.sum(~np.isnan(history), axis=2) >= MIN_HISTORY
+    return np.where(enough, z, np.nan), median
+
+
+def expense_baseline(columns, group, group_id, window, start, end):
+    """
+    Rolling median and z of the group's expenses dated start to end.
+
+    Each one is compared with the `window` expenses before it, so only those
+    are read before start. None when the group has no expense in the range.
+    """
+    mask = columns[GROUPS[group]] == group_id
+    ids, dates, amounts = columns["id"][mask], columns["date"][mask], columns["amount_cents"][mask]
+    order = np.lexsort((ids, dates))
+    ids, dates, amounts = ids[order], dates[order], amounts[order]
+
+    first, last = np.searchsorted(dates, start, "left"), np.searchsorted(dates, end, "right")
+    if first == last:
+        return None
+    history = max(first - window, 0)
+    z, median = rolling_robust_z(amounts[history:last], window)
+    return {
+        "id": ids[first:last],
+        "date": dates[first:last],
+        "amount_cents": amounts[first:last],
+        "median": median[0, first - history:],
+        "z": z[0, first - history:],
+    }
+
+
+def day_baseline(columns, group, group_id, window, start, end):
+    """
+    Rolling median and z of the group's daily expense count, start to end.
+
+    Days before the user's first expense are no history, not zeros. Keeps
+    only the days with two expenses or more, the only ones ever flagged.
+    """
+    dates = columns["date"]
+    if not len(dates):
+        return None
+    origin = max(start - np.timedelta64(window, "D"), dates.min())
+    mask = (columns[GROUPS[group]] == group_id) & (dates >= origin) & (dates <= end)
+    if not mask.any():
+        return None
+    counts = np.bincount((dates[mask] - origin).astype(np.int64), minlength=int((end - origin).astype(np.int64)) + 1)
+    z, median = rolling_robust_z(counts, window)
+
+    first = max(int((start - origin).astype(np.int64)), 0)
+    busy = first + np.flatnonzero(counts[first:] >= 2)
+    return {"date": origin + busy, "count": counts[busy], "median": median[0, busy], "z": z[0, busy]}
+
+
+def large_expenses(baseline, group, group_id, threshold):
+    """Expenses whose amount is unusually high for their group."""
+    if baseline is None:
+        return []
+    return [
+        {
+            "id": int(baseline["id"][i]),
+            "date": str(baseline["date"][i]),
+            "amount": int(baseline["amount_cents"][i]) / 100,
+            GROUPS[group]: _group_id(group_id),
+            "median": round(float(baseline["median"][i]) / 100, 2),
+            "z": _z(baseline["z"][i]),
+        }
+        for i in np.flatnonzero(baseline["z"] > threshold)
+    ]
+
+
+def frequent_days(baseline, group, group_id, threshold):
+    """Days with unusually many expenses in a group."""
+    if baseline is None:
+        return []
+    return [
+        {
+            "date": str(baseline["date"][i]),
+            GROUPS[group]: _group_id(group_id),
+            "count": int(baseline["count"][i]),
+            "median": round(float(baseline["median"][i]), 2),
+            "z": _z(baseline["z"][i]),
+        }
+        for i in np.flatnonzero(baseline["z"] > threshold)
+    ]
+
+
+def find_anomalies(iduser, group, window, threshold, start, end):
+    """
+    (large expenses, frequent days) of one grouping, dates start to end.
+
+    Baselines are computed per group and kept with the user's cached
+    columns, so repeated calls, other thresholds and writes to other groups
+    reuse them.
+    """
+    columns, baselines = column_cache.get(iduser)
+    start, end = np.datetime64(start, "D"), np.datetime64(end, "D")
+    large, frequent = [], []
+    for group_id in np.unique(columns[GROUPS[group]]).tolist():
+        key = (group, group_id, window, start, end)
+        baseline = baselines.get(key)
+        if baseline is None:
+            baseline = (
+                expense_baseline(columns, group, group_id, window, start, end),
+                day_baseline(columns, group, group_id, window, start, end),
+            )
+            if len(baselines) >= BASELINES_PER_USER:
+                baselines.clear()
+            baselines[key] = baseline
+        large += large_expenses(baseline[0], group, group_id, threshold)
+        frequent += frequent_days(baseline[1], group, group_id, threshold)
+    return large, frequent
+
+
+class ColumnCache:
+    """
+    Per-user expense columns kept in memory and patched from change events.
+
+    Creates append to the arrays and updates/deletes patch them in place,
+    so a user's history is read from the database once. Entries keep the
+    user version they reflect (api/events/versions.py): a load that raced a
+    write isn't kept, and a missed event makes the next get() reload.
+
+    Each entry also holds the baselines computed from its columns; a change
+    drops only those of the groups the expense was or is in.
+    """
+
+    def __init__(self, max_users):
+        self.max_users = max_users
+        self._users = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, iduser):
+        """(columns, baselines) of the user at the current version."""
+        current = versions.version(iduser)
+        with self._lock:
+            entry = self._users.get(iduser)
+            if entry is not None and entry[0] == current:
+                self._users.move_to_end(iduser)
+                return entry[1], entry[2]
+
+        columns, version = load_at_version(iduser, lambda: load_expense_columns(iduser, COLUMNS))
+        baselines = {}
+
+        with self._lock:
+            self._users.pop(iduser, None)
+            if version is not None:
+                self._users[iduser] = (version, columns, baselines)
+                while len(self._users) > self.max_users:
+                    self._users.popitem(last=False)
+        return columns, baselines
+
+    def apply(self, event):
+        with self._lock:
+            entry = self._users.get(event["iduser"])
+            if entry is None:
+                return
+            fit = event_fits(entry[0], event)
+            if fit == "drop":
+                del self._users[event["iduser"]]
+            if fit != "apply":
+                return
+            columns, baselines = entry[1], entry[2]
+            # Updates without fields changed none of the analysed ones
+            if event["entity"] == "expense" and (event["op"] != "updated" or event.get("fields")):
+                # Dropping the id first also makes a replayed "created" harmless
+                keep = columns["id"] != event["id"]
+                touched = {(group, int(columns[field][i])) for i in np.flatnonzero(~keep) for group, field in GROUPS.items()}
+                columns = {name: array[keep] for name, array in columns.items()}
+                if event["op"] != "deleted" and event["fields"].get("date"):
+                    row = _event_row(event)
+                    columns = {name: np.append(columns[name], row[name]) for name in COLUMNS}
+                    touched.update((group, int(row[field])) for group, field in GROUPS.items())
+                baselines = {key: value for key, value in list(baselines.items()) if key[:2] not in touched}
+            # Replace the entry, readers hold on to the old arrays safely
+            self._users[event["iduser"]] = (event["version"], columns, baselines)
+
+
+column_cache = ColumnCache(ANOMALY_CACHE_USERS)
+
+
+@bus.receiver
+def update_column_cache(event):
+    # Other entities only move the columns to the event's version
+    column_cache.apply(event)
+
+
+def _event_row(event):
+    fields = event["fields"]
+    return {
+        "id": np.int64(event["id"]),
+        "date": np.datetime64(fields["date"][:10], "D"),
+        "amount_cents": np.int64(to_cents(fields["amount"])),
+        "idcategory": np.int64(fields["idcategory"] if fields["idcategory"] is not None else -1),
+        "idpayment": np.int64(fields["idpayment"] if fields["idpayment"] is not None else -1),
+    }
+
+
+def _group_id(value):
+    return int(value) if value != -1 else None
+
+
+def _z(value):
+    return round(float(value), 2) if np.isfinite(value) else None
+
@@ -0,0 +1,67 @@
+import numpy as np
+from sqlalchemy import BigInteger, func, type_coerce
+from app import db
+from api.models.expense import Expense
+
+# Filas por lote al leer del cursor; cada lote se convierte a arrays de una vez
+CHUNK_SIZE = 5000
+
+# Columnas que se pueden proyectar y como se convierten a NumPy; los montos
+# se leen en centavos tal cual estan guardados, sin pasar por Decimal
+COLUMNS = {
+    "id": (Expense.id, "id"),
+    "date": (Expense.date, "datetime64[D]"),
+    "amount_cents": (type_coerce(Expense.amount, BigInteger), np.int64),
+    "idcategory": (Expense.idcategory, "id"),
+    "idpayment": (Expense.idpayment, "id"),
+}
+
+
+def load_expense_columns(iduser, names, date_from=None, date_to=None):
+    """
+    Stream a narrow projection of the user's expenses into NumPy arrays.
+
+    Returns a dict mapping each requested column name to a 1-D array. Rows
+    without a date are skipped; NULL ids come back as -1.
+    """
+    spec = [(name,) + COLUMNS[name] for name in names]
+    stmt = db.select(*[column for _, column, _ in spec]).where(
+        Expense.iduser == iduser, Expense.date.isnot(None)
+    )
+    if date_from is not None:
+        stmt = stmt.where(Expense.date >= date_from)
+    if date_to is not None:
+        stmt = stmt.where(Expense.date <= date_to)
+
+    parts = {name: [] for name in names}
+    result = db.session.execute(stmt.execution_options(yield_per=CHUNK_SIZE))
+    for chunk in result.partitions():
+        for (name, _, dtype), values in zip(spec, zip(*chunk)):
+            parts[name].append(_to_array(values, dtype))
+
+    return {
+        name: np.concatenate(parts[name]) if parts[name] else _to_array((), dtype)
+        for name, _, dtype in spec
+    }
+
+
+def expense_date_range(iduser, date_from=None, date_to=None):
+    """
+    (first, last) date of the user's expenses within the given bounds, or
+    (None, None) if there are none. Read from the (iduser, date) index.
+    """
+    stmt = db.select(func.min(Expense.date), func.max(Expense.date)).where(Expense.iduser == iduser)
+    if date_from is not None:
+        stmt = stmt.where(Expense.date >= date_from)
+    if date_to is not None:
+        stmt = stmt.where(Expense.date <= date_to)
+    first, last = db.session.execute(stmt).one()
+    return first, last
+
+
+def _to_array(values, dtype):
+    if dtype == "id":
+        # None -> nan -> -1 sin recorrer los valores en Python
+        array = np.array(values, dtype=np.float64)
+        return np.nan_to_num(array, nan=-1).astype(np.int64)
+    return np.array(values, dtype=dtype)
@@ -0,0 +1,51 @@
+import collections
+import decimal
+from api.utils.text import normalize_concept
+
+
+def duplicate_groups(rows, days, step):
+    """
+    Groups of expenses that look like the same one entered more than once.
+
+    rows come ordered by date and carry id, concept, amount, date and
+    fingerprint. A group starts at its oldest expense, the anchor; a later
+    expense joins it when its normalized concept is equal, its amount is at
+    most half a `step` from the anchor's and its date at most `days` after
+    it. Matching against the anchor and not any member keeps a daily
+    recurring expense from chaining into one endless group.
+
+    Open groups sit in (concept, amount // step) buckets holding the last
+    `days` of anchors; an amount can only be half a step from amounts in its
+    own bucket or the two next to it, so the pass is linear in the rows
+    instead of comparing every pair.
+    """
+    buckets = collections.defaultdict(collections.deque)
+    groups = []
+
+    for row in rows:
+        amount = decimal.Decimal(row.amount)
+        key = normalize_concept(row.concept)
+        slot = int(amount // step)
+        best = None
+        for neighbour in (slot - 1, slot, slot + 1):
+            bucket = buckets.get((key, neighbour))
+            if not bucket:
+                continue
+            while bucket and (row.date - bucket[0]["anchor"].date).days > days:
+                bucket.popleft()
+            for group in bucket:
+                difference = abs(amount - decimal.Decimal(group["anchor"].amount))
+                if difference * 2 <= step and (best is None or difference < best[0]):
+                    best = (difference, group)
+        if best is not None:
+            best[1]["expenses"].append(row)
+            continue
+        group = {"anchor": row, "expenses": [row]}
+        groups.append(group)
+        buckets[(key, slot)].append(group)
+
+    return [
+        {"exact": len({row.fingerprint for row in group["expenses"]}) == 1, "expenses": group["expenses"]}
+        for group in groups
+        if len(group["expenses"]) > 1
+    ]
@@ -0,0 +1,202 @@
+import collections
+import math
+import threading
+from decouple import config
+from api.events.bus import bus
+from api.events.versions import event_fits, load_at_version, versions
+from api.models.category import Category
+from api.models.payment_method import PaymentMethod
+from api.models.suggestion_count import SuggestionCount
+from api.utils.text import normalize_concept
+
+SUGGEST_CACHE_USERS = config("SUGGEST_CACHE_USERS", default=1024, cast=int)
+
+# What is predicted, and the Expense field holding it
+TARGETS = {"category": "idcategory", "payment": "idpayment"}
+# Rows a label can point to; the counts outlive a soft delete, the label doesn't
+LABELS = {"category": Category, "payment": PaymentMethod}
+# Token of the per-label expense count (the prior)
+PRIOR = ""
+
+
+def tokens(concept, amount):
+    """
+    Features of an expense: the words of its concept plus its amount size.
+
+    Amounts fall in power-of-two buckets, so 120 and 150 share "$7".
+    """
+    words = set(normalize_concept(concept).split())
+    features = {word[:64] for word in words}
+    if amount is not None and math.isfinite(float(amount)) and float(amount) > 0:
+        features.add("$%d" % int(math.log2(max(float(amount), 1))))
+    return features
+
+
+def contributions(old, new):
+    """
+    Count changes, as {(target, label, token): delta}, for an expense going
+    from old to new field values (None when created or deleted).
+    """
+    deltas = collections.Counter()
+    for values, sign in ((old, -1), (new, 1)):
+        if not values:
+            continue
+        features = tokens(values["concept"], values["amount"])
+        for target, field in TARGETS.items():
+            label = values.get(field)
+            if label is None:
+                continue
+            deltas[(target, label, PRIOR)] += sign
+            for token in features:
+                deltas[(target, label, token)] += sign
+    return {key: delta for key, delta in deltas.items() if delta}
+
+
+class Model:
+    """
+    One user's multinomial naive Bayes with add-one smoothing, per target.
+
+    Kept as plain dicts so a prediction is a few lookups per label.
+    """
+
+    def __init__(self):
+        # target -> label -> token -> count
+        self.counts = {target: collections.defaultdict(dict) for target in TARGETS}
+        # target -> label -> sum of token counts
+        self.totals = {target: collections.Counter() for target in TARGETS}
+        # target -> token -> labels where it has a positive count
+        self.vocabulary = {target: collections.Counter() for target in TARGETS}
+        # target -> labels that aren't deleted, the only ones suggested
+        self.live = {target: set() for target in TARGETS}
+
+    def add(self, target, label, token, delta):
+        label_counts = self.counts[target][label]
+        before = label_counts.get(token, 0)
+        after = before + delta
+        if after > 0:
+            label_counts[token] = after
+        else:
+            label_counts.pop(token, None)
+            if not label_counts:
+                del self.counts[target][label]
+        if token == PRIOR:
+            return
+        self.totals[target][label] += max(after, 0) - max(before, 0)
+        if before <= 0 < after:
+            self.vocabulary[target][token] += 1
+        elif after <= 0 < before:
+            self.vocabulary[target][token] -= 1
+            if self.vocabulary[target][token] <= 0:
+                del self.vocabulary[target][token]
+
+    def predict(self, target, features, limit):
+        labels = self.counts[target]
+        documents = sum(counts.get(PRIOR, 0) for counts in labels.values())
+        if not documents:
+            return []
+        size = len(self.vocabulary[target]) + 1
+        scores = {}
+        for label, counts in labels.items():
+            prior = counts.get(PRIOR, 0)
+            if prior <= 0 or label not in self.live[target]:
+                continue
+            denominator = math.log(self.totals[target][label] + size)
+            score = math.log(prior / documents)
+            for token in features:
+                score += math.log(counts.get(token, 0) + 1) - denominator
+            scores[label] = score
+        if not scores:
+            return []
+
+        # Normalized in log space so long concepts don't underflow
+        best = max(scores.values())
+        weights = {label: math.exp(score - best) for label, score in scores.items()}
+        total = sum(weights.values())
+        ranked = sorted(weights.items(), key=lambda item: item[1], reverse=True)[:limit]
+        return [{"id": label, "probability": round(weight / total, 4)} for label, weight in ranked]
+
+
+class ModelCache:
+    """Per-user models loaded from suggestion_count and patched from events."""
+
+    def __init__(self, max_users):
+        self.max_users = max_users
+        self._users = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, iduser):
+        current = versions.version(iduser)
+        with self._lock:
+            entry = self._users.get(iduser)
+            if entry is not None and entry[0] == current:
+                self._users.move_to_end(iduser)
+                return entry[1]
+
+        model, version = load_at_version(iduser, lambda: self._load(iduser))
+
+        with self._lock:
+            self._users.pop(iduser, None)
+            if version is not None:
+                self._users[iduser] = (version, model)
+                while len(self._users) > self.max_users:
+                    self._users.popitem(last=False)
+        return model
+
+    @staticmethod
+    def _load(iduser):
+        model = Model()
+        rows = SuggestionCount.query.filter(SuggestionCount.iduser == iduser, SuggestionCount.count > 0)
+        for row in rows:
+            if row.target in TARGETS:
+                model.add(row.target, row.label, row.token, row.count)
+        for target, label_model in LABELS.items():
+            rows = label_model.query.with_entities(label_model.id).filter_by(iduser=iduser, is_delete=0)
+            model.live[target] = {row.id for row in rows}
+        return model
+
+    def suggest(self, iduser, concept, amount, limit=3):
+        """Most likely labels per target, as {target: [{id, probability}]}."""
+        model = self.get(iduser)
+        features = tokens(concept, amount)
+        with self._lock:
+            return {target: model.predict(target, features, limit) for target in TARGETS}
+
+    def apply(self, event, deltas, reload=False):
+        """Patch the user's model with deltas, or drop it when reload is set."""
+        with self._lock:
+            entry = self._users.get(event["iduser"])
+            if entry is None:
+                return
+            fit = event_fits(entry[0], event)
+            if fit == "drop" or (fit == "apply" and reload):
+                del self._users[event["iduser"]]
+                return
+            if fit != "apply":
+                return
+            model = entry[1]
+            for (target, label, token), delta in deltas.items():
+                model.add(target, label, token, delta)
+            self._users[event["iduser"]] = (event["version"], model)
+
+
+model_cache = ModelCache(SUGGEST_CACHE_USERS)
+
+
+@bus.receiver
+def update_suggestion_model(event):
+    if event["entity"] in ("category", "payment_method"):
+        # Created, renamed or deleted: the live labels load again
+        model_cache.apply(event, {}, reload=True)
+        return
+    if event["entity"] != "expense" or event["op"] == "imported" or not event.get("fields"):
+        # Still moves the model to the event's version, or drops it
+        model_cache.apply(event, {})
+        return
+    if event["op"] == "created":
+        old, new = None, event["fields"]
+    elif event["op"] == "deleted":
+        old, new = event["fields"], None
+    else:
+        old, new = event.get("previous"), event["fields"]
+    model_cache.apply(event, contributions(old, new))
+
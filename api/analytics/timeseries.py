@@ -0,0 +1,87 @@
+import numpy as np
+
+BUCKETS = ("day", "week", "month")
+# Longest series /expense/timeseries returns: ten years of days
+MAX_BUCKETS = 3660
+
+
+def bucket_dates(dates, bucket):
+    """
+    Map datetime64[D] dates to the start of their bucket.
+
+    Weeks start on Monday (1970-01-01, day 0, was a Thursday).
+    """
+    if bucket == "day":
+        return dates.astype("datetime64[D]")
+    if bucket == "week":
+        days = dates.astype("datetime64[D]").astype(np.int64)
+        return (days - (days + 3) % 7).astype("datetime64[D]")
+    return dates.astype("datetime64[M]")
+
+
+def bucket_axis(start, end, bucket):
+    """Dense, gap-free axis of bucket starts between two bucketed dates."""
+    if bucket == "week":
+        return np.arange(start, end + np.timedelta64(1, "D"), np.timedelta64(7, "D"))
+    return np.arange(start, end + 1)
+
+
+def bucket_count(date_from, date_to, bucket):
+    """Number of buckets from date_from to date_to, both included."""
+    start, end = bucket_dates(np.array([date_from, date_to], dtype="datetime64[D]"), bucket)
+    return int((end - start).astype(np.int64)) // (7 if bucket == "week" else 1) + 1
+
+
+def dense_series(dates, amounts, groups, bucket, date_from=None, date_to=None, max_buckets=None):
+    """
+    Sum amounts per (group, bucket) into a dense zero-filled matrix.
+
+    Returns (axis, group_ids, totals) where totals has one row per group and
+    one column per bucket in axis. Pass groups=None for a single series.
+    Integer amounts (cents) give int64 totals. ValueError if the range holds
+    more than max_buckets buckets.
+    """
+    if date_from is None or date_to is None:
+        if not len(dates):
+            return np.empty(0, "datetime64[D]"), np.empty(0, np.int64), np.zeros((0, 0))
+        date_from = dates.min() if date_from is None else date_from
+        date_to = dates.max() if date_to is None else date_to
+
+    start = bucket_dates(np.array([date_from], dtype="datetime64[D]"), bucket)[0]
+    end = bucket_dates(np.array([date_to], dtype="datetime64[D]"), bucket)[0]
+    if max_buckets is not None:
+        count = bucket_count(date_from, date_to, bucket)
+        if count > max_buckets:
+            raise ValueError("The range holds %d %s buckets, at most %d are allowed" % (count, bucket, max_buckets))
+    axis = bucket_axis(start, end, bucket)
+
+    position = bucket_dates(dates, bucket) - start
+    position = position.astype(np.int64)
+    if bucket == "week":
+        position //= 7
+
+    size = len(axis)
+    inside = (position >= 0) & (position < size)
+    position, amounts = position[inside], amounts[inside]
+
+    if groups is None:
+        group_ids = np.zeros(1, dtype=np.int64)
+        inverse = np.zeros(len(position), dtype=np.int64)
+    else:
+        group_ids, inverse = np.unique(groups[inside], return_inverse=True)
+
+    totals = np.bincount(
+        inverse * size + position,
+        weights=amounts,
+        minlength=len(group_ids) * size,
+    ).reshape(len(group_ids), size)
+    if np.issubdtype(amounts.dtype, np.integer):
+        # bincount adds in float64, which is exact for whole numbers below 2**53
+        totals = np.rint(totals).astype(np.int64)
+    return axis, group_ids, totals
+
+
+def axis_labels(axis, bucket):
+    if bucket == "month":
+        return np.datetime_as_string(axis, unit="M").tolist()
+    return np.datetime_as_string(axis, unit="D").tolist()
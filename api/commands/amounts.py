@@ -0,0 +1,73 @@
+import click
+from flask.cli import AppGroup
+from sqlalchemy import inspect, text
+from api.services.sharding import DEFAULT_SHARD
+from api.services.shard_directory import SHARD_NAMES, shard_engine
+
+amounts_cli = AppGroup("expense-amounts", help="Migrate expense amounts to integer cents.")
+
+AMOUNT_INDEX = "ix_expense_iduser_date_amount"
+COPY = "UPDATE expense SET amount_cents = ROUND(amount * 100) WHERE amount_cents IS NULL"
+
+
+@amounts_cli.command("to-cents")
+@click.option("--shard", default=DEFAULT_SHARD, show_default=True, help="Shard to migrate.")
+@click.option("--batch", default=10000, show_default=True, help="Ids copied per statement.")
+@click.option("--copy-only", is_flag=True, help="Fill amount_cents but keep amount, so the running version still works.")
+def amounts_to_cents(shard, batch, copy_only):
+    """
+    Move expense.amount (DECIMAL(10, 2)) to amount_cents (BIGINT).
+
+    Adds amount_cents and copies the amounts over in id ranges, so no
+    statement locks the whole table. Without --copy-only it then copies
+    whatever was written meanwhile, moves the amount index to the new column
+    and drops amount; the version that reads amount_cents has to be deployed
+    right after. It can be run again after an interruption.
+    """
+    if shard not in SHARD_NAMES:
+        raise click.BadParameter("unknown shard %s, expected one of %s" % (shard, ", ".join(SHARD_NAMES)))
+    # Raw statements bypass the session's shard routing, so use the engine
+    with shard_engine(shard).connect() as connection:
+        columns = _expense_columns(connection)
+        if "amount" not in columns:
+            click.echo("expense.amount is already stored in cents.")
+            return
+        if "amount_cents" not in columns:
+            _run(connection, ["ALTER TABLE expense ADD COLUMN amount_cents BIGINT"])
+
+        last = connection.execute(text("SELECT MAX(id) FROM expense")).scalar() or 0
+        for start in range(0, last + 1, batch):
+            connection.execute(text(COPY + " AND id >= :start AND id < :end"), {"start": start, "end": start + batch})
+            connection.commit()
+        click.echo("Copied the amounts of ids up to %d." % last)
+        if copy_only:
+            return
+
+        mysql = connection.dialect.name == "mysql"
+        statements = [COPY]
+        # Databases created before the index, or a rerun after it was dropped
+        if AMOUNT_INDEX in _expense_indexes(connection):
+            statements.append("DROP INDEX %s ON expense" % AMOUNT_INDEX if mysql else "DROP INDEX %s" % AMOUNT_INDEX)
+        statements.append("CREATE INDEX %s ON expense (iduser, date, amount_cents)" % AMOUNT_INDEX)
+        if mysql:
+            statements.append("ALTER TABLE expense MODIFY amount_cents BIGINT NOT NULL, DROP COLUMN amount")
+        else:
+            # SQLite can't add NOT NULL to an existing column; the model still requires it
+            statements.append("ALTER TABLE expense DROP COLUMN amount")
+        _run(connection, statements)
+    click.echo("expense.amount of %s is now stored in cents." % shard)
+
+
+def _expense_columns(connection):
+    return {column["name"] for column in inspect(connection).get_columns("expense")}
+
+
+def _expense_indexes(connection):
+    return {index["name"] for index in inspect(connection).get_indexes("expense")}
+
+
+def _run(connection, statements):
+    for statement in statements:
+        click.echo(statement)
+        connection.execute(text(statement))
+    connection.commit()
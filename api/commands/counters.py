@@ -0,0 +1,110 @@
+import collections
+import click
+from flask.cli import AppGroup
+from app import db
+from api.analytics.suggest import contributions
+from api.models.concept_count import ConceptCount
+from api.models.suggestion_count import SuggestionCount
+from api.models.expense import Expense, fingerprint
+from api.services.sharding import DEFAULT_SHARD
+from api.services.shard_directory import using_shard
+from api.utils.text import normalize_concept
+
+counters_cli = AppGroup("counters", help="Rebuild the per-user counter tables from the expenses.")
+
+
+@counters_cli.command("concepts")
+@click.option("--shard", default=DEFAULT_SHARD, show_default=True, help="Shard to rebuild.")
+def rebuild_concept_counts(shard):
+    """Recount concept_count from every expense (normal writes keep it current)."""
+    with using_shard(shard):
+        _rebuild_concept_counts()
+
+
+def _rebuild_concept_counts():
+    counts = collections.Counter()
+    latest = {}
+    rows = db.session.execute(
+        db.select(Expense.iduser, Expense.concept, Expense.date)
+        .where(Expense.iduser.isnot(None))
+        .order_by(Expense.date, Expense.id)
+        .execution_options(yield_per=5000)
+    )
+    for iduser, concept, date in rows:
+        key = (iduser, normalize_concept(concept))
+        if not key[1]:
+            continue
+        counts[key] += 1
+        latest[key] = (concept.strip()[:255], date)
+
+    db.session.execute(db.delete(ConceptCount))
+    batch = [
+        {"iduser": iduser, "concept_key": key, "count": count, "concept": latest[(iduser, key)][0],
+         "last_used": latest[(iduser, key)][1]}
+        for (iduser, key), count in counts.items()
+    ]
+    for start in range(0, len(batch), 1000):
+        db.session.execute(db.insert(ConceptCount), batch[start:start + 1000])
+    db.session.commit()
+    click.echo("Counted %d concepts." % len(batch))
+
+
+@counters_cli.command("suggestions")
+@click.option("--shard", default=DEFAULT_SHARD, show_default=True, help="Shard to rebuild.")
+def rebuild_suggestion_counts(shard):
+    """Recount suggestion_count from every expense (normal writes keep it current)."""
+    with using_shard(shard):
+        _rebuild_suggestion_counts()
+
+
+def _rebuild_suggestion_counts():
+    counts = collections.Counter()
+    rows = db.session.execute(
+        db.select(Expense.iduser, Expense.concept, Expense.amount, Expense.idcategory, Expense.idpayment)
+        .where(Expense.iduser.isnot(None))
+        .execution_options(yield_per=5000)
+    )
+    for iduser, concept, amount, idcategory, idpayment in rows:
+        values = {"concept": concept, "amount": amount, "idcategory": idcategory, "idpayment": idpayment}
+        for (target, label, token), delta in contributions(None, values).items():
+            counts[(iduser, target, label, token)] += delta
+
+    db.session.execute(db.delete(SuggestionCount))
+    batch = [
+        {"iduser": iduser, "target": target, "label": label, "token": token, "count": count}
+        for (iduser, target, label, token), count in counts.items()
+    ]
+    for start in range(0, len(batch), 1000):
+        db.session.execute(db.insert(SuggestionCount), batch[start:start + 1000])
+    db.session.commit()
+    click.echo("Counted %d suggestion tokens." % len(batch))
+
+
+@counters_cli.command("fingerprints")
+@click.option("--shard", default=DEFAULT_SHARD, show_default=True, help="Shard to fill.")
+def fill_fingerprints(shard):
+    """Compute the duplicate fingerprint of expenses saved before it existed."""
+    with using_shard(shard):
+        _fill_fingerprints()
+
+
+def _fill_fingerprints():
+    # Straight on the table: it isn't a user edit, so no version bump or change events
+    table = Expense.__table__
+    filled = 0
+    while True:
+        rows = db.session.execute(
+            db.select(Expense.id, Expense.concept, Expense.amount, Expense.date, Expense.idpayment)
+            .where(Expense.fingerprint.is_(None), Expense.amount.isnot(None), Expense.date.isnot(None))
+            .order_by(Expense.id)
+            .limit(1000)
+        ).all()
+        if not rows:
+            break
+        db.session.execute(
+            table.update().where(table.c.id == db.bindparam("row_id")).values(fingerprint=db.bindparam("value")),
+            [{"row_id": row.id, "value": fingerprint(row.concept, row.amount, row.date, row.idpayment)} for row in rows],
+        )
+        db.session.commit()
+        filled += len(rows)
+    click.echo("Filled %d fingerprints." % filled)
@@ -0,0 +1,35 @@
+import click
+from flask.cli import AppGroup
+from api.services.export import DEFAULT_COLUMNS, FORMATS, parse_columns, record_batches, write_export
+from api.services.sharding import DEFAULT_SHARD
+from api.services.shard_directory import using_shard
+
+export_cli = AppGroup("expense-export", help="Export expenses as Arrow or Parquet files for analytics.")
+
+
+@export_cli.command("write")
+@click.argument("path", type=click.Path(dir_okay=False, writable=True))
+@click.option("--shard", default=DEFAULT_SHARD, show_default=True, help="Shard to export.")
+@click.option("--format", "fmt", type=click.Choice(list(FORMATS)), default="parquet", show_default=True)
+@click.option("--user", "iduser", type=int, help="Only this user's expenses; every user of the shard by default.")
+@click.option("--from", "date_from", type=click.DateTime(["%Y-%m-%d"]), help="First date to export.")
+@click.option("--to", "date_to", type=click.DateTime(["%Y-%m-%d"]), help="Last date to export.")
+@click.option("--columns", help="Comma-separated columns, see GET /expense/export.")
+def write_expense_export(path, shard, fmt, iduser, date_from, date_to, columns):
+    """Write the shard's expenses to PATH, one record batch at a time."""
+    default = DEFAULT_COLUMNS if iduser is not None else ("iduser",) + DEFAULT_COLUMNS
+    try:
+        names = parse_columns(columns, default)
+    except ValueError as e:
+        raise click.BadParameter(str(e), param_hint="--columns")
+
+    with using_shard(shard), open(path, "wb") as output:
+        batches = record_batches(
+            names,
+            iduser,
+            date_from.date() if date_from else None,
+            date_to.date() if date_to else None,
+        )
+        for data in write_export(fmt, names, batches):
+            output.write(data)
+    click.echo("Wrote %s." % path)
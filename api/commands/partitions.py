@@ -0,0 +1,142 @@
+import datetime
+import click
+from flask.cli import AppGroup
+from sqlalchemy import text
+from app import db
+
+partitions_cli = AppGroup("expense-partitions", help="Maintain the yearly partitions of the expense table (MySQL).")
+
+ARCHIVE_PARTITION = "parchive"
+MAX_PARTITION = "pmax"
+
+
+@partitions_cli.command("init")
+@click.option("--ahead", default=1, show_default=True, help="Future years to pre-create.")
+def init_partitions(ahead):
+    """
+    Convert expense into a RANGE COLUMNS(date) partitioned table.
+
+    MySQL requires the partition column in every unique key and does not
+    support foreign keys on partitioned tables, so this backfills NULL dates
+    from created_at, drops the iduser foreign key and widens the primary key
+    to (id, date). The ORM keeps mapping id as the primary key.
+    """
+    if not _is_mysql():
+        return
+    if _partition_bounds():
+        click.echo("expense is already partitioned, use 'roll' instead.")
+        return
+
+    oldest = db.session.execute(text("SELECT MIN(date) FROM expense")).scalar()
+    today = datetime.date.today()
+    first_year = min(oldest.year if oldest else today.year, today.year)
+    years = range(first_year, today.year + ahead + 1)
+
+    statements = ["UPDATE expense SET date = DATE(created_at) WHERE date IS NULL"]
+    statements += [
+        "ALTER TABLE expense DROP FOREIGN KEY `%s`" % name for name in _foreign_keys()
+    ]
+    statements += [
+        "ALTER TABLE expense MODIFY date DATE NOT NULL, "
+        "DROP PRIMARY KEY, ADD PRIMARY KEY (id, date)",
+        "ALTER TABLE expense PARTITION BY RANGE COLUMNS(date) (%s)"
+        % ", ".join([_year_partition(year) for year in years] + [_max_partition()]),
+    ]
+    _run(statements)
+    click.echo("expense partitioned from %d to %d." % (years[0], years[-1]))
+
+
+@partitions_cli.command("roll")
+@click.option("--ahead", default=1, show_default=True, help="Future years that must exist.")
+def roll_partitions(ahead):
+    """Split pmax so that a partition exists for every year up to today + ahead."""
+    if not _is_mysql():
+        return
+    bounds = _partition_bounds()
+    if not bounds:
+        click.echo("expense is not partitioned, run 'init' first.")
+        return
+
+    yearly = [year for year in bounds.values() if year is not None]
+    if not yearly:
+        click.echo("No yearly partitions left, run 'init' on a fresh table.")
+        return
+
+    last_year = max(yearly)
+    target = datetime.date.today().year + ahead
+    if last_year >= target:
+        click.echo("Nothing to do, partitions exist up to %d." % last_year)
+        return
+
+    years = range(last_year + 1, target + 1)
+    _run([
+        "ALTER TABLE expense REORGANIZE PARTITION %s INTO (%s)"
+        % (MAX_PARTITION, ", ".join([_year_partition(year) for year in years] + [_max_partition()]))
+    ])
+    click.echo("Added partitions for %d to %d." % (years[0], years[-1]))
+
+
+@partitions_cli.command("archive")
+@click.argument("before", type=int)
+def archive_partitions(before):
+    """Merge every yearly partition older than BEFORE into the archive partition."""
+    if not _is_mysql():
+        return
+    bounds = _partition_bounds()
+    cold = [name for name, year in bounds.items() if year is not None and year < before]
+    if not cold:
+        click.echo("No yearly partitions older than %d." % before)
+        return
+    if ARCHIVE_PARTITION in bounds:
+        # Reorganized partitions must be adjacent, the archive is the first one
+        cold.insert(0, ARCHIVE_PARTITION)
+
+    _run([
+        "ALTER TABLE expense REORGANIZE PARTITION %s INTO "
+        "(PARTITION %s VALUES LESS THAN ('%d-01-01'))" % (", ".join(cold), ARCHIVE_PARTITION, before)
+    ])
+    click.echo("Archived %s into %s." % (", ".join(cold), ARCHIVE_PARTITION))
+
+
+def _partition_bounds():
+    """Ordered {partition name: year it holds} (None for pmax/archive)."""
+    rows = db.session.execute(text(
+        "SELECT PARTITION_NAME FROM information_schema.PARTITIONS "
+        "WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = 'expense' "
+        "AND PARTITION_NAME IS NOT NULL ORDER BY PARTITION_ORDINAL_POSITION"
+    ))
+    bounds = {}
+    for (name,) in rows:
+        bounds[name] = int(name[1:]) if name[1:].isdigit() else None
+    return bounds
+
+
+def _foreign_keys():
+    rows = db.session.execute(text(
+        "SELECT CONSTRAINT_NAME FROM information_schema.TABLE_CONSTRAINTS "
+        "WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = 'expense' "
+        "AND CONSTRAINT_TYPE = 'FOREIGN KEY'"
+    ))
+    return [name for (name,) in rows]
+
+
+def _year_partition(year):
+    return "PARTITION p%d VALUES LESS THAN ('%d-01-01')" % (year, year + 1)
+
+
+def _max_partition():
+    return "PARTITION %s VALUES LESS THAN (MAXVALUE)" % MAX_PARTITION
+
+
+def _run(statements):
+    for statement in statements:
+        click.echo(statement)
+        db.session.execute(text(statement))
+    db.session.commit()
+
+
+def _is_mysql():
+    if db.engine.dialect.name != "mysql":
+        click.echo("Partitioning is only available on MySQL (current backend: %s)." % db.engine.dialect.name)
+        return False
+    return True
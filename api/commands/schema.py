@@ -0,0 +1,81 @@
+import click
+import sqlalchemy as sa
+from flask.cli import AppGroup
+from app import db
+from api.services.sharding import DEFAULT_SHARD, SHARDED_TABLES
+from api.services.shard_directory import SHARD_NAMES, shard_engine
+
+schema_cli = AppGroup("schema", help="Bring an existing database up to date with the models.")
+
+
+@schema_cli.command("upgrade")
+@click.option("--shard", default=DEFAULT_SHARD, show_default=True, help="Shard to upgrade.")
+@click.option("--dry-run", is_flag=True, help="Only print the statements.")
+def upgrade_schema(shard, dry_run):
+    """
+    Create the tables, columns and indexes the models have and the database lacks.
+
+    For databases created before the optimistic-locking version columns,
+    the expense location (latitude, longitude, geocell), the duplicate
+    fingerprint, and the change log, counter and import tables. It only
+    adds: nothing is altered or dropped, and new columns take their server
+    default (version = 1) or NULL. It can be run again at any time.
+
+    expense.amount_cents is left to `flask expense-amounts to-cents`, which
+    also copies the amounts. Run this before deploying the code that reads
+    the new columns, then fill the derived data with `flask counters
+    concepts`, `suggestions` and `fingerprints`.
+    """
+    if shard not in SHARD_NAMES:
+        raise click.BadParameter("unknown shard %s, expected one of %s" % (shard, ", ".join(SHARD_NAMES)))
+    engine = shard_engine(shard)
+    # The shards hold only the per-user tables, without foreign keys to user
+    tables = [
+        table for table in db.metadata.sorted_tables
+        if shard == DEFAULT_SHARD or table.name in SHARDED_TABLES
+    ]
+
+    with engine.connect() as connection:
+        statements = _missing_schema(connection, tables, foreign_keys=shard == DEFAULT_SHARD)
+        if not statements:
+            click.echo("The schema of %s is up to date." % shard)
+            return
+        for statement in statements:
+            click.echo(str(statement).strip() + ";")
+            if not dry_run:
+                connection.execute(statement)
+                connection.commit()
+    if not dry_run:
+        click.echo("Upgraded the schema of %s." % shard)
+
+
+def _missing_schema(connection, tables, foreign_keys):
+    inspector = sa.inspect(connection)
+    dialect = connection.dialect
+    existing = set(inspector.get_table_names())
+    statements = []
+    for table in tables:
+        if table.name not in existing:
+            statements.append(sa.schema.CreateTable(table, include_foreign_key_constraints=None if foreign_keys else []))
+            statements.extend(sa.schema.CreateIndex(index) for index in table.indexes)
+            continue
+
+        columns = {column["name"] for column in inspector.get_columns(table.name)}
+        for column in table.columns:
+            if column.name in columns:
+                continue
+            if table.name == "expense" and column.name == "amount_cents":
+                click.echo("expense.amount_cents is missing, run flask expense-amounts to-cents for it.")
+                continue
+            definition = sa.schema.CreateColumn(column).compile(dialect=dialect)
+            statements.append(sa.text("ALTER TABLE %s ADD COLUMN %s" % (
+                dialect.identifier_preparer.format_table(table), definition,
+            )))
+            columns.add(column.name)
+
+        indexes = {index["name"] for index in inspector.get_indexes(table.name)}
+        for index in table.indexes:
+            # An index on a column still to be migrated waits for it
+            if index.name not in indexes and all(column.name in columns for column in index.columns):
+                statements.append(sa.schema.CreateIndex(index))
+    return statements
@@ -0,0 +1,230 @@
+import datetime
+import json
+import time
+import click
+import sqlalchemy as sa
+from flask.cli import AppGroup
+from app import db
+from api.events.bus import bus
+from api.events.versions import versions
+from api.models.import_job import ImportJob
+from api.models.user import User
+from api.models.user_shard import UserShard
+from api.services.sharding import DEFAULT_SHARD, SHARDED_TABLES
+from api.services.shard_directory import SHARD_DIRECTORY_TTL, SHARD_NAMES, shard_engine
+
+shards_cli = AppGroup("shards", help="Manage the shards holding the per-user tables.")
+
+COPY_BATCH = 1000
+
+# Tables whose autoincrement ids can already be taken on the target shard
+RENUMBERED_TABLES = ("category", "payment_method", "expense", "import_job")
+# Columns holding those ids, per table
+REFERENCES = {
+    "expense": {"idcategory": "category", "idpayment": "payment_method"},
+    "import_job": {"idpayment": "payment_method"},
+    "import_mapping": {"idpayment": "payment_method"},
+    "import_fingerprint": {"idexpense": "expense"},
+}
+# Table of the ids in suggestion_count.label, per target
+SUGGESTION_LABELS = {"category": "category", "payment": "payment_method"}
+
+
+def sharded_tables():
+    """The per-user tables, parents first."""
+    return [table for table in db.metadata.sorted_tables if table.name in SHARDED_TABLES]
+
+
+@shards_cli.command("init")
+def init_shards():
+    """
+    Create the directory and the per-user tables on every shard.
+
+    Foreign keys to user are left out on the shards, the user table only
+    exists in the main database.
+
+    On MySQL give each shard server the same auto_increment_increment (at
+    least the number of shards) and its own auto_increment_offset, so IDs
+    never collide and moved rows keep theirs. Otherwise (SQLite, or shards
+    that already hold data) `move` renumbers the rows whose IDs are taken.
+    """
+    db.metadata.create_all(db.engine, tables=[UserShard.__table__])
+    for shard in SHARD_NAMES:
+        if shard == DEFAULT_SHARD:
+            continue
+        with shard_engine(shard).begin() as connection:
+            existing = set(sa.inspect(connection).get_table_names())
+            for table in sharded_tables():
+                if table.name in existing:
+                    continue
+                connection.execute(sa.schema.CreateTable(table, include_foreign_key_constraints=[]))
+                for index in table.indexes:
+                    connection.execute(sa.schema.CreateIndex(index))
+        click.echo("Created the tables on %s." % shard)
+
+
+@shards_cli.command("list")
+def list_shards():
+    """Users per shard."""
+    counts = dict(db.session.execute(db.select(UserShard.shard, sa.func.count()).group_by(UserShard.shard)).all())
+    users = db.session.execute(db.select(sa.func.count(User.id))).scalar()
+    counts[DEFAULT_SHARD] = counts.get(DEFAULT_SHARD, 0) + users - sum(counts.values())
+    for shard in SHARD_NAMES:
+        click.echo("%-20s %d users" % (shard, counts.get(shard, 0)))
+
+
+@shards_cli.command("move")
+@click.argument("iduser", type=int)
+@click.argument("target")
+@click.option("--wait", default=SHARD_DIRECTORY_TTL + 1, show_default=True,
+              help="Seconds to let requests in flight finish once the user is marked as moving.")
+def move_user(iduser, target, wait):
+    """
+    Move every row of a user to another shard.
+
+    The user gets 503 while moving. Rows keep their IDs unless another
+    user's row on the target already has it: those get new IDs above the
+    target's highest, and the columns pointing at them (expense category and
+    payment method, suggestion labels, import jobs and mappings, change log)
+    follow. The change log is copied after the target's highest seq, so
+    existing sync tokens resend the user's changes instead of skipping any,
+    plus a deletion for every renumbered ID so clients drop the old one.
+    Rows left on the old shard by an interrupted move are never read and
+    are cleared if the user moves back there.
+
+    IDs are picked inside the copy; if the target gives one of them to a new
+    row meanwhile, the move fails without changes and can be run again.
+    """
+    if target not in SHARD_NAMES:
+        raise click.BadParameter("unknown shard %s, expected one of %s" % (target, ", ".join(SHARD_NAMES)))
+    entry = db.session.get(UserShard, iduser)
+    source = entry.shard if entry else DEFAULT_SHARD
+    if source == target:
+        click.echo("User %d is already on %s." % (iduser, target))
+        return
+    with shard_engine(source).connect() as connection:
+        importing = connection.execute(
+            sa.select(sa.func.count()).select_from(ImportJob.__table__).where(
+                ImportJob.__table__.c.iduser == iduser, ImportJob.__table__.c.status.in_(("queued", "running"))
+            )
+        ).scalar()
+    if importing:
+        raise click.ClickException("User %d has %d imports in progress, move it once they finish." % (iduser, importing))
+
+    if entry is None:
+        entry = UserShard(iduser=iduser, shard=source)
+        db.session.add(entry)
+    entry.moving = True
+    db.session.commit()
+    bus.publish({"entity": "user_shard", "op": "moving", "id": iduser, "iduser": iduser})
+    time.sleep(wait)
+
+    tables = sharded_tables()
+    try:
+        with shard_engine(source).connect() as reader, shard_engine(target).begin() as writer:
+            for table in reversed(tables):
+                writer.execute(table.delete().where(table.c.iduser == iduser))
+            ids = {
+                table.name: renumber_ids(reader, writer, table, iduser)
+                for table in tables if table.name in RENUMBERED_TABLES
+            }
+            for table in tables:
+                if table.name == "change_log":
+                    copied = copy_change_log(reader, writer, table, iduser, ids)
+                else:
+                    copied = copy_rows(reader, writer, table, iduser, ids)
+                click.echo("%-20s %d rows, %d renumbered" % (table.name, copied, len(ids.get(table.name, ()))))
+    except Exception:
+        # Nothing was committed on the target, the user stays where it was
+        entry.moving = False
+        db.session.commit()
+        bus.publish({"entity": "user_shard", "op": "failed", "id": iduser, "iduser": iduser})
+        raise
+
+    entry.shard = target
+    entry.moving = False
+    db.session.commit()
+    # A version no event carries: every worker's caches of the user reload
+    # from the new shard instead of keeping the old IDs
+    versions.start({iduser: 1})
+    versions.finish({iduser: 1})
+    bus.publish({"entity": "user_shard", "op": "moved", "id": iduser, "iduser": iduser})
+
+    with shard_engine(source).begin() as connection:
+        for table in reversed(tables):
+            connection.execute(table.delete().where(table.c.iduser == iduser))
+    click.echo("Moved user %d from %s to %s." % (iduser, source, target))
+
+
+def renumber_ids(reader, writer, table, iduser):
+    """{old: new} for the user's IDs another row already has on the target."""
+    ids = reader.execute(sa.select(table.c.id).where(table.c.iduser == iduser)).scalars().all()
+    taken = set()
+    for start in range(0, len(ids), COPY_BATCH):
+        taken.update(writer.execute(sa.select(table.c.id).where(table.c.id.in_(ids[start:start + COPY_BATCH]))).scalars())
+    if not taken:
+        return {}
+    # Above the target's IDs and the user's own, so a new one never collides
+    last = max(writer.execute(sa.select(sa.func.max(table.c.id))).scalar() or 0, max(ids))
+    return {old: last + offset for offset, old in enumerate(sorted(taken), 1)}
+
+
+def renumber_row(table, row, ids):
+    """The row with its own and its referenced IDs renumbered."""
+    row = dict(row)
+    if table.name in ids:
+        row["id"] = ids[table.name].get(row["id"], row["id"])
+    for column, referenced in REFERENCES.get(table.name, {}).items():
+        row[column] = ids[referenced].get(row[column], row[column])
+    if table.name == "suggestion_count" and row["target"] in SUGGESTION_LABELS:
+        row["label"] = ids[SUGGESTION_LABELS[row["target"]]].get(row["label"], row["label"])
+    elif table.name == "change_log" and row["entity"] in ids:
+        row["entity_id"] = ids[row["entity"]].get(row["entity_id"], row["entity_id"])
+    elif table.name == "import_mapping":
+        mapping = json.loads(row["mapping"])
+        if mapping.get("idcategory") in ids["category"]:
+            mapping["idcategory"] = ids["category"][mapping["idcategory"]]
+            row["mapping"] = json.dumps(mapping)
+    return row
+
+
+def copy_rows(reader, writer, table, iduser, ids):
+    copied = 0
+    result = reader.execution_options(yield_per=COPY_BATCH).execute(
+        sa.select(table).where(table.c.iduser == iduser)
+    )
+    for rows in result.mappings().partitions():
+        writer.execute(table.insert(), [renumber_row(table, row, ids) for row in rows])
+        copied += len(rows)
+    return copied
+
+
+def copy_change_log(reader, writer, table, iduser, ids):
+    # Above every seq on both shards, so no sync token can be past them
+    base = max(
+        writer.execute(sa.select(sa.func.max(table.c.seq))).scalar() or 0,
+        reader.execute(sa.select(sa.func.max(table.c.seq)).where(table.c.iduser == iduser)).scalar() or 0,
+    )
+    copied = 0
+    result = reader.execution_options(yield_per=COPY_BATCH).execute(
+        sa.select(table).where(table.c.iduser == iduser).order_by(table.c.seq)
+    )
+    for rows in result.mappings().partitions():
+        batch = []
+        for row in rows:
+            copied += 1
+            batch.append(dict(renumber_row(table, row, ids), seq=base + copied))
+        writer.execute(table.insert(), batch)
+
+    # The old IDs are gone for the user's synced clients
+    now = datetime.datetime.utcnow()
+    tombstones = []
+    for entity in ("expense", "category", "payment_method"):
+        for old in sorted(ids.get(entity, ())):
+            copied += 1
+            tombstones.append({
+                "seq": base + copied, "iduser": iduser, "entity": entity, "entity_id": old, "op": "deleted", "created_at": now,
+            })
+    if tombstones:
+        writer.execute(table.insert(), tombstones)
+    return copied
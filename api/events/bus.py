@@ -0,0 +1,157 @@
+import collections
+import json
+import logging
+import os
+import queue
+import socket
+import tempfile
+import threading
+import time
+from decouple import config
+
+EVENTS_SOCKET_DIR = config(
+    "EVENTS_SOCKET_DIR", default=os.path.join(tempfile.gettempdir(), "finanzcord-events")
+)
+EVENTS_REPLAY_SIZE = config("EVENTS_REPLAY_SIZE", default=1000, cast=int)
+# Sockets are also re-listed this often, in case a join was missed
+EVENTS_PEER_REFRESH = config("EVENTS_PEER_REFRESH", default=30.0, cast=float)
+
+logger = logging.getLogger(__name__)
+
+
+class EventBus:
+    """
+    Host-local pub/sub between the gunicorn workers.
+
+    Every worker binds a UNIX datagram socket named after its pid in
+    EVENTS_SOCKET_DIR, lists the sockets already there and announces itself
+    to them, so publishing sends the event to the known workers (the
+    publisher's own included) without reading the directory. Sends never
+    block the writing request: a worker whose queue is full misses the
+    event, which leaves a gap in that user's versions
+    (api/events/versions.py) so its caches reload. A listener thread per worker hands each event to
+    the SSE subscribers and the registered receivers, and keeps the last
+    EVENTS_REPLAY_SIZE events for Last-Event-ID resume.
+    """
+
+    def __init__(self, directory, replay_size):
+        self.directory = directory
+        self._lock = threading.Lock()
+        self._pid = None
+        self._sender = None
+        self._path = None
+        self._peers = set()
+        self._subscribers = set()
+        self._receivers = []
+        self._recent = collections.deque(maxlen=replay_size)
+
+    def receiver(self, f):
+        """Register f(event), called in every worker for every event."""
+        self._receivers.append(f)
+        return f
+
+    def subscribe(self):
+        self._ensure_started()
+        subscription = queue.Queue(maxsize=1000)
+        with self._lock:
+            self._subscribers.add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            self._subscribers.discard(subscription)
+
+    def replay(self, after_id):
+        """Events still in memory newer than after_id, oldest first."""
+        return sorted((e for e in list(self._recent) if e["event_id"] > after_id), key=lambda e: e["event_id"])
+
+    def publish(self, event):
+        self._ensure_started()
+        event = dict(event, event_id=time.time_ns())
+        self._send(json.dumps(event).encode())
+
+    def _send(self, payload):
+        with self._lock:
+            peers = list(self._peers)
+        for path in peers:
+            try:
+                self._sender.sendto(payload, socket.MSG_DONTWAIT, path)
+            except (ConnectionRefusedError, FileNotFoundError):
+                # Socket left behind by a dead worker
+                self._forget(path)
+                self._remove(path)
+            except BlockingIOError:
+                logger.warning("Worker %s is behind and missed an event, its caches will reload", path)
+
+    def _ensure_started(self):
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            os.makedirs(self.directory, exist_ok=True)
+            path = os.path.join(self.directory, "%d.sock" % os.getpid())
+            self._remove(path)
+            listener = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+            listener.bind(path)
+            listener.settimeout(EVENTS_PEER_REFRESH)
+            self._sender = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+            self._sender.setblocking(False)
+            self._path = path
+            # Bound before listing: a worker starting now either is listed
+            # here or lists this socket
+            self._peers = self._list_peers()
+            self._subscribers = set()
+            threading.Thread(target=self._listen, args=(listener,), name="event-bus", daemon=True).start()
+            self._pid = os.getpid()
+        self._send(json.dumps({"bus": "join", "path": path}).encode())
+
+    def _list_peers(self):
+        return {
+            os.path.join(self.directory, name) for name in os.listdir(self.directory) if name.endswith(".sock")
+        }
+
+    def _forget(self, path):
+        with self._lock:
+            if path != self._path:
+                self._peers.discard(path)
+
+    def _listen(self, listener):
+        refreshed = time.monotonic()
+        while True:
+            if time.monotonic() - refreshed > EVENTS_PEER_REFRESH:
+                peers = self._list_peers()
+                with self._lock:
+                    self._peers = peers | {self._path}
+                refreshed = time.monotonic()
+            try:
+                event = json.loads(listener.recv(65536))
+            except TimeoutError:
+                continue
+            if "bus" in event:
+                with self._lock:
+                    self._peers.add(event["path"])
+                continue
+            self._recent.append(event)
+            with self._lock:
+                subscribers = list(self._subscribers)
+            for subscription in subscribers:
+                try:
+                    subscription.put_nowait(event)
+                except queue.Full:
+                    pass
+            for receive in self._receivers:
+                try:
+                    receive(event)
+                except Exception:
+                    logger.exception("Event receiver %s failed", receive.__name__)
+
+    @staticmethod
+    def _remove(path):
+        try:
+            os.unlink(path)
+        except FileNotFoundError:
+            pass
+
+
+bus = EventBus(EVENTS_SOCKET_DIR, EVENTS_REPLAY_SIZE)
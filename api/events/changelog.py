@@ -0,0 +1,21 @@
+import datetime
+from api.events.tracking import flush_handler
+from api.models.change_log import ChangeLog
+
+
+@flush_handler
+def write_change_log(session, changes):
+    now = datetime.datetime.utcnow()
+    rows = [
+        {
+            "iduser": change.iduser,
+            "entity": change.entity,
+            "entity_id": change.id,
+            "op": change.op,
+            "created_at": now,
+        }
+        for change in changes
+        if change.iduser is not None
+    ]
+    if rows:
+        session.execute(ChangeLog.__table__.insert(), rows)
@@ -0,0 +1,42 @@
+import collections
+from sqlalchemy import bindparam, update
+from api.events.tracking import flush_handler
+from api.models.concept_count import ConceptCount
+from api.services.upsert import upsert_add_all
+from api.utils.text import normalize_concept
+
+
+@flush_handler
+def count_concepts(session, changes):
+    """Add up the flush's changes per concept, then one statement per direction."""
+    table = ConceptCount.__table__
+    added = {}
+    removed = collections.Counter()
+    for change in changes:
+        if change.entity != "expense" or change.iduser is None:
+            continue
+        old_key = normalize_concept(change.old["concept"]) if change.old else None
+        new_key = normalize_concept(change.new["concept"]) if change.new else None
+
+        if old_key and old_key != new_key:
+            removed[(change.iduser, old_key)] += 1
+        if new_key:
+            row = added.setdefault(
+                (change.iduser, new_key),
+                {"iduser": change.iduser, "concept_key": new_key, "count": 0, "last_used": None},
+            )
+            row["count"] += 1 if new_key != old_key else 0
+            row["concept"] = change.new["concept"].strip()[:255]
+            if change.new["date"] and (row["last_used"] is None or change.new["date"] > row["last_used"]):
+                row["last_used"] = change.new["date"]
+
+    if removed:
+        session.execute(
+            update(table)
+            .where(table.c.iduser == bindparam("b_iduser"), table.c.concept_key == bindparam("b_key"))
+            .values(count=table.c.count - bindparam("b_count")),
+            [{"b_iduser": iduser, "b_key": key, "b_count": count} for (iduser, key), count in sorted(removed.items())],
+        )
+    upsert_add_all(
+        session, table, [added[key] for key in sorted(added)], ["iduser", "concept_key"], ["count"], ["concept"], ["last_used"]
+    )
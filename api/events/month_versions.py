@@ -0,0 +1,29 @@
+from api.events.tracking import flush_handler
+from api.models.month_version import MonthVersion
+from api.services.upsert import upsert_add_all
+
+# Month of the category and payment method names
+NAMES = ""
+
+
+@flush_handler
+def bump_month_versions(session, changes):
+    months = set()
+    for change in changes:
+        if change.iduser is None:
+            continue
+        if change.entity != "expense":
+            months.add((change.iduser, NAMES))
+            continue
+        # Moving an expense to another month changes both statements
+        for values in (change.old, change.new):
+            if values and values.get("date"):
+                months.add((change.iduser, str(values["date"])[:7]))
+
+    upsert_add_all(
+        session,
+        MonthVersion.__table__,
+        [{"iduser": iduser, "month": month, "version": 1} for iduser, month in sorted(months)],
+        ["iduser", "month"],
+        ["version"],
+    )
@@ -0,0 +1,33 @@
+import collections
+from sqlalchemy import bindparam, update
+from api.analytics.suggest import contributions
+from api.events.tracking import flush_handler
+from api.models.suggestion_count import SuggestionCount
+from api.services.upsert import upsert_add_all
+
+KEYS = ("iduser", "target", "label", "token")
+
+
+@flush_handler
+def count_suggestion_tokens(session, changes):
+    """Add up the flush's token deltas, then one statement per direction."""
+    table = SuggestionCount.__table__
+    deltas = collections.Counter()
+    for change in changes:
+        if change.entity != "expense" or change.iduser is None:
+            continue
+        for (target, label, token), delta in contributions(change.old, change.new).items():
+            deltas[(change.iduser, target, label, token)] += delta
+
+    rows = sorted((key, delta) for key, delta in deltas.items() if delta)
+    upsert_add_all(
+        session, table, [dict(zip(KEYS, key), count=delta) for key, delta in rows if delta > 0], KEYS, ["count"]
+    )
+    decrements = [dict(zip(["b_" + name for name in KEYS], key), b_delta=delta) for key, delta in rows if delta < 0]
+    if decrements:
+        session.execute(
+            update(table)
+            .where(*(table.c[name] == bindparam("b_" + name) for name in KEYS))
+            .values(count=table.c.count + bindparam("b_delta")),
+            decrements,
+        )
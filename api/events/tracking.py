@@ -0,0 +1,173 @@
+import collections
+import datetime
+import decimal
+from sqlalchemy import event, inspect
+from sqlalchemy.orm import Session
+from api.events.bus import bus
+from api.events.versions import counts_by_user, versions
+
+# Modelos cuyos cambios se publican, por nombre de tabla
+TRACKED_TABLES = ("expense", "category", "payment_method")
+
+# Campos de Expense que viajan en el evento (los usan las caches)
+EXPENSE_FIELDS = ("concept", "amount", "date", "idcategory", "idpayment")
+
+Change = collections.namedtuple("Change", "entity op id iduser old new")
+
+_flush_handlers = []
+
+
+def flush_handler(f):
+    """
+    Register f(session, changes), run inside the flush that wrote them.
+
+    Used to keep derived tables in the same transaction as the change.
+    """
+    _flush_handlers.append(f)
+    return f
+
+
+def record_changes(session, changes, published=None):
+    """
+    Run the flush handlers and queue the events for after the commit.
+
+    after_flush calls this for ORM writes; bulk INSERT/UPDATE/DELETE
+    statements, which bypass the unit of work, must call it themselves.
+    `published` replaces the changes on the bus, e.g. one "imported" change
+    for a whole chunk of inserted rows.
+    """
+    for handler in _flush_handlers:
+        handler(session, changes)
+    published = changes if published is None else published
+    session.info.setdefault("pending_changes", []).extend(published)
+    # Announced before the commit, so no cache stores a load taken meanwhile
+    started = counts_by_user(published)
+    versions.start(started)
+    session.info.setdefault("started_versions", collections.Counter()).update(started)
+
+
+def hold_changes(session):
+    """Keep events queued past commit() until publish_held() or discard_held()."""
+    session.info["hold_changes"] = True
+
+
+def publish_held(session):
+    session.info.pop("hold_changes", None)
+    _publish(session.info.pop("pending_changes", []), session.info.pop("started_versions", None))
+
+
+def discard_held(session):
+    session.info.pop("hold_changes", None)
+    session.info.pop("pending_changes", None)
+    _publish([], session.info.pop("started_versions", None))
+
+
+def fields(obj, entity):
+    if entity != "expense":
+        return {}
+    return {name: getattr(obj, name) for name in EXPENSE_FIELDS}
+
+
+def previous_fields(obj, entity):
+    if entity != "expense":
+        return {}
+    state = inspect(obj)
+    previous = {}
+    for name in EXPENSE_FIELDS:
+        history = state.attrs[name].history
+        previous[name] = history.deleted[0] if history.deleted else getattr(obj, name)
+    return previous
+
+
+def is_soft_deleted(obj):
+    history = inspect(obj).attrs.is_delete.history if hasattr(obj, "is_delete") else None
+    return bool(history and history.added and history.added[0])
+
+
+@event.listens_for(Session, "after_flush")
+def collect_changes(session, flush_context):
+    changes = []
+    for obj in session.new:
+        entity = getattr(obj, "__tablename__", None)
+        if entity in TRACKED_TABLES:
+            changes.append(Change(entity, "created", obj.id, obj.iduser, None, fields(obj, entity)))
+    for obj in session.dirty:
+        entity = getattr(obj, "__tablename__", None)
+        if entity in TRACKED_TABLES and session.is_modified(obj, include_collections=False):
+            op = "deleted" if is_soft_deleted(obj) else "updated"
+            changes.append(Change(entity, op, obj.id, obj.iduser, previous_fields(obj, entity), fields(obj, entity)))
+    for obj in session.deleted:
+        entity = getattr(obj, "__tablename__", None)
+        if entity in TRACKED_TABLES:
+            changes.append(Change(entity, "deleted", obj.id, obj.iduser, fields(obj, entity), None))
+    if changes:
+        record_changes(session, changes)
+
+
+@event.listens_for(Session, "after_transaction_create")
+def mark_savepoint(session, transaction):
+    if transaction.nested:
+        marks = session.info.setdefault("change_marks", {})
+        marks[transaction] = len(session.info.get("pending_changes", ()))
+
+
+@event.listens_for(Session, "after_soft_rollback")
+def forget_changes(session, previous_transaction):
+    mark = session.info.get("change_marks", {}).pop(previous_transaction, None)
+    if previous_transaction.nested:
+        # Only the rows written since the SAVEPOINT are gone
+        if mark is not None and "pending_changes" in session.info:
+            del session.info["pending_changes"][mark:]
+    else:
+        session.info.pop("pending_changes", None)
+        session.info.pop("change_marks", None)
+
+
+@event.listens_for(Session, "after_commit")
+def publish_changes(session):
+    if session.in_nested_transaction():
+        # Releasing a SAVEPOINT, the outer transaction can still roll back
+        return
+    session.info.pop("change_marks", None)
+    if not session.info.get("hold_changes"):
+        _publish(session.info.pop("pending_changes", []), session.info.pop("started_versions", None))
+
+
+@event.listens_for(Session, "after_transaction_end")
+def finish_rolled_back(session, transaction):
+    # Rollback or close: the announced writes end without events, which
+    # leaves a gap that makes the caches of those users reload
+    if transaction.parent is None and not session.info.get("hold_changes"):
+        session.info.pop("pending_changes", None)
+        _publish([], session.info.pop("started_versions", None))
+
+
+def _publish(changes, started):
+    first = versions.finish(started) if started else {}
+    taken = collections.Counter()
+    for change in changes:
+        version = None
+        if change.iduser is not None:
+            version = first[change.iduser] + taken[change.iduser]
+            taken[change.iduser] += 1
+        bus.publish(as_event(change, version))
+
+
+def as_event(change, version=None):
+    event = {"entity": change.entity, "op": change.op, "id": change.id, "iduser": change.iduser}
+    if version is not None:
+        event["version"] = version
+    values = change.new if change.new is not None else change.old
+    if values:
+        event["fields"] = {name: _json_value(value) for name, value in values.items()}
+    if change.old and change.new:
+        event["previous"] = {name: _json_value(value) for name, value in change.old.items()}
+    return event
+
+
+def _json_value(value):
+    if isinstance(value, decimal.Decimal):
+        return float(value)
+    if isinstance(value, (datetime.date, datetime.datetime)):
+        return value.isoformat()
+    return value
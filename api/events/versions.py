@@ -0,0 +1,148 @@
+import collections
+import fcntl
+import mmap
+import os
+import struct
+import tempfile
+import threading
+import time
+from decouple import config
+
+EVENTS_VERSIONS_PATH = config(
+    "EVENTS_VERSIONS_PATH",
+    default=os.path.join("/dev/shm" if os.path.isdir("/dev/shm") else tempfile.gettempdir(), "finanzcord-versions"),
+)
+EVENTS_VERSION_SLOTS = config("EVENTS_VERSION_SLOTS", default=65536, cast=int)
+# A write that started this long ago and never finished belonged to a dead process
+EVENTS_VERSION_ABANDON_SECONDS = config("EVENTS_VERSION_ABANDON_SECONDS", default=60.0, cast=float)
+
+
+class UserVersions:
+    """
+    Per-user write counters in a file-backed mmap shared by every worker.
+
+    A transaction that touches a user adds to `started` when it flushes and
+    to `finished` once it committed or rolled back; the committed events are
+    numbered with the finished values they took. The per-worker caches keep
+    the finished version their data reflects and compare it here before
+    serving, so an event that never reached a worker makes it reload instead
+    of serving stale data. Users share a slot when iduser collides modulo the
+    slot count, which only costs extra reloads.
+    """
+
+    SLOT = struct.Struct("=QQd")
+
+    def __init__(self, path, slots):
+        self.path = path
+        self.slots = slots
+        self._lock = threading.Lock()
+        self._fd = None
+        self._map = None
+
+    def _open(self):
+        size = self.slots * self.SLOT.size
+        fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o600)
+        if os.fstat(fd).st_size < size:
+            os.ftruncate(fd, size)
+        self._map = mmap.mmap(fd, size)
+        self._fd = fd
+
+    def read(self, iduser):
+        """(started, finished) of the user; equal when no write is in flight."""
+        with self._lock:
+            if self._map is None:
+                self._open()
+            started, finished, updated = self.SLOT.unpack_from(self._map, self._offset(iduser))
+        if started != finished and time.time() - updated > EVENTS_VERSION_ABANDON_SECONDS:
+            return self._abandon(iduser)
+        return started, finished
+
+    def version(self, iduser):
+        return self.read(iduser)[1]
+
+    def start(self, counts):
+        """Announce writes about to commit, as {iduser: number of changes}."""
+        self._update(counts, started=True)
+
+    def finish(self, counts):
+        """
+        Close writes announced by start(); returns {iduser: first version}.
+
+        A user's n changes take the versions first .. first + n - 1.
+        """
+        return self._update(counts, started=False)
+
+    def _update(self, counts, started):
+        first = {}
+        with self._lock:
+            if self._map is None:
+                self._open()
+            fcntl.lockf(self._fd, fcntl.LOCK_EX)
+            try:
+                now = time.time()
+                for iduser, count in counts.items():
+                    offset = self._offset(iduser)
+                    slot_started, slot_finished, updated = self.SLOT.unpack_from(self._map, offset)
+                    if started:
+                        slot_started += count
+                        updated = now
+                    else:
+                        first[iduser] = slot_finished + 1
+                        # Never past started, in case it was abandoned meanwhile
+                        slot_finished = min(slot_finished + count, slot_started)
+                    self.SLOT.pack_into(self._map, offset, slot_started, slot_finished, updated)
+            finally:
+                fcntl.lockf(self._fd, fcntl.LOCK_UN)
+        return first
+
+    def _abandon(self, iduser):
+        with self._lock:
+            fcntl.lockf(self._fd, fcntl.LOCK_EX)
+            try:
+                offset = self._offset(iduser)
+                started, finished, updated = self.SLOT.unpack_from(self._map, offset)
+                if started != finished and time.time() - updated > EVENTS_VERSION_ABANDON_SECONDS:
+                    finished = started
+                    self.SLOT.pack_into(self._map, offset, started, finished, updated)
+            finally:
+                fcntl.lockf(self._fd, fcntl.LOCK_UN)
+        return started, finished
+
+    def _offset(self, iduser):
+        return (iduser % self.slots) * self.SLOT.size
+
+
+versions = UserVersions(EVENTS_VERSIONS_PATH, EVENTS_VERSION_SLOTS)
+
+
+def counts_by_user(changes):
+    return collections.Counter(change.iduser for change in changes if change.iduser is not None)
+
+
+def load_at_version(iduser, load):
+    """
+    (load(), version it reflects), or (load(), None) if a write was in flight.
+
+    Only a load with no write of the user in flight around it may be cached,
+    so a change can't be both in the loaded rows and applied again from its
+    event.
+    """
+    before = versions.read(iduser)
+    value = load()
+    if before[0] != before[1] or versions.read(iduser) != before:
+        return value, None
+    return value, before[1]
+
+
+def event_fits(version, event):
+    """
+    How a cache entry at `version` takes an event: "apply" when it is the
+    next one, "skip" when the entry already reflects it, "drop" on a gap
+    (an event went missing or arrived out of order; reload on next use) or
+    on an "imported" event, which only lists the ids of the inserted rows.
+    """
+    if event.get("version") is None or event["version"] <= version:
+        return "skip"
+    if event["op"] == "imported":
+        return "drop"
+    return "apply" if event["version"] == version + 1 else "drop"
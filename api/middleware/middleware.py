@@ -1,5 +1,7 @@
-from flask import request, jsonify
+from flask import request, jsonify, g
 from app import app
+from api.models.user import User
+from api.services.shard_directory import bind_shard
 import jwt
 from functools import wraps
 from flask_cors import CORS, cross_origin
@@ -11,13 +13,16 @@ def jwt_required(f):
     @cross_origin()
     @wraps(f)
     def decorated(*args, **kwargs):
+        # Las sub-peticiones de un batch usan el token que ya verifico el batch
+        if 'batch_token' in g:
+            return f(g.batch_token, *args, **kwargs)
+
         token = request.headers.get('Authorization')
 
         if not token:
             return jsonify({'message': 'Token faltante'}), 401
 
         token = token.split(" ")[1]
-        print(token)
         try:
             data = jwt.decode(token, SECRET_KEY, algorithms=['HS256'])  # Corrige esta línea
         except jwt.ExpiredSignatureError:
@@ -25,6 +30,21 @@ def jwt_required(f):
         except jwt.InvalidTokenError:
             return jsonify({'message': 'Token inválido'}), 401
 
+        g.token_data = data
+        # Las tablas por usuario se leen del shard del usuario
+        if not bind_shard(data.get('email')):
+            return jsonify({'message': 'Usuario en mantenimiento, intente de nuevo en unos segundos'}), 503
         return f(data, *args, **kwargs)
 
     return decorated
+
+
+def current_user():
+    """
+    User owning the request's token, looked up once per request.
+
+    Only valid inside a view protected by @jwt_required.
+    """
+    if "current_user" not in g:
+        g.current_user = User.query.filter_by(email=g.token_data['email']).first()
+    return g.current_user
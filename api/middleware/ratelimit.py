@@ -0,0 +1,164 @@
+import fcntl
+import hashlib
+import math
+import mmap
+import os
+import struct
+import tempfile
+import threading
+import time
+from functools import wraps
+from flask import request, jsonify, make_response
+from decouple import config
+
+RATELIMIT_ENABLED = config("RATELIMIT_ENABLED", default=True, cast=bool)
+RATELIMIT_REDIS_URL = config("RATELIMIT_REDIS_URL", default="")
+RATELIMIT_SHM_PATH = config(
+    "RATELIMIT_SHM_PATH",
+    default=os.path.join("/dev/shm" if os.path.isdir("/dev/shm") else tempfile.gettempdir(), "finanzcord-ratelimit"),
+)
+RATELIMIT_SLOTS = config("RATELIMIT_SLOTS", default=8192, cast=int)
+
+
+class SharedMemoryStore:
+    """
+    Token buckets in a file-backed mmap shared by every worker on the host.
+
+    The file is a fixed open-addressing table of (key hash, tokens, updated)
+    slots. A full probe window evicts its least recently updated bucket,
+    which at worst hands a forgotten client a fresh bucket.
+    """
+
+    SLOT = struct.Struct("=Qdd")
+    PROBE = 8
+
+    def __init__(self, path, slots):
+        self.path = path
+        self.slots = slots
+        self._lock = threading.Lock()
+        self._fd = None
+        self._map = None
+
+    def _open(self):
+        size = self.slots * self.SLOT.size
+        fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o600)
+        if os.fstat(fd).st_size < size:
+            os.ftruncate(fd, size)
+        self._map = mmap.mmap(fd, size)
+        self._fd = fd
+
+    def consume(self, key, rate, burst, now):
+        """Take one token from key's bucket; returns (allowed, tokens left)."""
+        key_hash = int.from_bytes(hashlib.blake2b(key.encode(), digest_size=8).digest(), "little") or 1
+        # lockf() excludes other processes, the thread lock excludes our own threads
+        with self._lock:
+            if self._map is None:
+                self._open()
+            fcntl.lockf(self._fd, fcntl.LOCK_EX)
+            try:
+                offset = self._find(key_hash)
+                stored_hash, tokens, updated = self.SLOT.unpack_from(self._map, offset)
+                if stored_hash != key_hash:
+                    tokens, updated = burst, now
+                tokens = min(burst, tokens + max(0.0, now - updated) * rate)
+                allowed = tokens >= 1
+                if allowed:
+                    tokens -= 1
+                self.SLOT.pack_into(self._map, offset, key_hash, tokens, now)
+            finally:
+                fcntl.lockf(self._fd, fcntl.LOCK_UN)
+        return allowed, tokens
+
+    def _find(self, key_hash):
+        oldest_offset, oldest_updated = None, None
+        for probe in range(self.PROBE):
+            offset = ((key_hash + probe) % self.slots) * self.SLOT.size
+            stored_hash, _, updated = self.SLOT.unpack_from(self._map, offset)
+            if stored_hash == key_hash or stored_hash == 0:
+                return offset
+            if oldest_updated is None or updated < oldest_updated:
+                oldest_offset, oldest_updated = offset, updated
+        return oldest_offset
+
+
+class RedisStore:
+    """Same buckets kept in Redis (or anything speaking its protocol)."""
+
+    SCRIPT = """
+    local rate, burst, now = tonumber(ARGV[1]), tonumber(ARGV[2]), tonumber(ARGV[3])
+    local bucket = redis.call('HMGET', KEYS[1], 'tokens', 'updated')
+    local tokens = tonumber(bucket[1]) or burst
+    local updated = tonumber(bucket[2]) or now
+    tokens = math.min(burst, tokens + math.max(0, now - updated) * rate)
+    local allowed = 0
+    if tokens >= 1 then
+        tokens = tokens - 1
+        allowed = 1
+    end
+    redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'updated', tostring(now))
+    redis.call('PEXPIRE', KEYS[1], math.ceil(burst / rate * 1000))
+    return {allowed, tostring(tokens)}
+    """
+
+    def __init__(self, url):
+        import redis
+
+        self._script = redis.Redis.from_url(url).register_script(self.SCRIPT)
+
+    def consume(self, key, rate, burst, now):
+        allowed, tokens = self._script(keys=["ratelimit:" + key], args=[rate, burst, now])
+        return bool(allowed), float(tokens)
+
+
+if RATELIMIT_REDIS_URL:
+    store = RedisStore(RATELIMIT_REDIS_URL)
+else:
+    store = SharedMemoryStore(RATELIMIT_SHM_PATH, RATELIMIT_SLOTS)
+
+
+def rate_limit(per_user=None, per_ip=None):
+    """
+    Token-bucket limits for a route, as (tokens per second, burst) pairs.
+
+    Goes below @jwt_required, so the user key comes from the decoded token
+    without touching the database. Every response carries RateLimit-*
+    headers for the tightest bucket; rejected ones get 429 and Retry-After.
+    """
+    def decorator(f):
+        @wraps(f)
+        def decorated(data, *args, **kwargs):
+            if not RATELIMIT_ENABLED:
+                return f(data, *args, **kwargs)
+
+            now = time.time()
+            limits = []
+            if per_user:
+                limits.append(("user:" + str(data.get("email")),) + tuple(per_user))
+            if per_ip:
+                limits.append(("ip:" + str(request.remote_addr),) + tuple(per_ip))
+
+            tightest = None
+            for key, rate, burst in limits:
+                allowed, tokens = store.consume(f.__name__ + ":" + key, rate, burst, now)
+                if tightest is None or not allowed or (tightest[0] and tokens < tightest[1]):
+                    tightest = (allowed, tokens, rate, burst)
+                if not allowed:
+                    break
+
+            if tightest is None:
+                return f(data, *args, **kwargs)
+
+            allowed, tokens, rate, burst = tightest
+            if allowed:
+                response = make_response(f(data, *args, **kwargs))
+            else:
+                response = make_response(jsonify({"error": "Too many requests"}), 429)
+                response.headers["Retry-After"] = str(math.ceil((1 - tokens) / rate))
+            response.headers["RateLimit-Limit"] = str(int(burst))
+            response.headers["RateLimit-Remaining"] = str(int(tokens))
+            response.headers["RateLimit-Reset"] = str(math.ceil((burst - tokens) / rate))
+            return response
+
+        return decorated
+
+    return decorator
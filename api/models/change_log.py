@@ -0,0 +1,19 @@
+from app import db
+import datetime
+
+class ChangeLog(db.Model):
+    """
+    One row per write to an expense, category or payment method.
+
+    seq is the monotonic cursor behind /sync; rows are written by
+    api/events/changelog.py in the same transaction as the change.
+    """
+    __tablename__ = "change_log"
+    __table_args__ = (db.Index("ix_change_log_iduser_seq", "iduser", "seq"),)
+
+    seq = db.Column(db.BigInteger().with_variant(db.Integer, "sqlite"), primary_key=True, autoincrement=True)
+    iduser = db.Column(db.Integer, nullable=False)
+    entity = db.Column(db.String(20), nullable=False)
+    entity_id = db.Column(db.Integer, nullable=False)
+    op = db.Column(db.String(10), nullable=False)
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.datetime.utcnow)
@@ -0,0 +1,12 @@
+from app import db
+
+class ConceptCount(db.Model):
+    """How many expenses of a user carry each (normalized) concept."""
+    __tablename__ = "concept_count"
+    __table_args__ = (db.Index("ix_concept_count_iduser_count", "iduser", "count"),)
+
+    iduser = db.Column(db.Integer, primary_key=True)
+    concept_key = db.Column(db.String(255), primary_key=True)
+    concept = db.Column(db.String(255), nullable=False)
+    count = db.Column(db.Integer, nullable=False, default=0)
+    last_used = db.Column(db.Date)
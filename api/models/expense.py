@@ -1,14 +1,70 @@
+from sqlalchemy import event
 from app import db
+from api.utils import geohash
+from api.utils.money import Cents, from_cents, to_cents
+from api.utils.text import normalize_concept
+import datetime
+import hashlib
 
 class Expense(db.Model):
+    # La tabla se particiona por RANGE COLUMNS(date) en MySQL, ver
+    # api/commands/partitions.py; (iduser, date) es el acceso de los listados
+    # y amount al final cubre los rankings por monto.
+    # amount se guarda en centavos (BIGINT, columna amount_cents) y se lee como
+    # Decimal, ver api/utils/money.py y api/commands/amounts.py
+    # (iduser, geocell) sirve las búsquedas por cercanía, ver api/utils/geohash.py
+    # (iduser, fingerprint) encuentra los gastos repetidos
+    __table_args__ = (
+        db.Index("ix_expense_iduser_date_amount", "iduser", "date", "amount_cents"),
+        db.Index("ix_expense_iduser_geocell", "iduser", "geocell"),
+        db.Index("ix_expense_iduser_fingerprint", "iduser", "fingerprint"),
+    )
+
     id = db.Column(db.Integer, primary_key=True)
     concept = db.Column(db.String(255), nullable=False)
     idcategory = db.Column(db.Integer)
-    amount = db.Column(db.DECIMAL(10, 2), nullable=False)
+    amount = db.Column("amount_cents", Cents, nullable=False)
     description = db.Column(db.Text)
     created_at = db.Column(db.TIMESTAMP, server_default=db.func.current_timestamp())
     updated_at = db.Column(db.TIMESTAMP, server_default=db.func.current_timestamp(), server_onupdate=db.func.current_timestamp())
-    date = db.Column(db.Date)
+    date = db.Column(db.Date, default=datetime.date.today)
     idpayment = db.Column(db.Integer)
     priority = db.Column(db.Integer)
-    iduser = db.Column(db.Integer, db.ForeignKey('user.id'))
\ No newline at end of file
+    iduser = db.Column(db.Integer, db.ForeignKey('user.id'))
+    latitude = db.Column(db.Float)
+    longitude = db.Column(db.Float)
+    geocell = db.Column(db.String(geohash.PRECISION))
+    # Hash de concepto normalizado, monto, fecha y metodo de pago, ver fingerprint()
+    fingerprint = db.Column(db.String(16))
+    # Sube en cada UPDATE; PATCH y el ORM solo escriben sobre la version leida
+    version = db.Column(db.Integer, nullable=False, default=1, server_default="1")
+
+    __mapper_args__ = {"version_id_col": version}
+
+
+@event.listens_for(Expense, "before_insert")
+@event.listens_for(Expense, "before_update")
+def set_geocell(mapper, connection, expense):
+    if expense.latitude is None or expense.longitude is None:
+        expense.geocell = None
+    else:
+        expense.geocell = geohash.encode(expense.latitude, expense.longitude)
+
+
+def fingerprint(concept, amount, date, idpayment):
+    """
+    Same value for expenses that only differ in the concept's case, accents
+    or spacing, or in how the amount was written (12.5 vs "12.50").
+    """
+    if amount is None or date is None:
+        return None
+    # Same rounding as the stored value, written as before ("12.50")
+    amount = from_cents(to_cents(amount))
+    text = "%s|%s|%s|%s" % (normalize_concept(concept), amount, date, "" if idpayment is None else idpayment)
+    return hashlib.blake2b(text.encode("utf-8"), digest_size=8).hexdigest()
+
+
+@event.listens_for(Expense, "before_insert")
+@event.listens_for(Expense, "before_update")
+def set_fingerprint(mapper, connection, expense):
+    expense.fingerprint = fingerprint(expense.concept, expense.amount, expense.date, expense.idpayment)
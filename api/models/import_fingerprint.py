@@ -0,0 +1,14 @@
+from app import db
+
+class ImportFingerprint(db.Model):
+    """
+    Hash of every imported statement line, so re-imports skip them.
+
+    The primary key is the lookup: fixed-length hashes per user, checked a
+    whole chunk of lines at a time.
+    """
+    __tablename__ = "import_fingerprint"
+
+    iduser = db.Column(db.Integer, primary_key=True)
+    fingerprint = db.Column(db.String(32), primary_key=True)
+    idexpense = db.Column(db.Integer)
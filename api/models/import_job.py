@@ -0,0 +1,28 @@
+from app import db
+import datetime
+
+class ImportJob(db.Model):
+    """One uploaded statement file and how far its import got."""
+    __tablename__ = "import_job"
+    __table_args__ = (db.Index("ix_import_job_iduser_id", "iduser", "id"),)
+
+    id = db.Column(db.Integer, primary_key=True)
+    iduser = db.Column(db.Integer, nullable=False)
+    idpayment = db.Column(db.Integer, nullable=False)
+    filename = db.Column(db.String(255))
+    format = db.Column(db.String(10), nullable=False)
+    # queued, running, done, failed
+    status = db.Column(db.String(10), nullable=False, default="queued")
+    rows_read = db.Column(db.Integer, nullable=False, default=0)
+    inserted = db.Column(db.Integer, nullable=False, default=0)
+    duplicates = db.Column(db.Integer, nullable=False, default=0)
+    skipped = db.Column(db.Integer, nullable=False, default=0)
+    failed = db.Column(db.Integer, nullable=False, default=0)
+    # JSON list of the first row errors, or the message that stopped the job
+    errors = db.Column(db.Text)
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.datetime.utcnow)
+    # Process running it (host:pid) and when it last made progress, so the
+    # jobs of a worker that died are resumed, see Importer.resume_orphaned
+    worker = db.Column(db.String(128))
+    updated_at = db.Column(db.DateTime)
+    finished_at = db.Column(db.DateTime)
@@ -0,0 +1,16 @@
+from app import db
+import datetime
+
+class ImportMapping(db.Model):
+    """
+    How a payment method's CSV statements map to expense fields.
+
+    mapping is the JSON written by PUT /import/mapping/<idpayment>, see
+    api/services/imports.py for its keys.
+    """
+    __tablename__ = "import_mapping"
+
+    idpayment = db.Column(db.Integer, primary_key=True)
+    iduser = db.Column(db.Integer, nullable=False)
+    mapping = db.Column(db.Text, nullable=False)
+    updated_at = db.Column(db.DateTime, nullable=False, default=datetime.datetime.utcnow, onupdate=datetime.datetime.utcnow)
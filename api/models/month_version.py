@@ -0,0 +1,14 @@
+from app import db
+
+class MonthVersion(db.Model):
+    """
+    Write counter per user and month ("YYYY-MM") of expenses.
+
+    The empty month counts category and payment method changes, which show
+    up in every month's statement. Bumped by api/events/month_versions.py.
+    """
+    __tablename__ = "month_version"
+
+    iduser = db.Column(db.Integer, primary_key=True)
+    month = db.Column(db.String(7), primary_key=True)
+    version = db.Column(db.Integer, nullable=False, default=0)
@@ -7,4 +7,8 @@ class PaymentMethod(db.Model):
     created_at = db.Column(db.TIMESTAMP, server_default=db.func.current_timestamp())
     updated_at = db.Column(db.TIMESTAMP, server_default=db.func.current_timestamp(), server_onupdate=db.func.current_timestamp())
     iduser = db.Column(db.Integer, db.ForeignKey('user.id'))
-    is_delete = db.Column(db.Integer)
\ No newline at end of file
+    is_delete = db.Column(db.Integer)
+    # Sube en cada UPDATE; PATCH y el ORM solo escriben sobre la version leida
+    version = db.Column(db.Integer, nullable=False, default=1, server_default="1")
+
+    __mapper_args__ = {"version_id_col": version}
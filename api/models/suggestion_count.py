@@ -0,0 +1,16 @@
+from app import db
+
+class SuggestionCount(db.Model):
+    """
+    Naive Bayes counts behind the category/payment suggestions.
+
+    One row per (user, target, label, token); the empty token holds how many
+    expenses carry the label.
+    """
+    __tablename__ = "suggestion_count"
+
+    iduser = db.Column(db.Integer, primary_key=True)
+    target = db.Column(db.String(16), primary_key=True)
+    label = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    token = db.Column(db.String(64), primary_key=True)
+    count = db.Column(db.Integer, nullable=False, default=0)
@@ -1,6 +1,12 @@
 from app import db
 
 class User(db.Model):
+    # Directorio de usuarios: busqueda por prefijo y paginacion por (campo, id)
+    __table_args__ = (
+        db.Index("ix_user_is_delete_email", "is_delete", "email", "id"),
+        db.Index("ix_user_is_delete_name", "is_delete", "name", "id"),
+    )
+
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(60))
     password = db.Column(db.String(128))
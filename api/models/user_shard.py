@@ -0,0 +1,14 @@
+from app import db
+
+class UserShard(db.Model):
+    """
+    Directory of which shard holds each user's rows.
+
+    Users without a row live in the main database ("default"). moving is set
+    by 'flask shards move' while the rows are being copied.
+    """
+    __tablename__ = "user_shard"
+
+    iduser = db.Column(db.Integer, db.ForeignKey('user.id'), primary_key=True, autoincrement=False)
+    shard = db.Column(db.String(32), nullable=False)
+    moving = db.Column(db.Boolean, nullable=False, default=False)
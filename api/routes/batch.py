@@ -0,0 +1,229 @@
+import json
+import time
+from flask import Blueprint, request, jsonify, g
+from sqlalchemy.orm import Session
+from werkzeug.test import EnvironBuilder
+from decouple import config
+from app import app, db
+from api.middleware.middleware import jwt_required
+from api.events.tracking import hold_changes, publish_held, discard_held
+from api.models.user import User
+from api.services.sharding import current_shard
+from api.services.shard_directory import shard_engine
+
+batch_bp = Blueprint("batch", __name__)
+
+BATCH_MAX_REQUESTS = config("BATCH_MAX_REQUESTS", default=20, cast=int)
+BATCH_MAX_SECONDS = config("BATCH_MAX_SECONDS", default=5.0, cast=float)
+BATCH_METHODS = ("GET", "POST", "PUT", "PATCH", "DELETE")
+# Endpoints that stream their response or run in the background
+BATCH_STREAMING_PATHS = ("/events", "/expense/export", "/report", "/import")
+# Set by the before_request hooks, put back after each sub-request so the
+# batch's own log line and statement limit stay its own
+REQUEST_G_FIELDS = ("request_id", "request_started", "query_count", "log_sampled", "statement_timeout_ms")
+
+
+@batch_bp.route("/", methods=["POST"], strict_slashes=False)
+@jwt_required
+def run_batch(data):
+    """
+    Run several requests in one round trip
+    ---
+    parameters:
+      - name: data
+        in: body
+        required: true
+        description: Sub-requests to run, in order.
+        schema:
+          type: object
+          properties:
+            atomic:
+              type: boolean
+              description: Run every sub-request in one transaction, rolled back if any fails.
+            requests:
+              type: array
+              items:
+                type: object
+                properties:
+                  method:
+                    type: string
+                    description: HTTP method.
+                  path:
+                    type: string
+                    description: Path of the sub-request, e.g. /expense/12.
+                  body:
+                    type: object
+                    description: JSON body of the sub-request.
+
+    responses:
+      200:
+        description: One response per sub-request, in the same order.
+        schema:
+          type: object
+          properties:
+            responses:
+              type: array
+              items:
+                type: object
+                properties:
+                  status:
+                    type: integer
+                    description: HTTP status of the sub-request.
+                  body:
+                    type: object
+                    description: JSON body of the sub-request response.
+            committed:
+              type: boolean
+              description: Only for atomic batches, whether the transaction was committed.
+      400:
+        description: Bad request.
+        schema:
+          type: object
+          properties:
+            error:
+              type: string
+              description: Error message.
+    """
+    payload = request.get_json(silent=True) or {}
+    sub_requests = payload.get("requests")
+    atomic = bool(payload.get("atomic"))
+
+    if not isinstance(sub_requests, list) or not sub_requests:
+        return jsonify({"error": "requests must be a non-empty array"}), 400
+    if len(sub_requests) > BATCH_MAX_REQUESTS:
+        return jsonify({"error": "A batch can hold at most %d requests" % BATCH_MAX_REQUESTS}), 400
+    for sub_request in sub_requests:
+        error = validate_sub_request(sub_request)
+        if error:
+            return jsonify({"error": error}), 400
+
+    # One token check per batch: @jwt_required takes this one in sub-requests
+    g.batch_token = data
+    if atomic:
+        responses, committed = run_atomic(sub_requests)
+        return jsonify({"responses": responses, "committed": committed}), 200
+
+    responses = run_each(sub_requests, atomic=False)
+    return jsonify({"responses": responses}), 200
+
+
+def validate_sub_request(sub_request):
+    if not isinstance(sub_request, dict):
+        return "Every request must be an object"
+    if str(sub_request.get("method", "GET")).upper() not in BATCH_METHODS:
+        return "Unsupported method: %s" % sub_request.get("method")
+    path = sub_request.get("path")
+    if not isinstance(path, str) or not path.startswith("/"):
+        return "Every request needs an absolute path"
+    path = path.split("?")[0].rstrip("/")
+    if path == request.path.rstrip("/"):
+        return "Batches can't be nested"
+    if any(path == prefix or path.startswith(prefix + "/") for prefix in BATCH_STREAMING_PATHS):
+        return "Streaming endpoints can't be batched: %s" % path
+    return None
+
+
+def run_each(sub_requests, atomic):
+    """
+    Dispatch the sub-requests in order inside the current app context.
+
+    They all share the caller's scoped session and g, so the token verified
+    for the batch and the user resolved by current_user() are reused.
+    Outside a transaction a failed sub-request is rolled back on its own;
+    inside one, the remaining sub-requests are skipped with 424.
+    """
+    deadline = time.monotonic() + BATCH_MAX_SECONDS
+    headers = {"Authorization": request.headers.get("Authorization")}
+    responses = []
+    failed = False
+    for sub_request in sub_requests:
+        if failed:
+            responses.append({"status": 424, "body": {"error": "Skipped, an earlier request failed"}})
+            continue
+        status, body = dispatch(sub_request, headers, deadline)
+        if status >= 400:
+            if atomic:
+                failed = True
+            else:
+                db.session.rollback()
+        responses.append({"status": status, "body": body})
+    return responses
+
+
+def run_atomic(sub_requests):
+    """
+    Run every sub-request on one connection inside one transaction.
+
+    The handlers' own commit() calls only release SAVEPOINTs
+    (join_transaction_mode="create_savepoint"); the outer transaction is
+    committed once at the end, or rolled back if any sub-request failed.
+    """
+    engine = shard_engine(current_shard())
+    connection = engine.connect()
+    transaction = connection.begin()
+    # On a shard the transaction only covers the per-user tables, the user
+    # table is read from the main database
+    binds = {User: db.engine} if engine is not db.engine else {}
+    session = Session(bind=connection, binds=binds, join_transaction_mode="create_savepoint")
+    db.session.registry.set(session)
+    # The handlers' commits are only SAVEPOINT releases, publish at the end
+    hold_changes(session)
+    try:
+        responses = run_each(sub_requests, atomic=True)
+        committed = all(response["status"] < 400 for response in responses)
+        if committed:
+            session.commit()
+            transaction.commit()
+            publish_held(session)
+        else:
+            transaction.rollback()
+            discard_held(session)
+        return responses, committed
+    except Exception:
+        transaction.rollback()
+        discard_held(session)
+        raise
+    finally:
+        db.session.remove()
+        connection.close()
+
+
+def dispatch(sub_request, headers, deadline):
+    """
+    Run one sub-request and return (status, JSON body).
+
+    A running sub-request can't be cut short, so one only starts before the
+    deadline. Streamed responses are closed unread, they have no end to wait
+    for. Its log line carries the batch's request ID, and its queries count
+    towards the batch's.
+    """
+    if time.monotonic() > deadline:
+        return 504, {"error": "Batch time limit exceeded"}
+    builder = EnvironBuilder(
+        path=sub_request["path"],
+        method=str(sub_request.get("method", "GET")).upper(),
+        headers=dict(headers, **{"X-Request-ID": g.request_id}),
+        json=sub_request.get("body"),
+        environ_base={"REMOTE_ADDR": request.remote_addr},
+    )
+    saved = {name: g.get(name) for name in REQUEST_G_FIELDS}
+    try:
+        with app.request_context(builder.get_environ()):
+            response = app.full_dispatch_request()
+    finally:
+        builder.close()
+        queries = g.get("query_count", 0)
+        for name, value in saved.items():
+            setattr(g, name, value)
+        g.query_count += queries
+
+    if response.is_streamed:
+        response.close()
+        return 400, {"error": "Streaming endpoints can't be batched"}
+
+    body = response.get_data(as_text=True)
+    try:
+        body = json.loads(body) if body else None
+    except ValueError:
+        pass
+    return response.status_code, body
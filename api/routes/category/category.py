@@ -9,7 +9,9 @@ import jwt
 category_bp = Blueprint("category", __name__)
 SECRET_KEY = config("SECRET_KEY")
 
-from api.middleware.middleware import jwt_required
+from api.middleware.middleware import jwt_required, current_user
+from api.services.patch import PatchError, apply_patch, expected_version, patch_values
+from sqlalchemy.orm.exc import StaleDataError
 
 from api.routes.category.catalog import catalog_bp
 category_bp.register_blueprint(catalog_bp, url_prefix='/catalog')
@@ -59,6 +61,7 @@ def list_categories(data):
             "meta": category.meta,
             "created_at": str(category.created_at),
             "updated_at": str(category.updated_at),
+            "version": category.version,
         }
         category_list.append(category_info)
 
@@ -123,6 +126,7 @@ def get_category(data,category_id):
         "meta": category.meta,
         "created_at": str(category.created_at),
         "updated_at": str(category.updated_at),
+        "version": category.version,
     }
 
     return jsonify(category_info), 200
@@ -255,10 +259,10 @@ def update_category(data,category_id):
         user = User.query.filter_by(email=tokenDe['email']).first()
     
         category = Category.query.get(category_id)
-        if category.iduser != user.id:
-            return jsonify({"error": "Category ajena"}), 403
         if not category:
             return jsonify({"error": "Category not found"}), 404
+        if category.iduser != user.id:
+            return jsonify({"error": "Category ajena"}), 403
 
         category.description = description if description is not None else category.description
         category.relevance = relevance if relevance is not None else category.relevance
@@ -268,10 +272,86 @@ def update_category(data,category_id):
 
         return jsonify({"message": "Category updated successfully", "id": category.id}), 200
 
+    except StaleDataError:
+        return jsonify({"error": "Category was modified meanwhile, reload it"}), 409
     except Exception as e:
         return jsonify({"error": "Error updating category: " + str(e)}), 500
 
 
+# Campos que acepta PATCH: (parse, admite null)
+CATEGORY_PATCH_FIELDS = {
+    "description": (str, False),
+    "relevance": (str, True),
+    "meta": (str, True),
+}
+
+
+@category_bp.route("/<int:category_id>", methods=["PATCH"])
+@jwt_required
+def patch_category(data, category_id):
+    """
+    Partially update a category, if it is still at the version being edited
+    ---
+    parameters:
+      - name: category_id
+        in: path
+        type: integer
+        required: true
+        description: ID of the category to update.
+      - name: If-Match
+        in: header
+        type: string
+        description: Version being edited; or send it as the version field.
+      - name: data
+        in: body
+        required: true
+        description: Only the fields to change; null clears relevance or meta.
+        schema:
+          type: object
+          properties:
+            version:
+              type: integer
+              description: Version being edited, when If-Match is not sent.
+            description:
+              type: string
+            relevance:
+              type: string
+            meta:
+              type: string
+
+    responses:
+      200:
+        description: Category updated, with its new version.
+      400:
+        description: Invalid or unknown fields.
+      403:
+        description: The category belongs to another user.
+      404:
+        description: Category not found or deleted.
+      409:
+        description: The category changed since that version; the current one is returned.
+      428:
+        description: No version was sent.
+    """
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict):
+        return jsonify({"error": "Expected a JSON object"}), 400
+    try:
+        version = expected_version(data)
+        values = patch_values(data, CATEGORY_PATCH_FIELDS)
+        version = apply_patch(Category, category_id, current_user().id, values, version)
+        db.session.commit()
+    except PatchError as e:
+        body = {"error": str(e)}
+        if e.version is not None:
+            body["version"] = e.version
+        return jsonify(body), e.status
+
+    response = jsonify({"message": "Category updated successfully", "id": category_id, "version": version})
+    response.set_etag(str(version))
+    return response, 200
+
+
 @category_bp.route("/<int:category_id>", methods=["DELETE"])
 @jwt_required
 def delete_category(data,category_id):
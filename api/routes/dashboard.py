@@ -0,0 +1,168 @@
+import datetime
+import time
+from concurrent.futures import ThreadPoolExecutor
+from flask import Blueprint, jsonify, g
+from decouple import config
+from app import app, db
+from api.models.category import Category
+from api.models.expense import Expense
+from api.models.payment_method import PaymentMethod
+from api.middleware.middleware import jwt_required, current_user
+from api.services.sharding import current_shard
+from api.services.shard_directory import using_shard
+from api.services.unit_of_work import current_timeout
+
+dashboard_bp = Blueprint("dashboard", __name__)
+
+DASHBOARD_THREADS = config("DASHBOARD_THREADS", default=4, cast=int)
+RECENT_EXPENSES = 10
+TOP_CATEGORIES = 5
+
+# Shared by all requests of the worker, so concurrent dashboards can't
+# open more than DASHBOARD_THREADS extra database connections
+executor = ThreadPoolExecutor(max_workers=DASHBOARD_THREADS, thread_name_prefix="dashboard")
+
+
+@dashboard_bp.route("/", methods=["GET"], strict_slashes=False)
+@jwt_required
+def get_dashboard(data):
+    """
+    Home screen data in one response
+    ---
+    responses:
+      200:
+        description: Catalogs, recent expenses, month-to-date totals and top categories.
+        schema:
+          type: object
+          properties:
+            categories:
+              type: array
+              items:
+                type: object
+                properties:
+                  id:
+                    type: integer
+                    description: Category ID.
+                  description:
+                    type: string
+                    description: Description of the category.
+            payment_methods:
+              type: array
+              items:
+                type: object
+                properties:
+                  id:
+                    type: integer
+                    description: Payment method ID.
+                  name:
+                    type: string
+                    description: Name of the payment method.
+            recent_expenses:
+              type: array
+              items:
+                type: object
+              description: Latest expenses, newest first.
+            month_to_date:
+              type: object
+              properties:
+                total:
+                  type: number
+                  description: Amount spent since the first day of the month.
+                count:
+                  type: integer
+                  description: Number of expenses since the first day of the month.
+            top_categories:
+              type: array
+              items:
+                type: object
+                properties:
+                  idcategory:
+                    type: integer
+                    description: Category ID.
+                  total:
+                    type: number
+                    description: Amount spent this month in the category.
+            timings_ms:
+              type: object
+              description: Time spent on each section, in milliseconds.
+    """
+    iduser = current_user().id
+    today = datetime.date.today()
+    month_start = today.replace(day=1)
+
+    sections = {
+        "categories": (list_categories, iduser),
+        "payment_methods": (list_payment_methods, iduser),
+        "recent_expenses": (list_recent_expenses, iduser),
+        "month_to_date": (month_to_date, iduser, month_start, today),
+        "top_categories": (top_categories, iduser, month_start, today),
+    }
+    shard = current_shard()
+    timeout = current_timeout()
+    futures = {name: executor.submit(run_section, shard, timeout, *job) for name, job in sections.items()}
+
+    dashboard = {}
+    timings = {}
+    for name, future in futures.items():
+        dashboard[name], timings[name] = future.result()
+    dashboard["timings_ms"] = timings
+
+    return jsonify(dashboard), 200
+
+
+def run_section(shard, timeout, query, *args):
+    """Run one section in its own app context (and session) on the request's shard."""
+    start = time.perf_counter()
+    with app.app_context(), using_shard(shard):
+        g.statement_timeout_ms = timeout
+        result = query(*args)
+    return result, round((time.perf_counter() - start) * 1000, 2)
+
+
+def list_categories(iduser):
+    categories = Category.query.filter_by(iduser=iduser, is_delete=0)
+    return [{"id": category.id, "description": category.description} for category in categories]
+
+
+def list_payment_methods(iduser):
+    payment_methods = PaymentMethod.query.filter_by(iduser=iduser, is_delete=0)
+    return [{"id": payment_method.id, "name": payment_method.name} for payment_method in payment_methods]
+
+
+def list_recent_expenses(iduser):
+    expenses = (
+        Expense.query.filter_by(iduser=iduser)
+        .order_by(Expense.date.desc(), Expense.id.desc())
+        .limit(RECENT_EXPENSES)
+    )
+    return [
+        {
+            "id": expense.id,
+            "concept": expense.concept,
+            "idcategory": expense.idcategory,
+            "amount": float(expense.amount),
+            "date": str(expense.date),
+            "idpayment": expense.idpayment,
+        }
+        for expense in expenses
+    ]
+
+
+def month_to_date(iduser, month_start, today):
+    total, count = db.session.execute(
+        db.select(db.func.coalesce(db.func.sum(Expense.amount), 0), db.func.count(Expense.id))
+        .where(Expense.iduser == iduser, Expense.date >= month_start, Expense.date <= today)
+    ).one()
+    return {"from": str(month_start), "to": str(today), "total": float(total), "count": count}
+
+
+def top_categories(iduser, month_start, today):
+    total = db.func.sum(Expense.amount).label("total")
+    rows = db.session.execute(
+        db.select(Expense.idcategory, total)
+        .where(Expense.iduser == iduser, Expense.date >= month_start, Expense.date <= today)
+        .group_by(Expense.idcategory)
+        .order_by(total.desc())
+        .limit(TOP_CATEGORIES)
+    )
+    return [{"idcategory": idcategory, "total": float(amount)} for idcategory, amount in rows]
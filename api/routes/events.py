@@ -0,0 +1,104 @@
+import json
+import queue
+import threading
+from flask import Blueprint, Response, jsonify, request
+from decouple import config
+from app import db
+from api.events.bus import bus
+from api.events.tracking import TRACKED_TABLES
+from api.middleware.middleware import jwt_required, current_user
+
+events_bp = Blueprint("events", __name__)
+
+EVENTS_HEARTBEAT_SECONDS = config("EVENTS_HEARTBEAT_SECONDS", default=15, cast=int)
+# Every open stream holds a worker thread; keep this below GUNICORN_THREADS
+# so the other requests still get one
+EVENTS_MAX_STREAMS = config("EVENTS_MAX_STREAMS", default=2, cast=int)
+EVENTS_RETRY_SECONDS = config("EVENTS_RETRY_SECONDS", default=10, cast=int)
+
+streams = threading.BoundedSemaphore(EVENTS_MAX_STREAMS)
+
+
+@events_bp.route("/", methods=["GET"], strict_slashes=False)
+@jwt_required
+def stream_events(data):
+    """
+    Change feed (Server-Sent Events)
+    ---
+    parameters:
+      - name: Last-Event-ID
+        in: header
+        type: string
+        description: Resume after this event; recent events are replayed.
+    responses:
+      200:
+        description: >
+          text/event-stream of expense, category and payment_method events named
+          "<entity>.<op>" with op created, updated or deleted. Each data line is a
+          JSON object with entity, op, id and, for expenses, the main fields.
+          A statement import sends one expense.imported event per chunk, with
+          the new expense ids in fields.ids.
+          A comment line is sent every EVENTS_HEARTBEAT_SECONDS.
+      503:
+        description: This worker already serves EVENTS_MAX_STREAMS streams; retry after Retry-After seconds.
+        schema:
+          type: object
+          properties:
+            error:
+              type: string
+              description: Error message.
+    """
+    iduser = current_user().id
+    last_event_id = request.headers.get("Last-Event-ID") or request.args.get("last_event_id")
+
+    if not streams.acquire(blocking=False):
+        response = jsonify({"error": "Too many open event streams, retry later"})
+        response.headers["Retry-After"] = str(EVENTS_RETRY_SECONDS)
+        return response, 503
+
+    # Subscribe before replaying so nothing falls in between
+    subscription = bus.subscribe()
+    backlog = bus.replay(int(last_event_id)) if last_event_id and last_event_id.isdigit() else []
+    # The stream can stay open for hours, don't keep a pooled connection
+    db.session.remove()
+
+    def generate():
+        yield "retry: 3000\n\n"
+        replayed = set()
+        for event in backlog:
+            replayed.add(event["event_id"])
+            if is_for(event, iduser):
+                yield format_event(event)
+        while True:
+            try:
+                event = subscription.get(timeout=EVENTS_HEARTBEAT_SECONDS)
+            except queue.Empty:
+                yield ": heartbeat\n\n"
+                continue
+            if is_for(event, iduser) and event["event_id"] not in replayed:
+                yield format_event(event)
+
+    def close():
+        bus.unsubscribe(subscription)
+        streams.release()
+
+    response = Response(
+        generate(),
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+    # Also runs when the client leaves before the first chunk is sent
+    response.call_on_close(close)
+    return response
+
+
+def is_for(event, iduser):
+    # The bus also carries internal events (e.g. shard moves)
+    return event["iduser"] == iduser and event["entity"] in TRACKED_TABLES
+
+
+def format_event(event):
+    body = {key: value for key, value in event.items() if key not in ("event_id", "iduser")}
+    return "id: %d\nevent: %s.%s\ndata: %s\n\n" % (
+        event["event_id"], event["entity"], event["op"], json.dumps(body)
+    )
@@ -1,23 +1,61 @@
-from flask import Blueprint, request, jsonify
+from flask import Blueprint, Response, request, jsonify, stream_with_context
 from api.models.category import Category
 from api.models.payment_method import PaymentMethod
 from app import db
-from api.models.expense import Expense  # Assuming you have an Expense model
-from api.middleware.middleware import jwt_required
-from api.models.user import User
-import jwt
+from api.models.expense import Expense, fingerprint  # Assuming you have an Expense model
+from api.middleware.middleware import jwt_required, current_user
+from api.middleware.ratelimit import rate_limit
+from api.services.read_cache import cached_read
+from api.services.unit_of_work import statement_timeout
+from api.services.patch import PatchError, apply_patch, expected_version, patch_values
+from api.services.export import FORMATS as EXPORT_FORMATS, parse_columns, record_batches, write_export
+from api.models.concept_count import ConceptCount
+from api.analytics.columns import expense_date_range, load_expense_columns
+from api.analytics.timeseries import BUCKETS, MAX_BUCKETS, bucket_count, dense_series, axis_labels
+from api.analytics.anomalies import GROUPS, MAX_RANGE_DAYS, MAX_WINDOW, find_anomalies
+from api.services.group_commit import GROUP_COMMIT_ENABLED, GroupCommitTimeout, expense_committer, in_explicit_transaction
+from api.services.concept_index import concept_index
+from api.analytics.suggest import model_cache
+from api.analytics.duplicates import duplicate_groups
+from api.utils.text import normalize_concept
+from api.utils.money import to_cents
+from api.utils import geohash
+from sqlalchemy import and_, or_
+from sqlalchemy.orm.exc import StaleDataError
+import numpy as np
+import datetime
+import decimal
+import logging
+import math
 from decouple import config
 
 expense_bp = Blueprint("expense", __name__)
-SECRET_KEY = config("SECRET_KEY")
+logger = logging.getLogger(__name__)
+# Years (current one included) served from the hot partitions
+EXPENSE_HOT_YEARS = config("EXPENSE_HOT_YEARS", default=2, cast=int)
+NEARBY_MAX_RADIUS = config("NEARBY_MAX_RADIUS", default=50000, cast=float)
+# What create_expense does with an exact repeat: allow, warn (duplicate_of in the answer) or reject (409)
+EXPENSE_DUPLICATES = config("EXPENSE_DUPLICATES", default="warn")
+DUPLICATE_POLICIES = ("allow", "warn", "reject")
 
 
 @expense_bp.route("/page/<int:page>", methods=["GET"])
 @jwt_required
+@rate_limit(per_user=(5, 30), per_ip=(10, 60))
+@cached_read
 def list_expenses(data, page):
     """
     List all expenses
     ---
+    parameters:
+      - name: from
+        in: query
+        type: string
+        description: Only expenses on or after this date (YYYY-MM-DD).
+      - name: to
+        in: query
+        type: string
+        description: Only expenses on or before this date (YYYY-MM-DD).
     responses:
       200:
         description: List of expenses.
@@ -38,6 +76,9 @@ def list_expenses(data, page):
               amount:
                 type: float
                 description: Amount of the expense.
+              amount_cents:
+                type: integer
+                description: Amount in cents, exact.
               description:
                 type: string
                 description: Description of the expense.
@@ -57,7 +98,10 @@ def list_expenses(data, page):
                 type: integer
                 description: Priority of the expense.
     """
-    expenses = filterExpenseUser(request, page)
+    try:
+        expenses = filterExpenseUser(request, page)
+    except ValueError:
+        return jsonify({"error": "Invalid date, expected YYYY-MM-DD"}), 400
     expense_list = []
 
     for expense in expenses:
@@ -66,12 +110,14 @@ def list_expenses(data, page):
             "concept": expense.concept,
             "idcategory": expense.idcategory,
             "amount": float(expense.amount),
+            "amount_cents": to_cents(expense.amount),
             "description": expense.description,
             "created_at": str(expense.created_at),
             "updated_at": str(expense.updated_at),
             "date": str(expense.date),
             "idpayment": expense.idpayment,
             "priority": expense.priority,
+            "version": expense.version,
         }
         expense_list.append(expense_info)
 
@@ -80,10 +126,21 @@ def list_expenses(data, page):
 
 @expense_bp.route("/page/<int:page>/last-page/<int:lastpage>", methods=["GET"])
 @jwt_required
+@rate_limit(per_user=(1, 10), per_ip=(2, 20))
+@cached_read
 def list_expensesByPage(data, page, lastpage):
     """
     List all expenses
     ---
+    parameters:
+      - name: from
+        in: query
+        type: string
+        description: Only expenses on or after this date (YYYY-MM-DD).
+      - name: to
+        in: query
+        type: string
+        description: Only expenses on or before this date (YYYY-MM-DD).
     responses:
       200:
         description: List of expenses.
@@ -104,6 +161,9 @@ def list_expensesByPage(data, page, lastpage):
               amount:
                 type: float
                 description: Amount of the expense.
+              amount_cents:
+                type: integer
+                description: Amount in cents, exact.
               description:
                 type: string
                 description: Description of the expense.
@@ -123,12 +183,14 @@ def list_expensesByPage(data, page, lastpage):
                 type: integer
                 description: Priority of the expense.
     """
-    expenses = filterExpenseUserRange(request, page, lastpage)
+    try:
+        expenses = filterExpenseUserRange(request, page, lastpage)
+    except ValueError:
+        return jsonify({"error": "Invalid date, expected YYYY-MM-DD"}), 400
     expense_list = []
     categories = filterCategoryUser(request)
     payments = filterPaymentMethodUser(request)
     for expense in expenses:
-        print(expense.idpayment)
         payment = next(
             (obj for obj in payments if obj.id == expense.idpayment), None)
         category = next((obj for obj in categories if obj.id ==
@@ -146,6 +208,7 @@ def list_expensesByPage(data, page, lastpage):
             "updated_at": str(category.updated_at),
         },
             "amount": float(expense.amount),
+            "amount_cents": to_cents(expense.amount),
             "description": expense.description,
             "created_at": str(expense.created_at),
             "updated_at": str(expense.updated_at),
@@ -159,14 +222,791 @@ def list_expensesByPage(data, page, lastpage):
                 "updated_at": str(payment.updated_at),
             },
             "priority": expense.priority,
+            "version": expense.version,
         }
         expense_list.append(expense_info)
 
+    logger.debug("expense page", extra={"page": page, "lastpage": lastpage, "rows": len(expense_list)})
     return jsonify(expense_list)
 
 
+@expense_bp.route("/timeseries", methods=["GET"])
+@jwt_required
+@rate_limit(per_user=(2, 20), per_ip=(4, 40))
+@statement_timeout(15000)
+def expense_timeseries(data):
+    """
+    Spending time series
+    ---
+    parameters:
+      - name: bucket
+        in: query
+        type: string
+        enum: [day, week, month]
+        default: day
+        description: Size of each bucket. Weeks start on Monday; a series holds at most 3660 buckets.
+      - name: from
+        in: query
+        type: string
+        description: First date to include (YYYY-MM-DD). Defaults to the oldest expense.
+      - name: to
+        in: query
+        type: string
+        description: Last date to include (YYYY-MM-DD). Defaults to the newest expense.
+      - name: by
+        in: query
+        type: string
+        enum: [category]
+        description: Split the series per category.
+
+    responses:
+      200:
+        description: Dense series with zero-filled gaps and running totals.
+        schema:
+          type: object
+          properties:
+            bucket:
+              type: string
+              description: Bucket size used.
+            labels:
+              type: array
+              items:
+                type: string
+              description: Start date of every bucket.
+            series:
+              type: array
+              items:
+                type: object
+                properties:
+                  idcategory:
+                    type: integer
+                    description: Category ID (only when by=category).
+                  totals:
+                    type: array
+                    items:
+                      type: number
+                    description: Amount spent in each bucket.
+                  cumulative:
+                    type: array
+                    items:
+                      type: number
+                    description: Running total up to each bucket.
+      400:
+        description: Bad request.
+        schema:
+          type: object
+          properties:
+            error:
+              type: string
+              description: Error message.
+    """
+    bucket = request.args.get("bucket", "day")
+    by = request.args.get("by")
+    if bucket not in BUCKETS:
+        return jsonify({"error": "bucket must be one of: " + ", ".join(BUCKETS)}), 400
+    if by not in (None, "category"):
+        return jsonify({"error": "by must be: category"}), 400
+    try:
+        date_from = parse_date_arg(request.args.get("from"))
+        date_to = parse_date_arg(request.args.get("to"))
+    except ValueError:
+        return jsonify({"error": "Invalid date, expected YYYY-MM-DD"}), 400
+
+    user = current_user()
+
+    # An open range ends at the first or last expense; size it before loading anything
+    if date_from is None or date_to is None:
+        first, last = expense_date_range(user.id, date_from, date_to)
+        date_from = date_from or first
+        date_to = date_to or last
+    if date_from is not None and date_to is not None:
+        count = bucket_count(date_from, date_to, bucket)
+        if count > MAX_BUCKETS:
+            return jsonify({
+                "error": "The range holds %d %s buckets, at most %d are allowed; narrow from/to or use a larger bucket"
+                % (count, bucket, MAX_BUCKETS)
+            }), 400
+
+    names = ["date", "amount_cents"] + (["idcategory"] if by else [])
+    columns = load_expense_columns(user.id, names, date_from, date_to)
+    axis, group_ids, totals = dense_series(
+        columns["date"],
+        columns["amount_cents"],
+        columns.get("idcategory"),
+        bucket,
+        date_from,
+        date_to,
+    )
+    cumulative = np.cumsum(totals, axis=1)
+
+    series = []
+    for group_id, row, running in zip(
+        group_ids.tolist(), (totals / 100).tolist(), (cumulative / 100).tolist()
+    ):
+        series_info = {"totals": row, "cumulative": running}
+        if by:
+            series_info = {"idcategory": group_id if group_id != -1 else None, **series_info}
+        series.append(series_info)
+
+    return jsonify({
+        "bucket": bucket,
+        "labels": axis_labels(axis, bucket),
+        "series": series,
+    })
+
+
+@expense_bp.route("/anomalies", methods=["GET"])
+@jwt_required
+@rate_limit(per_user=(2, 20), per_ip=(4, 40))
+@statement_timeout(15000)
+def expense_anomalies(data):
+    """
+    Unusually large or frequent spending
+    ---
+    parameters:
+      - name: by
+        in: query
+        type: string
+        enum: [category, payment]
+        description: Group to compare against. Both by default.
+      - name: window
+        in: query
+        type: integer
+        default: 30
+        description: Previous expenses (large) or days (frequent) forming the baseline, 2 to 90.
+      - name: threshold
+        in: query
+        type: number
+        default: 3.5
+        description: Robust z-score (median/MAD) above which spending is flagged.
+      - name: from
+        in: query
+        type: string
+        description: Only report anomalies on or after this date (YYYY-MM-DD). Defaults to a year before to.
+      - name: to
+        in: query
+        type: string
+        description: Only report anomalies on or before this date (YYYY-MM-DD). Defaults to today.
+
+    responses:
+      200:
+        description: Flagged expenses and days, per group.
+        schema:
+          type: object
+          properties:
+            large:
+              type: array
+              items:
+                type: object
+              description: Expenses with an unusually high amount for their category or payment method.
+            frequent:
+              type: array
+              items:
+                type: object
+              description: Days with unusually many expenses in a category or payment method.
+      400:
+        description: Bad request.
+        schema:
+          type: object
+          properties:
+            error:
+              type: string
+              description: Error message.
+    """
+    by = request.args.get("by")
+    if by is not None and by not in GROUPS:
+        return jsonify({"error": "by must be one of: " + ", ".join(GROUPS)}), 400
+    try:
+        window = int(request.args.get("window", 30))
+        threshold = float(request.args.get("threshold", 3.5))
+        date_from = parse_date_arg(request.args.get("from"))
+        date_to = parse_date_arg(request.args.get("to"))
+    except ValueError:
+        return jsonify({"error": "Invalid window, threshold or date"}), 400
+    if not 2 <= window <= MAX_WINDOW:
+        return jsonify({"error": "window must be between 2 and %d" % MAX_WINDOW}), 400
+    date_to = date_to or datetime.date.today()
+    date_from = date_from or date_to - datetime.timedelta(days=MAX_RANGE_DAYS - 1)
+    if not 0 <= (date_to - date_from).days < MAX_RANGE_DAYS:
+        return jsonify({"error": "from must be before to and at most %d days apart" % MAX_RANGE_DAYS}), 400
+
+    user = current_user()
+
+    groups = [by] if by else list(GROUPS)
+    large = []
+    frequent = []
+    for group in groups:
+        group_large, group_frequent = find_anomalies(user.id, group, window, threshold, date_from, date_to)
+        large += [dict(item, group=group) for item in group_large]
+        frequent += [dict(item, group=group) for item in group_frequent]
+
+    return jsonify({
+        "large": sorted(large, key=lambda item: item["date"], reverse=True),
+        "frequent": sorted(frequent, key=lambda item: item["date"], reverse=True),
+    })
+
+
+@expense_bp.route("/top", methods=["GET"])
+@jwt_required
+def top_expenses(data):
+    """
+    Largest expenses in a date range
+    ---
+    parameters:
+      - name: n
+        in: query
+        type: integer
+        default: 10
+        description: How many expenses to return (at most 100).
+      - name: from
+        in: query
+        type: string
+        description: First date (YYYY-MM-DD). Defaults to the first day of the current month.
+      - name: to
+        in: query
+        type: string
+        description: Last date (YYYY-MM-DD). Defaults to today.
+
+    responses:
+      200:
+        description: Expenses ordered by amount, largest first.
+        schema:
+          type: array
+          items:
+            type: object
+            properties:
+              id:
+                type: integer
+                description: Expense ID.
+              concept:
+                type: string
+                description: Concept of the expense.
+              idcategory:
+                type: integer
+                description: Category ID of the expense.
+              amount:
+                type: float
+                description: Amount of the expense.
+              date:
+                type: string
+                description: Date of the expense.
+              idpayment:
+                type: integer
+                description: Payment method ID of the expense.
+      400:
+        description: Bad request.
+        schema:
+          type: object
+          properties:
+            error:
+              type: string
+              description: Error message.
+    """
+    try:
+        n = min(int(request.args.get("n", 10)), 100)
+        today = datetime.date.today()
+        date_from = parse_date_arg(request.args.get("from")) or today.replace(day=1)
+        date_to = parse_date_arg(request.args.get("to")) or today
+    except ValueError:
+        return jsonify({"error": "Invalid n or date"}), 400
+
+    user = current_user()
+
+    # Range scan on (iduser, date, amount)
+    expenses = (
+        Expense.query.filter(
+            Expense.iduser == user.id, Expense.date >= date_from, Expense.date <= date_to
+        )
+        .order_by(Expense.amount.desc(), Expense.id.desc())
+        .limit(n)
+    )
+    return jsonify([
+        {
+            "id": expense.id,
+            "concept": expense.concept,
+            "idcategory": expense.idcategory,
+            "amount": float(expense.amount),
+            "date": str(expense.date),
+            "idpayment": expense.idpayment,
+        }
+        for expense in expenses
+    ])
+
+
+@expense_bp.route("/concepts/frequent", methods=["GET"])
+@jwt_required
+def frequent_concepts(data):
+    """
+    Most frequent concepts
+    ---
+    parameters:
+      - name: n
+        in: query
+        type: integer
+        default: 10
+        description: How many concepts to return (at most 100).
+
+    responses:
+      200:
+        description: Concepts ordered by number of expenses, most used first.
+        schema:
+          type: array
+          items:
+            type: object
+            properties:
+              concept:
+                type: string
+                description: Concept as last typed by the user.
+              count:
+                type: integer
+                description: Number of expenses with this concept.
+              last_used:
+                type: string
+                description: Date of the latest expense written with this concept.
+    """
+    try:
+        n = min(int(request.args.get("n", 10)), 100)
+    except ValueError:
+        return jsonify({"error": "Invalid n"}), 400
+
+    user = current_user()
+
+    # Read from the maintained counters instead of GROUP BY over expense
+    concepts = (
+        ConceptCount.query.filter(ConceptCount.iduser == user.id, ConceptCount.count > 0)
+        .order_by(ConceptCount.count.desc())
+        .limit(n)
+    )
+    return jsonify([
+        {"concept": concept.concept, "count": concept.count, "last_used": str(concept.last_used)}
+        for concept in concepts
+    ])
+
+
+@expense_bp.route("/concepts/suggest", methods=["GET"])
+@jwt_required
+@rate_limit(per_user=(20, 60))
+def suggest_concepts(data):
+    """
+    Concept autocomplete
+    ---
+    parameters:
+      - name: q
+        in: query
+        type: string
+        required: true
+        description: What the user has typed so far. Case and accents are ignored.
+      - name: n
+        in: query
+        type: integer
+        default: 8
+        description: How many suggestions to return (at most 50).
+
+    responses:
+      200:
+        description: Concepts starting with q, most used and most recent first.
+        schema:
+          type: array
+          items:
+            type: object
+            properties:
+              concept:
+                type: string
+                description: Concept as last typed by the user.
+              count:
+                type: integer
+                description: Number of expenses with this concept.
+              last_used:
+                type: string
+                description: Date of the latest expense written with this concept.
+      400:
+        description: Bad request.
+        schema:
+          type: object
+          properties:
+            error:
+              type: string
+              description: Error message.
+    """
+    try:
+        n = min(int(request.args.get("n", 8)), 50)
+    except ValueError:
+        return jsonify({"error": "Invalid n"}), 400
+    prefix = normalize_concept(request.args.get("q", ""))
+    if not prefix:
+        return jsonify({"error": "q is required"}), 400
+
+    iduser = current_user().id
+    # Served from memory, the database is only read the first time per user
+    index = concept_index.get(iduser)
+    return jsonify(index.suggest(prefix, n, datetime.date.today()))
+
+
+@expense_bp.route("/suggest-category", methods=["GET"])
+@jwt_required
+@rate_limit(per_user=(20, 60))
+def suggest_category(data):
+    """
+    Suggest a category and payment method for a new expense
+    ---
+    parameters:
+      - name: concept
+        in: query
+        type: string
+        required: true
+        description: Concept typed so far.
+      - name: amount
+        in: query
+        type: number
+        description: Amount of the expense, if known.
+
+    responses:
+      200:
+        description: Most likely category and payment method, learned from the user's expenses.
+        schema:
+          type: object
+          properties:
+            idcategory:
+              type: integer
+              description: Suggested category ID, null without history.
+            idpayment:
+              type: integer
+              description: Suggested payment method ID, null without history.
+            categories:
+              type: array
+              description: Up to three candidate categories with their probability.
+              items:
+                type: object
+            payments:
+              type: array
+              description: Up to three candidate payment methods with their probability.
+              items:
+                type: object
+      400:
+        description: Bad request.
+        schema:
+          type: object
+          properties:
+            error:
+              type: string
+              description: Error message.
+    """
+    concept = request.args.get("concept", "")
+    if not normalize_concept(concept):
+        return jsonify({"error": "concept is required"}), 400
+    try:
+        amount = float(request.args["amount"]) if request.args.get("amount") else None
+    except ValueError:
+        return jsonify({"error": "Invalid amount"}), 400
+    if amount is not None and not math.isfinite(amount):
+        return jsonify({"error": "amount must be a finite number"}), 400
+
+    candidates = model_cache.suggest(current_user().id, concept, amount)
+    return jsonify({
+        "idcategory": candidates["category"][0]["id"] if candidates["category"] else None,
+        "idpayment": candidates["payment"][0]["id"] if candidates["payment"] else None,
+        "categories": candidates["category"],
+        "payments": candidates["payment"],
+    })
+
+
+@expense_bp.route("/nearby", methods=["GET"])
+@jwt_required
+@rate_limit(per_user=(5, 30), per_ip=(10, 60))
+def nearby_expenses(data):
+    """
+    Expenses made near a point
+    ---
+    parameters:
+      - name: lat
+        in: query
+        type: number
+        required: true
+        description: Latitude of the center.
+      - name: lon
+        in: query
+        type: number
+        required: true
+        description: Longitude of the center.
+      - name: radius
+        in: query
+        type: number
+        default: 500
+        description: Radius in meters (at most NEARBY_MAX_RADIUS, 50 km by default).
+      - name: n
+        in: query
+        type: integer
+        default: 50
+        description: How many expenses to return (at most 500).
+
+    responses:
+      200:
+        description: Geotagged expenses inside the radius, closest first.
+        schema:
+          type: array
+          items:
+            type: object
+            properties:
+              id:
+                type: integer
+                description: Expense ID.
+              concept:
+                type: string
+                description: Concept of the expense.
+              amount:
+                type: float
+                description: Amount of the expense.
+              date:
+                type: string
+                description: Date of the expense.
+              idcategory:
+                type: integer
+                description: Category ID of the expense.
+              latitude:
+                type: number
+                description: Latitude of the expense.
+              longitude:
+                type: number
+                description: Longitude of the expense.
+              distance:
+                type: number
+                description: Distance to the center in meters.
+      400:
+        description: Bad request.
+        schema:
+          type: object
+          properties:
+            error:
+              type: string
+              description: Error message.
+    """
+    try:
+        latitude, longitude = parse_coordinates(request.args.get("lat"), request.args.get("lon"))
+        radius = float(request.args.get("radius", 500))
+        n = min(int(request.args.get("n", 50)), 500)
+    except ValueError as e:
+        return jsonify({"error": "Invalid parameters: " + str(e)}), 400
+    if latitude is None:
+        return jsonify({"error": "lat and lon are required"}), 400
+    if not 0 < radius <= NEARBY_MAX_RADIUS:
+        return jsonify({"error": "radius must be between 0 and %d meters" % NEARBY_MAX_RADIUS}), 400
+
+    iduser = current_user().id
+
+    # Index ranges over (iduser, geocell) for the cells covering the circle,
+    # then exact distances only for those candidates
+    ranges = [geohash.prefix_range(prefix) for prefix in geohash.cover(latitude, longitude, radius)]
+    candidates = db.session.execute(
+        db.select(
+            Expense.id, Expense.concept, Expense.amount, Expense.date, Expense.idcategory,
+            Expense.latitude, Expense.longitude,
+        ).where(
+            Expense.iduser == iduser,
+            Expense.geocell.isnot(None),
+            or_(*(and_(Expense.geocell >= low, Expense.geocell < high) for low, high in ranges)),
+        )
+    ).all()
+
+    meters = geohash.distances(
+        latitude, longitude,
+        np.array([row.latitude for row in candidates], dtype=np.float64),
+        np.array([row.longitude for row in candidates], dtype=np.float64),
+    )
+    inside = np.flatnonzero(meters <= radius)
+    # Stable, so equally distant expenses keep their query order
+    order = inside[np.argsort(meters[inside], kind="stable")]
+    nearby = [(float(meters[index]), candidates[index]) for index in order]
+
+    return jsonify([
+        {
+            "id": row.id,
+            "concept": row.concept,
+            "amount": float(row.amount),
+            "date": str(row.date),
+            "idcategory": row.idcategory,
+            "latitude": row.latitude,
+            "longitude": row.longitude,
+            "distance": round(distance, 1),
+        }
+        for distance, row in nearby[:n]
+    ])
+
+
+@expense_bp.route("/duplicates", methods=["GET"])
+@jwt_required
+@rate_limit(per_user=(2, 20), per_ip=(4, 40))
+@statement_timeout(15000)
+def duplicate_expenses(data):
+    """
+    Expenses that look entered more than once
+    ---
+    parameters:
+      - name: from
+        in: query
+        type: string
+        description: First date to look at (YYYY-MM-DD), 90 days ago by default.
+      - name: to
+        in: query
+        type: string
+        description: Last date to look at (YYYY-MM-DD), today by default.
+      - name: days
+        in: query
+        type: integer
+        default: 1
+        description: How many days apart two copies may be (0 to 31).
+      - name: round
+        in: query
+        type: number
+        default: 1
+        description: Amounts at most half of this apart match.
+      - name: n
+        in: query
+        type: integer
+        default: 100
+        description: How many groups to return (at most 500).
+
+    responses:
+      200:
+        description: Groups of matching expenses, oldest first; exact is true when all of them have the same concept, amount, date and payment method.
+        schema:
+          type: object
+          properties:
+            groups:
+              type: array
+              items:
+                type: object
+                properties:
+                  exact:
+                    type: boolean
+                  expenses:
+                    type: array
+                    items:
+                      type: object
+            truncated:
+              type: boolean
+              description: More groups than n were found.
+      400:
+        description: Bad request.
+        schema:
+          type: object
+          properties:
+            error:
+              type: string
+              description: Error message.
+    """
+    try:
+        end = parse_date_arg(request.args.get("to")) or datetime.date.today()
+        start = parse_date_arg(request.args.get("from")) or end - datetime.timedelta(days=90)
+        days = int(request.args.get("days", 1))
+        step = decimal.Decimal(request.args.get("round", "1"))
+        n = min(int(request.args.get("n", 100)), 500)
+    except (ValueError, decimal.InvalidOperation) as e:
+        return jsonify({"error": "Invalid parameters: " + str(e)}), 400
+    if not 0 <= days <= 31:
+        return jsonify({"error": "days must be between 0 and 31"}), 400
+    if not step > 0:
+        return jsonify({"error": "round must be positive"}), 400
+
+    # One range scan of (iduser, date, amount), then a single bucketed pass
+    rows = db.session.execute(
+        db.select(Expense.id, Expense.concept, Expense.amount, Expense.date, Expense.idpayment, Expense.fingerprint)
+        .where(Expense.iduser == current_user().id, Expense.date >= start, Expense.date <= end)
+        .order_by(Expense.date, Expense.id)
+    ).all()
+    groups = duplicate_groups(rows, days, step)
+
+    return jsonify({
+        "groups": [
+            {
+                "exact": group["exact"],
+                "expenses": [
+                    {
+                        "id": row.id,
+                        "concept": row.concept,
+                        "amount": float(row.amount),
+                        "date": str(row.date),
+                        "idpayment": row.idpayment,
+                    }
+                    for row in group["expenses"]
+                ],
+            }
+            for group in groups[:n]
+        ],
+        "truncated": len(groups) > n,
+    })
+
+
+@expense_bp.route("/export", methods=["GET"])
+@jwt_required
+@rate_limit(per_user=(1, 5), per_ip=(2, 10))
+# The cursor stays open while the client downloads; the date range bounds it instead
+@statement_timeout(0)
+def export_expenses(data):
+    """
+    Expenses as an Apache Arrow or Parquet file, for pandas, polars and the like
+    ---
+    produces:
+      - application/vnd.apache.arrow.file
+      - application/vnd.apache.arrow.stream
+      - application/vnd.apache.parquet
+    parameters:
+      - name: format
+        in: query
+        type: string
+        enum: [arrow, arrows, parquet]
+        default: arrow
+        description: Arrow IPC file (memory-mappable), Arrow IPC stream or Parquet.
+      - name: from
+        in: query
+        type: string
+        description: First date to export (YYYY-MM-DD).
+      - name: to
+        in: query
+        type: string
+        description: Last date to export (YYYY-MM-DD).
+      - name: columns
+        in: query
+        type: string
+        description: >
+          Comma-separated columns out of id, iduser, date, concept, description,
+          amount, amount_cents, idcategory, category, idpayment, payment_method,
+          priority, latitude, longitude, created_at and updated_at. category and
+          payment_method are the names. By default id, date, concept, amount,
+          amount_cents, idcategory and idpayment.
+    responses:
+      200:
+        description: The expenses ordered by date, streamed one record batch at a time.
+      400:
+        description: Bad request.
+        schema:
+          type: object
+          properties:
+            error:
+              type: string
+              description: Error message.
+    """
+    fmt = request.args.get("format", "arrow")
+    if fmt not in EXPORT_FORMATS:
+        return jsonify({"error": "format must be one of: " + ", ".join(EXPORT_FORMATS)}), 400
+    try:
+        date_from = parse_date_arg(request.args.get("from"))
+        date_to = parse_date_arg(request.args.get("to"))
+        names = parse_columns(request.args.get("columns"))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    batches = record_batches(names, current_user().id, date_from, date_to)
+    mimetype, extension = EXPORT_FORMATS[fmt]
+    return Response(
+        stream_with_context(write_export(fmt, names, batches)),
+        mimetype=mimetype,
+        headers={"Content-Disposition": "attachment; filename=expenses.%s" % extension},
+    )
+
+
 @expense_bp.route("/<int:expense_id>", methods=["GET"])
 @jwt_required
+@cached_read
 def get_expense(data, expense_id):
     """
     Get expense by ID
@@ -196,6 +1036,9 @@ def get_expense(data, expense_id):
             amount:
               type: float
               description: Amount of the expense.
+            amount_cents:
+              type: integer
+              description: Amount in cents, exact.
             description:
               type: string
               description: Description of the expense.
@@ -214,6 +1057,12 @@ def get_expense(data, expense_id):
             priority:
               type: integer
               description: Priority of the expense.
+            latitude:
+              type: number
+              description: Latitude where the expense was made, if geotagged.
+            longitude:
+              type: number
+              description: Longitude where the expense was made, if geotagged.
       404:
         description: Expense not found.
         schema:
@@ -223,31 +1072,35 @@ def get_expense(data, expense_id):
               type: string
               description: Error message.
     """
-    token = request.headers.get('Authorization').split(' ')[1]
-    tokenDe = jwt.decode(token, SECRET_KEY, algorithms=['HS256'])
-    user = User.query.filter_by(email=tokenDe['email']).first()
+    user = current_user()
 
     expense = Expense.query.get(expense_id)
-    if expense.iduser != user.id:
-        return jsonify({"error": "Gasto ajeno"}), 403
-
     if not expense:
         return jsonify({"error": "Expense not found"}), 404
 
+    if expense.iduser != user.id:
+        return jsonify({"error": "Gasto ajeno"}), 403
+
     expense_info = {
         "id": expense.id,
         "concept": expense.concept,
         "idcategory": expense.idcategory,
-        "amount": expense.amount,
+        "amount": float(expense.amount),
+        "amount_cents": to_cents(expense.amount),
         "description": expense.description,
         "created_at": str(expense.created_at),
         "updated_at": str(expense.updated_at),
         "date": str(expense.date),
         "idpayment": expense.idpayment,
         "priority": expense.priority,
+        "latitude": expense.latitude,
+        "longitude": expense.longitude,
+        "version": expense.version,
     }
 
-    return jsonify(expense_info), 200
+    response = jsonify(expense_info)
+    response.set_etag(str(expense.version))
+    return response, 200
 
 
 @expense_bp.route("/", methods=["POST"])
@@ -285,6 +1138,17 @@ def create_expense(data):
             priority:
               type: integer
               description: Priority of the expense.
+            latitude:
+              type: number
+              description: Optional latitude where the expense was made.
+            longitude:
+              type: number
+              description: Optional longitude where the expense was made.
+      - name: duplicates
+        in: query
+        type: string
+        enum: [allow, warn, reject]
+        description: What to do if the same expense (concept, amount, date and payment method) already exists; EXPENSE_DUPLICATES by default.
 
     responses:
       201:
@@ -298,6 +1162,9 @@ def create_expense(data):
             id:
               type: integer
               description: ID of the created expense.
+            duplicate_of:
+              type: integer
+              description: With duplicates=warn, an existing expense this one repeats.
       400:
         description: Bad request.
         schema:
@@ -306,23 +1173,36 @@ def create_expense(data):
             error:
               type: string
               description: Error message.
+      409:
+        description: With duplicates=reject, the same expense already exists (duplicate_of).
+      503:
+        description: Group commit mode is on and the batch did not commit in time.
+        schema:
+          type: object
+          properties:
+            error:
+              type: string
+              description: Error message.
     """
+    duplicates = request.args.get("duplicates", EXPENSE_DUPLICATES)
+    if duplicates not in DUPLICATE_POLICIES:
+        return jsonify({"error": "duplicates must be one of " + ", ".join(DUPLICATE_POLICIES)}), 400
     try:
-        token = request.headers.get('Authorization').split(' ')[1]
-        tokenDe = jwt.decode(token, SECRET_KEY, algorithms=['HS256'])
-        user = User.query.filter_by(email=tokenDe['email']).first()
+        user = current_user()
 
         data = request.get_json()
         concept = data.get("concept")
         idcategory = data.get("idcategory")
         amount = data.get("amount")
         description = data.get("description")
-        date = data.get("date")
+        # The partition key can't be NULL, default to today like the model does
+        date = parse_date_arg(data.get("date")) or datetime.date.today()
         idpayment = data.get("idpayment")
         priority = data.get("priority")
+        latitude, longitude = parse_coordinates(data.get("latitude"), data.get("longitude"))
         iduser = user.id
 
-        new_expense = Expense(
+        values = dict(
             concept=concept,
             idcategory=idcategory,
             amount=amount,
@@ -330,14 +1210,39 @@ def create_expense(data):
             date=date,
             idpayment=idpayment,
             priority=priority,
-            iduser=iduser
+            iduser=iduser,
+            latitude=latitude,
+            longitude=longitude,
         )
 
-        db.session.add(new_expense)
-        db.session.commit()
+        duplicate_of = None
+        if duplicates != "allow":
+            duplicate_of = db.session.execute(
+                db.select(Expense.id)
+                .where(Expense.iduser == iduser, Expense.fingerprint == fingerprint(concept, amount, date, idpayment))
+                .limit(1)
+            ).scalar()
+            if duplicate_of is not None and duplicates == "reject":
+                return jsonify({"error": "This expense is already recorded", "duplicate_of": duplicate_of}), 409
 
-        return jsonify({"message": "Expense created successfully", "id": new_expense.id}), 201
+        if GROUP_COMMIT_ENABLED and not in_explicit_transaction(db.session()):
+            # Only ends the duplicate check's read transaction, whose locks
+            # the flusher's commit would otherwise wait for
+            db.session.commit()
+            expense_id = expense_committer.submit(Expense, values)
+        else:
+            new_expense = Expense(**values)
+            db.session.add(new_expense)
+            db.session.commit()
+            expense_id = new_expense.id
 
+        body = {"message": "Expense created successfully", "id": expense_id}
+        if duplicate_of is not None:
+            body["duplicate_of"] = duplicate_of
+        return jsonify(body), 201
+
+    except GroupCommitTimeout as e:
+        return jsonify({"error": "Error creating expense: " + str(e)}), 503
     except Exception as e:
         return jsonify({"error": "Error creating expense: " + str(e)}), 400
 
@@ -382,6 +1287,12 @@ def update_expense(data, expense_id):
             priority:
               type: integer
               description: Updated priority of the expense.
+            latitude:
+              type: number
+              description: Updated latitude, sent together with longitude.
+            longitude:
+              type: number
+              description: Updated longitude, sent together with latitude.
 
     responses:
       200:
@@ -410,21 +1321,20 @@ def update_expense(data, expense_id):
         idcategory = data.get("idcategory")
         amount = data.get("amount")
         description = data.get("description")
-        date = data.get("date")
+        date = parse_date_arg(data.get("date"))
         idpayment = data.get("idpayment")
         priority = data.get("priority")
+        latitude, longitude = parse_coordinates(data.get("latitude"), data.get("longitude"))
 
-        token = request.headers.get('Authorization').split(' ')[1]
-        tokenDe = jwt.decode(token, SECRET_KEY, algorithms=['HS256'])
-        user = User.query.filter_by(email=tokenDe['email']).first()
+        user = current_user()
 
         expense = Expense.query.get(expense_id)
-        if expense.iduser != user.id:
-            return jsonify({"error": "Gasto ajeno"}), 403
-
         if not expense:
             return jsonify({"error": "Expense not found"}), 404
 
+        if expense.iduser != user.id:
+            return jsonify({"error": "Gasto ajeno"}), 403
+
         expense.concept = concept if concept is not None else expense.concept
         expense.idcategory = idcategory if idcategory is not None else expense.idcategory
         expense.amount = amount if amount is not None else expense.amount
@@ -432,15 +1342,125 @@ def update_expense(data, expense_id):
         expense.date = date if date is not None else expense.date
         expense.idpayment = idpayment if idpayment is not None else expense.idpayment
         expense.priority = priority if priority is not None else expense.priority
+        if latitude is not None:
+            expense.latitude, expense.longitude = latitude, longitude
 
         db.session.commit()
 
         return jsonify({"message": "Expense updated successfully", "id": expense.id}), 200
 
+    except StaleDataError:
+        return jsonify({"error": "Expense was modified meanwhile, reload it"}), 409
     except Exception as e:
         return jsonify({"error": "Error updating expense: " + str(e)}), 500
 
 
+# Campos que acepta PATCH: (parse, admite null)
+EXPENSE_PATCH_FIELDS = {
+    "concept": (str, False),
+    "idcategory": (int, True),
+    "amount": (lambda value: decimal.Decimal(str(value)), False),
+    "description": (str, True),
+    "date": (datetime.date.fromisoformat, False),
+    "idpayment": (int, True),
+    "priority": (int, True),
+}
+
+
+@expense_bp.route("/<int:expense_id>", methods=["PATCH"])
+@jwt_required
+def patch_expense(data, expense_id):
+    """
+    Partially update an expense, if it is still at the version being edited
+    ---
+    parameters:
+      - name: expense_id
+        in: path
+        type: integer
+        required: true
+        description: ID of the expense to update.
+      - name: If-Match
+        in: header
+        type: string
+        description: Version being edited (the ETag of GET /expense/<id>); or send it as the version field.
+      - name: data
+        in: body
+        required: true
+        description: Only the fields to change; null clears description, idcategory, idpayment, priority or the coordinates.
+        schema:
+          type: object
+          properties:
+            version:
+              type: integer
+              description: Version being edited, when If-Match is not sent.
+            concept:
+              type: string
+            idcategory:
+              type: integer
+            amount:
+              type: number
+            description:
+              type: string
+            date:
+              type: string
+              description: YYYY-MM-DD.
+            idpayment:
+              type: integer
+            priority:
+              type: integer
+            latitude:
+              type: number
+              description: Sent together with longitude.
+            longitude:
+              type: number
+              description: Sent together with latitude.
+
+    responses:
+      200:
+        description: Expense updated, with its new version.
+      400:
+        description: Invalid or unknown fields.
+      403:
+        description: The expense belongs to another user.
+      404:
+        description: Expense not found.
+      409:
+        description: The expense changed since that version; the current one is returned.
+      428:
+        description: No version was sent.
+    """
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict):
+        return jsonify({"error": "Expected a JSON object"}), 400
+    try:
+        version = expected_version(data)
+        coordinates = {}
+        if "latitude" in data or "longitude" in data:
+            try:
+                latitude, longitude = parse_coordinates(data.pop("latitude", None), data.pop("longitude", None))
+            except (TypeError, ValueError) as e:
+                raise PatchError(400, str(e))
+            coordinates = {
+                "latitude": latitude,
+                "longitude": longitude,
+                # The mapper hook doesn't run for bulk UPDATEs
+                "geocell": geohash.encode(latitude, longitude) if latitude is not None else None,
+            }
+        values = patch_values(data, EXPENSE_PATCH_FIELDS)
+        values.update(coordinates)
+        version = apply_patch(Expense, expense_id, current_user().id, values, version)
+        db.session.commit()
+    except PatchError as e:
+        body = {"error": str(e)}
+        if e.version is not None:
+            body["version"] = e.version
+        return jsonify(body), e.status
+
+    response = jsonify({"message": "Expense updated successfully", "id": expense_id, "version": version})
+    response.set_etag(str(version))
+    return response, 200
+
+
 @expense_bp.route("/<int:expense_id>", methods=["DELETE"])
 @jwt_required
 def delete_expense(data, expense_id):
@@ -473,17 +1493,15 @@ def delete_expense(data, expense_id):
               description: Error message.
     """
     try:
-        token = request.headers.get('Authorization').split(' ')[1]
-        tokenDe = jwt.decode(token, SECRET_KEY, algorithms=['HS256'])
-        user = User.query.filter_by(email=tokenDe['email']).first()
+        user = current_user()
 
         expense = Expense.query.get(expense_id)
-        if expense.iduser != user.id:
-            return jsonify({"error": "Gasto ajeno"}), 403
-
         if not expense:
             return jsonify({"error": "Expense not found"}), 404
 
+        if expense.iduser != user.id:
+            return jsonify({"error": "Gasto ajeno"}), 403
+
         db.session.delete(expense)
         db.session.commit()
 
@@ -493,39 +1511,77 @@ def delete_expense(data, expense_id):
         return jsonify({"error": "Error deleting expense: " + str(e)}), 500
 
 
+def parse_date_arg(value):
+    if not value:
+        return None
+    return datetime.date.fromisoformat(value)
+
+
+def parse_coordinates(latitude, longitude):
+    """(latitude, longitude) as floats, both None if missing; ValueError if invalid."""
+    if latitude is None and longitude is None:
+        return None, None
+    if latitude is None or longitude is None:
+        raise ValueError("latitude and longitude go together")
+    latitude, longitude = float(latitude), float(longitude)
+    if not (-90 <= latitude <= 90 and -180 <= longitude <= 180):
+        raise ValueError("Coordinates out of range")
+    return latitude, longitude
+
+
 def filterExpenseUser(request, page):
-    token = request.headers.get('Authorization').split(' ')[1]
-    tokenDe = jwt.decode(token, SECRET_KEY, algorithms=['HS256'])
-    user = User.query.filter_by(email=tokenDe['email']).first()
+    user = current_user()
     per_page = 100
-    expense = Expense.query.order_by(Expense.date.desc()).filter_by(
-        iduser=user.id).paginate(page=page, per_page=per_page, error_out=False)
-    return expense
+    query = Expense.query.order_by(Expense.date.desc()).filter_by(iduser=user.id)
+    return paginateHotFirst(query, request, page, per_page)
 
 
 def filterExpenseUserRange(request, page, lastpage):
-    token = request.headers.get('Authorization').split(' ')[1]
-    tokenDe = jwt.decode(token, SECRET_KEY, algorithms=['HS256'])
-    user = User.query.filter_by(email=tokenDe['email']).first()
+    user = current_user()
     per_page = 100 * lastpage - page + 1
-    expense = Expense.query.order_by(Expense.date.desc()).filter_by(
-        iduser=user.id).paginate(page=page, per_page=per_page, error_out=False)
-    return expense
+    query = Expense.query.order_by(Expense.date.desc()).filter_by(iduser=user.id)
+    return paginateHotFirst(query, request, page, per_page)
+
+
+def paginateHotFirst(query, request, page, per_page):
+    """
+    Paginate a date-descending expense query, trying the hot partitions first.
+
+    Recent pages are usually filled entirely by rows newer than hot_start(),
+    so the first attempt carries a date bound MySQL can prune on. Only when
+    the page reaches into older data is the unbounded query run.
+    """
+    date_from = parse_date_arg(request.args.get("from"))
+    date_to = parse_date_arg(request.args.get("to"))
+    if date_from is not None:
+        query = query.filter(Expense.date >= date_from)
+    if date_to is not None:
+        query = query.filter(Expense.date <= date_to)
+
+    hot_from = hot_start()
+    if (date_from is None or date_from < hot_from) and (date_to is None or date_to >= hot_from):
+        hot = query.filter(Expense.date >= hot_from).paginate(
+            page=page, per_page=per_page, error_out=False, count=False)
+        if len(hot.items) == per_page:
+            return hot
+
+    return query.paginate(page=page, per_page=per_page, error_out=False)
+
+
+def hot_start():
+    """First day of the oldest year still considered hot data."""
+    return datetime.date(datetime.date.today().year - EXPENSE_HOT_YEARS + 1, 1, 1)
 
 
 def filterCategoryUser(request):
-  token = request.headers.get('Authorization').split(' ')[1]
-  tokenDe = jwt.decode(token, SECRET_KEY, algorithms=['HS256'])
-  user = User.query.filter_by(email=tokenDe['email']).first()
+  user = current_user()
     
   categories = Category.query.filter_by(iduser=user.id, is_delete=0)
   return categories
 
 
 def filterPaymentMethodUser(request):
-    token = request.headers.get('Authorization').split(' ')[1]
-    tokenDe = jwt.decode(token, SECRET_KEY, algorithms=['HS256'])
-    user = User.query.filter_by(email=tokenDe['email']).first()
+    user = current_user()
 
     paymentMethod = PaymentMethod.query.filter_by(iduser=user.id)
     return paymentMethod
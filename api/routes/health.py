@@ -0,0 +1,54 @@
+from flask import Blueprint, jsonify
+from api.middleware.middleware import jwt_required, current_user
+from api.services.warmup import is_ready
+from api.services.read_cache import read_cache
+from api.services.user_directory import ADMIN_USER_IDS
+
+health_bp = Blueprint("health", __name__)
+
+
+@health_bp.route("/live", methods=["GET"])
+def live():
+    """
+    Liveness probe
+    ---
+    responses:
+      200:
+        description: The worker is up.
+    """
+    return jsonify({"status": "ok"}), 200
+
+
+@health_bp.route("/ready", methods=["GET"])
+def ready():
+    """
+    Readiness probe
+    ---
+    responses:
+      200:
+        description: Database pool warmed up, the worker can take traffic.
+      503:
+        description: Still warming up.
+    """
+    if not is_ready():
+        return jsonify({"status": "warming up"}), 503
+    return jsonify({"status": "ready"}), 200
+
+
+@health_bp.route("/cache", methods=["GET"])
+@jwt_required
+def cache_stats(data):
+    """
+    Read cache statistics of this worker, for administrators (ADMIN_USER_IDS)
+    ---
+    responses:
+      200:
+        description: Entries, size, hits, misses, evictions and hit ratio of the expense read cache.
+      401:
+        description: Missing or invalid token.
+      403:
+        description: The user is not an administrator.
+    """
+    if current_user().id not in ADMIN_USER_IDS:
+        return jsonify({"error": "Only administrators can read the cache statistics"}), 403
+    return jsonify(read_cache.stats()), 200
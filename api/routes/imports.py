@@ -0,0 +1,242 @@
+import json
+import os
+from flask import Blueprint, request, jsonify
+from app import db
+from api.models.category import Category
+from api.models.import_job import ImportJob
+from api.models.import_mapping import ImportMapping
+from api.models.payment_method import PaymentMethod
+from api.middleware.middleware import jwt_required, current_user
+from api.middleware.ratelimit import rate_limit
+from api.services.imports import (
+    FORMATS, IMPORT_MAX_BYTES, importer, parse_mapping, spool, stored_mapping, worker_id,
+)
+from api.services.sharding import current_shard
+
+import_bp = Blueprint("import", __name__)
+
+
+def own_payment_method(idpayment):
+    return PaymentMethod.query.filter_by(id=idpayment, iduser=current_user().id, is_delete=0).first()
+
+
+def own_category(idcategory):
+    return Category.query.filter_by(id=idcategory, iduser=current_user().id, is_delete=0).first()
+
+
+@import_bp.route("/mapping/<int:idpayment>", methods=["GET"])
+@jwt_required
+def get_mapping(data, idpayment):
+    """
+    CSV column mapping of a payment method
+    ---
+    parameters:
+      - name: idpayment
+        in: path
+        type: integer
+        required: true
+        description: Payment method whose statements are imported.
+    responses:
+      200:
+        description: The stored mapping, or the defaults if none was saved.
+      404:
+        description: Payment method not found.
+    """
+    if own_payment_method(idpayment) is None:
+        return jsonify({"error": "Payment method not found"}), 404
+    return jsonify(stored_mapping(idpayment)), 200
+
+
+@import_bp.route("/mapping/<int:idpayment>", methods=["PUT"])
+@jwt_required
+def put_mapping(data, idpayment):
+    """
+    Save how a payment method's CSV statements map to expense fields
+    ---
+    parameters:
+      - name: idpayment
+        in: path
+        type: integer
+        required: true
+        description: Payment method whose statements are imported.
+      - name: data
+        in: body
+        required: true
+        description: Keys to change over the defaults.
+        schema:
+          type: object
+          properties:
+            delimiter:
+              type: string
+              description: Field separator.
+            encoding:
+              type: string
+              description: File encoding, utf-8-sig by default.
+            skip_rows:
+              type: integer
+              description: Lines before the header.
+            header:
+              type: boolean
+              description: Whether the file has a header; if not, columns are 0-based positions.
+            date:
+              type: string
+              description: Date column.
+            date_format:
+              type: string
+              description: strptime format of the date, %Y-%m-%d by default.
+            amount:
+              type: string
+              description: Signed amount column.
+            expenses:
+              type: string
+              enum: [negative, positive]
+              description: Sign of spending in the amount column; rows of the other sign are skipped.
+            debit:
+              type: string
+              description: Column with only the spent amount, instead of amount.
+            decimal:
+              type: string
+              enum: [".", ","]
+              description: Decimal separator.
+            concept:
+              type: string
+              description: Concept column.
+            description:
+              type: string
+              description: Optional description column.
+            idcategory:
+              type: integer
+              description: Category given to the imported expenses.
+    responses:
+      200:
+        description: The saved mapping.
+      400:
+        description: Invalid mapping, or a category that is not the user's.
+      404:
+        description: Payment method not found.
+    """
+    if own_payment_method(idpayment) is None:
+        return jsonify({"error": "Payment method not found"}), 404
+    try:
+        mapping = parse_mapping(request.get_json(silent=True))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    if mapping["idcategory"] is not None and own_category(mapping["idcategory"]) is None:
+        return jsonify({"error": "Category not found"}), 400
+
+    row = db.session.get(ImportMapping, idpayment)
+    if row is None:
+        row = ImportMapping(idpayment=idpayment, iduser=current_user().id)
+        db.session.add(row)
+    row.mapping = json.dumps(mapping)
+    db.session.commit()
+    return jsonify(mapping), 200
+
+
+@import_bp.route("/<int:idpayment>", methods=["POST"])
+@jwt_required
+@rate_limit(per_user=(2, 60))
+def upload_statement(data, idpayment):
+    """
+    Import a bank or credit card statement as expenses of a payment method
+    ---
+    consumes:
+      - multipart/form-data
+    parameters:
+      - name: idpayment
+        in: path
+        type: integer
+        required: true
+        description: Payment method the statement belongs to.
+      - name: file
+        in: formData
+        type: file
+        required: true
+        description: CSV (read with the payment method's mapping) or OFX file; the raw request body also works.
+      - name: format
+        in: query
+        type: string
+        enum: [csv, ofx]
+        description: File format, guessed from the file name by default.
+    responses:
+      202:
+        description: Import queued; follow its progress at /import/jobs/<id>.
+      400:
+        description: No file, unknown format, or the mapping's category was deleted.
+      404:
+        description: Payment method not found.
+      413:
+        description: The file is larger than IMPORT_MAX_BYTES.
+    """
+    if own_payment_method(idpayment) is None:
+        return jsonify({"error": "Payment method not found"}), 404
+    if request.content_length and request.content_length > IMPORT_MAX_BYTES:
+        return jsonify({"error": "The file is larger than %d bytes" % IMPORT_MAX_BYTES}), 413
+
+    upload = request.files.get("file")
+    filename = upload.filename if upload is not None else None
+    fmt = request.args.get("format")
+    if fmt is None:
+        extension = os.path.splitext(filename or "")[1].lower()
+        fmt = "ofx" if extension in (".ofx", ".qfx") else "csv"
+    if fmt not in FORMATS:
+        return jsonify({"error": "Unknown format, expected one of " + ", ".join(FORMATS)}), 400
+    stream = upload.stream if upload is not None else request.stream
+
+    mapping = stored_mapping(idpayment)
+    # The category may have been deleted since the mapping was saved
+    if mapping["idcategory"] is not None and own_category(mapping["idcategory"]) is None:
+        return jsonify({"error": "The mapping's category no longer exists"}), 400
+
+    job = ImportJob(iduser=current_user().id, idpayment=idpayment, filename=filename, format=fmt, worker=worker_id())
+    db.session.add(job)
+    db.session.flush()
+    try:
+        spool(stream, current_shard(), job.id)
+    except ValueError as e:
+        db.session.rollback()
+        return jsonify({"error": str(e)}), 413
+    db.session.commit()
+
+    importer.submit(job.id, current_shard(), mapping)
+    response = jsonify({"message": "Import queued", "id": job.id})
+    response.headers["Location"] = "/import/jobs/%d" % job.id
+    return response, 202
+
+
+@import_bp.route("/jobs/<int:job_id>", methods=["GET"])
+@jwt_required
+def get_import_job(data, job_id):
+    """
+    Progress of a statement import
+    ---
+    parameters:
+      - name: job_id
+        in: path
+        type: integer
+        required: true
+        description: ID returned by the upload.
+    responses:
+      200:
+        description: Status (queued, running, done or failed), line counts so far and the first errors.
+      404:
+        description: Import not found.
+    """
+    job = db.session.get(ImportJob, job_id)
+    if job is None or job.iduser != current_user().id:
+        return jsonify({"error": "Import not found"}), 404
+    return jsonify({
+        "id": job.id,
+        "idpayment": job.idpayment,
+        "filename": job.filename,
+        "format": job.format,
+        "status": job.status,
+        "rows_read": job.rows_read,
+        "inserted": job.inserted,
+        "duplicates": job.duplicates,
+        "skipped": job.skipped,
+        "failed": job.failed,
+        "errors": json.loads(job.errors) if job.errors else [],
+        "created_at": str(job.created_at),
+        "finished_at": str(job.finished_at) if job.finished_at else None,
+    }), 200
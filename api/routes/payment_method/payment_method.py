@@ -2,7 +2,9 @@ from flask import Blueprint, request, jsonify
 from app import db
 from api.models.payment_method import PaymentMethod
 from api.models.user import User 
-from api.middleware.middleware import jwt_required
+from api.middleware.middleware import jwt_required, current_user
+from api.services.patch import PatchError, apply_patch, expected_version, patch_values
+from sqlalchemy.orm.exc import StaleDataError
 import jwt
 from decouple import config
 
@@ -51,6 +53,7 @@ def list_payment_methods(data):
             "description": payment_method.description,
             "created_at": str(payment_method.created_at),
             "updated_at": str(payment_method.updated_at),
+            "version": payment_method.version,
         }
         payment_method_list.append(payment_method_info)
 
@@ -117,6 +120,7 @@ def get_payment_method(data,payment_method_id):
         "description": payment_method.description,
         "created_at": str(payment_method.created_at),
         "updated_at": str(payment_method.updated_at),
+        "version": payment_method.version,
     }
 
     return jsonify(payment_method_info), 200
@@ -243,12 +247,12 @@ def update_payment_method(data,payment_method_id):
         user = User.query.filter_by(email=tokenDe['email']).first()
     
         payment_method = PaymentMethod.query.filter_by(id=payment_method_id).first()
-        if payment_method.iduser != user.id:
-            return jsonify({"error": "Metodo de pago ajeno"}), 403
-
         if not payment_method:
             return jsonify({"error": "Payment method not found"}), 404
 
+        if payment_method.iduser != user.id:
+            return jsonify({"error": "Metodo de pago ajeno"}), 403
+
         payment_method.name = name if name is not None else payment_method.name
         payment_method.description = description if description is not None else payment_method.description
 
@@ -256,10 +260,83 @@ def update_payment_method(data,payment_method_id):
 
         return jsonify({"message": "Payment method updated successfully", "id": payment_method.id}), 200
 
+    except StaleDataError:
+        return jsonify({"error": "Payment method was modified meanwhile, reload it"}), 409
     except Exception as e:
         return jsonify({"error": "Error updating payment method: " + str(e)}), 500
 
 
+# Campos que acepta PATCH: (parse, admite null)
+PAYMENT_METHOD_PATCH_FIELDS = {
+    "name": (str, False),
+    "description": (str, True),
+}
+
+
+@payment_method_bp.route("/<int:payment_method_id>", methods=["PATCH"])
+@jwt_required
+def patch_payment_method(data, payment_method_id):
+    """
+    Partially update a payment method, if it is still at the version being edited
+    ---
+    parameters:
+      - name: payment_method_id
+        in: path
+        type: integer
+        required: true
+        description: ID of the payment method to update.
+      - name: If-Match
+        in: header
+        type: string
+        description: Version being edited; or send it as the version field.
+      - name: data
+        in: body
+        required: true
+        description: Only the fields to change; null clears description.
+        schema:
+          type: object
+          properties:
+            version:
+              type: integer
+              description: Version being edited, when If-Match is not sent.
+            name:
+              type: string
+            description:
+              type: string
+
+    responses:
+      200:
+        description: Payment method updated, with its new version.
+      400:
+        description: Invalid or unknown fields.
+      403:
+        description: The payment method belongs to another user.
+      404:
+        description: Payment method not found or deleted.
+      409:
+        description: The payment method changed since that version; the current one is returned.
+      428:
+        description: No version was sent.
+    """
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict):
+        return jsonify({"error": "Expected a JSON object"}), 400
+    try:
+        version = expected_version(data)
+        values = patch_values(data, PAYMENT_METHOD_PATCH_FIELDS)
+        version = apply_patch(PaymentMethod, payment_method_id, current_user().id, values, version)
+        db.session.commit()
+    except PatchError as e:
+        body = {"error": str(e)}
+        if e.version is not None:
+            body["version"] = e.version
+        return jsonify(body), e.status
+
+    response = jsonify({"message": "Payment method updated successfully", "id": payment_method_id, "version": version})
+    response.set_etag(str(version))
+    return response, 200
+
+
 @payment_method_bp.route("/<int:payment_method_id>", methods=["DELETE"])
 @jwt_required
 def delete_payment_method(data, payment_method_id):
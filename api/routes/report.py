@@ -0,0 +1,119 @@
+import concurrent.futures
+import datetime
+import os
+from flask import Blueprint, request, jsonify, send_file
+from decouple import config
+from app import db
+from api.models.category import Category
+from api.models.expense import Expense
+from api.models.month_version import MonthVersion
+from api.models.payment_method import PaymentMethod
+from api.middleware.middleware import jwt_required, current_user
+from api.middleware.ratelimit import rate_limit
+from api.services.unit_of_work import statement_timeout
+from api.events.month_versions import NAMES
+from api.services.statements import FORMATS, cache_path, renderer
+
+report_bp = Blueprint("report", __name__)
+
+# How long a request waits for a fresh render before answering 202
+REPORT_WAIT_SECONDS = config("REPORT_WAIT_SECONDS", default=2.0, cast=float)
+
+
+@report_bp.route("/monthly", methods=["GET"])
+@jwt_required
+@rate_limit(per_user=(1, 10))
+@statement_timeout(15000)
+def monthly_statement(data):
+    """
+    Monthly statement
+    ---
+    parameters:
+      - name: month
+        in: query
+        type: string
+        description: Month of the statement (YYYY-MM), the current one by default.
+      - name: format
+        in: query
+        type: string
+        enum: [csv, pdf]
+        default: pdf
+        description: File format.
+
+    responses:
+      200:
+        description: The statement file, with totals by category and payment method and every expense of the month.
+      202:
+        description: The statement is still being generated; retry after Retry-After seconds.
+        schema:
+          type: object
+          properties:
+            status:
+              type: string
+              description: Always "rendering".
+      400:
+        description: Bad request.
+        schema:
+          type: object
+          properties:
+            error:
+              type: string
+              description: Error message.
+    """
+    fmt = request.args.get("format", "pdf")
+    if fmt not in FORMATS:
+        return jsonify({"error": "format must be csv or pdf"}), 400
+    month = request.args.get("month") or datetime.date.today().strftime("%Y-%m")
+    try:
+        start = datetime.datetime.strptime(month, "%Y-%m").date()
+    except ValueError:
+        return jsonify({"error": "Invalid month, expected YYYY-MM"}), 400
+    month = start.strftime("%Y-%m")
+
+    user = current_user()
+    # Expense writes bump their month, category and payment method writes
+    # the names; either makes a new file, untouched months stay cached
+    versions = dict(
+        db.session.query(MonthVersion.month, MonthVersion.version)
+        .filter(MonthVersion.iduser == user.id, MonthVersion.month.in_([month, NAMES]))
+        .all()
+    )
+    version = "%d.%d" % (versions.get(month, 0), versions.get(NAMES, 0))
+    path = cache_path(user.id, month, version, fmt)
+    download_name = "statement-%s.%s" % (month, fmt)
+
+    if not os.path.exists(path):
+        future = renderer.submit(lambda: load_statement(user, start), fmt, path)
+        try:
+            future.result(timeout=REPORT_WAIT_SECONDS)
+        except concurrent.futures.TimeoutError:
+            response = jsonify({"status": "rendering"})
+            response.status_code = 202
+            response.headers["Retry-After"] = "1"
+            return response
+
+    return send_file(path, mimetype=FORMATS[fmt], as_attachment=True, download_name=download_name)
+
+
+def load_statement(user, start):
+    """Rows of the month as plain strings, ready to be pickled to the pool."""
+    end = (start + datetime.timedelta(days=32)).replace(day=1)
+    categories = dict(db.session.query(Category.id, Category.description).filter(Category.iduser == user.id))
+    payments = dict(db.session.query(PaymentMethod.id, PaymentMethod.name).filter(PaymentMethod.iduser == user.id))
+
+    rows = db.session.execute(
+        db.select(Expense.date, Expense.concept, Expense.idcategory, Expense.idpayment, Expense.amount)
+        .where(Expense.iduser == user.id, Expense.date >= start, Expense.date < end)
+        .order_by(Expense.date, Expense.id)
+    )
+    items = [
+        (
+            str(date),
+            concept,
+            categories.get(idcategory) or "Uncategorized",
+            payments.get(idpayment) or "Unspecified",
+            str(amount),
+        )
+        for date, concept, idcategory, idpayment, amount in rows
+    ]
+    return {"month": start.strftime("%Y-%m"), "user": user.name or user.email, "items": items}
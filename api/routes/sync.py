@@ -0,0 +1,208 @@
+import datetime
+import math
+from flask import Blueprint, request, jsonify
+from decouple import config
+from app import db
+from api.models.category import Category
+from api.models.change_log import ChangeLog
+from api.models.expense import Expense
+from api.models.payment_method import PaymentMethod
+from api.middleware.middleware import jwt_required, current_user
+from api.utils.money import to_cents
+
+sync_bp = Blueprint("sync", __name__)
+
+SYNC_MAX_CHANGES = config("SYNC_MAX_CHANGES", default=1000, cast=int)
+# Transactions can commit out of seq order; changes younger than this are
+# sent but the token doesn't move past them, so a late commit isn't skipped
+SYNC_SETTLE_SECONDS = config("SYNC_SETTLE_SECONDS", default=5, cast=int)
+
+ENTITIES = {
+    "expense": Expense,
+    "category": Category,
+    "payment_method": PaymentMethod,
+}
+
+
+@sync_bp.route("/", methods=["GET"], strict_slashes=False)
+@jwt_required
+def sync(data):
+    """
+    Changes since a sync token
+    ---
+    parameters:
+      - name: since
+        in: query
+        type: string
+        description: Token from the previous sync. Without it a full snapshot is returned.
+    responses:
+      200:
+        description: Changed rows, tombstones and the token for the next sync.
+        schema:
+          type: object
+          properties:
+            expenses:
+              type: array
+              items:
+                type: object
+              description: Created or updated expenses.
+            categories:
+              type: array
+              items:
+                type: object
+              description: Created or updated categories.
+            payment_methods:
+              type: array
+              items:
+                type: object
+              description: Created or updated payment methods.
+            deleted:
+              type: object
+              description: IDs deleted since the token, per entity.
+            token:
+              type: string
+              description: Pass it as since on the next sync.
+            has_more:
+              type: boolean
+              description: More changes are waiting, sync again right away.
+            retry_after:
+              type: integer
+              description: >
+                Present when recent changes held the token back; sync again
+                after these seconds (also sent as Retry-After).
+      400:
+        description: Invalid token.
+        schema:
+          type: object
+          properties:
+            error:
+              type: string
+              description: Error message.
+    """
+    since = request.args.get("since")
+    if since is not None and not since.isdigit():
+        return jsonify({"error": "Invalid sync token"}), 400
+
+    iduser = current_user().id
+    if since is None:
+        return jsonify(snapshot(iduser)), 200
+    result = changes_since(iduser, int(since))
+    response = jsonify(result)
+    if "retry_after" in result:
+        response.headers["Retry-After"] = str(result["retry_after"])
+    return response, 200
+
+
+def snapshot(iduser):
+    # Take the token first: anything written during the snapshot is resent
+    token = settled_seq(iduser, 0)
+    return {
+        "expenses": [serialize("expense", row) for row in Expense.query.filter_by(iduser=iduser)],
+        "categories": [serialize("category", row) for row in Category.query.filter_by(iduser=iduser, is_delete=0)],
+        "payment_methods": [
+            serialize("payment_method", row) for row in PaymentMethod.query.filter_by(iduser=iduser, is_delete=0)
+        ],
+        "deleted": {entity: [] for entity in ENTITIES},
+        "token": str(token),
+        "has_more": False,
+    }
+
+
+def changes_since(iduser, since):
+    rows = db.session.execute(
+        db.select(ChangeLog.seq, ChangeLog.entity, ChangeLog.entity_id, ChangeLog.op, ChangeLog.created_at)
+        .where(ChangeLog.iduser == iduser, ChangeLog.seq > since)
+        .order_by(ChangeLog.seq)
+        .limit(SYNC_MAX_CHANGES + 1)
+    ).all()
+    has_more = len(rows) > SYNC_MAX_CHANGES
+    rows = rows[:SYNC_MAX_CHANGES]
+
+    # Only the last operation on each row matters
+    latest = {}
+    for seq, entity, entity_id, op, created_at in rows:
+        latest[(entity, entity_id)] = op
+
+    result = {"expenses": [], "categories": [], "payment_methods": []}
+    deleted = {entity: [] for entity in ENTITIES}
+    for entity, model in ENTITIES.items():
+        ids = [entity_id for (kind, entity_id), op in latest.items() if kind == entity and op != "deleted"]
+        deleted[entity] = [entity_id for (kind, entity_id), op in latest.items() if kind == entity and op == "deleted"]
+        if not ids:
+            continue
+        found = set()
+        for row in model.query.filter(model.id.in_(ids), model.iduser == iduser):
+            if getattr(row, "is_delete", 0):
+                continue
+            found.add(row.id)
+            result[plural(entity)].append(serialize(entity, row))
+        # Deleted after the last change we read
+        deleted[entity].extend(entity_id for entity_id in ids if entity_id not in found)
+
+    settle = datetime.datetime.utcnow() - datetime.timedelta(seconds=SYNC_SETTLE_SECONDS)
+    token = since
+    unsettled = None
+    for seq, _, _, _, created_at in rows:
+        if created_at > settle:
+            unsettled = created_at
+            break
+        token = seq
+
+    result["deleted"] = deleted
+    result["token"] = str(token)
+    if unsettled is None:
+        result["has_more"] = has_more
+    else:
+        # Syncing again right away would read the same batch from the same
+        # token; wait for the first change the token stopped at to settle
+        result["has_more"] = False
+        result["retry_after"] = max(1, math.ceil((unsettled - settle).total_seconds()))
+    return result
+
+
+def settled_seq(iduser, default):
+    settle = datetime.datetime.utcnow() - datetime.timedelta(seconds=SYNC_SETTLE_SECONDS)
+    seq = db.session.execute(
+        db.select(db.func.max(ChangeLog.seq)).where(ChangeLog.iduser == iduser, ChangeLog.created_at <= settle)
+    ).scalar()
+    return seq if seq is not None else default
+
+
+def plural(entity):
+    return {"expense": "expenses", "category": "categories", "payment_method": "payment_methods"}[entity]
+
+
+def serialize(entity, row):
+    if entity == "expense":
+        return {
+            "id": row.id,
+            "concept": row.concept,
+            "idcategory": row.idcategory,
+            "amount": float(row.amount),
+            "amount_cents": to_cents(row.amount),
+            "description": row.description,
+            "created_at": str(row.created_at),
+            "updated_at": str(row.updated_at),
+            "date": str(row.date),
+            "idpayment": row.idpayment,
+            "priority": row.priority,
+            "version": row.version,
+        }
+    if entity == "category":
+        return {
+            "id": row.id,
+            "description": row.description,
+            "relevance": row.relevance,
+            "meta": row.meta,
+            "created_at": str(row.created_at),
+            "updated_at": str(row.updated_at),
+            "version": row.version,
+        }
+    return {
+        "id": row.id,
+        "name": row.name,
+        "description": row.description,
+        "created_at": str(row.created_at),
+        "updated_at": str(row.updated_at),
+        "version": row.version,
+    }
@@ -1,14 +1,18 @@
 from flask import Blueprint, request, jsonify
 from werkzeug.security import generate_password_hash, check_password_hash
 from api.models.user import User
+from api.models.user_shard import UserShard
 from app import db
 from decouple import config
 import jwt
+from urllib.parse import urlencode
 
 user_bp = Blueprint("user", __name__)
 SECRET_KEY = config("SECRET_KEY")
 
-from api.middleware.middleware import jwt_required
+from api.middleware.middleware import jwt_required, current_user
+from api.services.shard_directory import SHARDING_ENABLED, assign_shard
+from api.services.user_directory import ADMIN_USER_IDS, USER_PAGE_SIZE, USER_PAGE_MAX, directory_page, user_counts
 
 
 @user_bp.route("/", methods=["POST"])
@@ -66,6 +70,10 @@ def registro():
 
       new_user = User(name=name, password=hashed_password, email=email)
       db.session.add(new_user)
+      if SHARDING_ENABLED:
+        # Asigna el shard que guardará los gastos, categorías y métodos de pago
+        db.session.flush()
+        db.session.add(UserShard(iduser=new_user.id, shard=assign_shard(new_user.id)))
       db.session.commit()
 
       return jsonify({"message": "Usuario registrado exitosamente"})
@@ -127,7 +135,6 @@ def update_user(data, user_id):
     # verificacion de token
     token = request.headers.get('Authorization').split(' ')[1]
     tokenDe = jwt.decode(token, SECRET_KEY, algorithms=['HS256'])
-    print(tokenDe)
     if not user:
       return jsonify({"message": "Usuario no encontrado"}), 404
     if user.email != tokenDe['email']:
@@ -250,11 +257,35 @@ def login():
 @jwt_required
 def list_users(data):
     """
-    Listar todos los usuarios
+    Directorio de usuarios (solo administradores), paginado por cursor
     ---
+    parameters:
+      - name: email
+        in: query
+        type: string
+        description: Prefijo del correo; ordena por correo.
+      - name: name
+        in: query
+        type: string
+        description: Prefijo del nombre; ordena por nombre.
+      - name: deleted
+        in: query
+        type: integer
+        enum: [0, 1]
+        default: 0
+        description: 1 lista los usuarios eliminados.
+      - name: after
+        in: query
+        type: string
+        description: Cursor de la página siguiente, tomado del header Link.
+      - name: limit
+        in: query
+        type: integer
+        default: 50
+        description: Usuarios por página (máximo USER_PAGE_MAX).
     responses:
       200:
-        description: Lista de usuarios.
+        description: Una página de usuarios. El header Link (rel="next") trae la siguiente y X-Total-Count el total aproximado (cacheado USER_COUNT_TTL segundos).
         schema:
           type: array
           items:
@@ -269,6 +300,8 @@ def list_users(data):
               email:
                 type: string
                 description: Correo electrónico del usuario.
+      400:
+        description: Parámetros inválidos.
       401:
         description: Acceso no autorizado.
         schema:
@@ -277,17 +310,32 @@ def list_users(data):
             message:
               type: string
               description: Mensaje de error.
+      403:
+        description: El usuario no es administrador.
     """
-    # Obtiene todos los usuarios de la base de datos
-    users = User.query.all()
+    if current_user().id not in ADMIN_USER_IDS:
+        return jsonify({"message": "Solo los administradores pueden listar usuarios"}), 403
 
-    # Crea una lista de diccionarios con la información de cada usuario
-    user_list = []
-    for user in users:
-        user_info = {"user_id":user.id, "name": user.name, "email": user.email}
-        user_list.append(user_info)
-
-    return jsonify(user_list)
+    if request.args.get("email") and request.args.get("name"):
+        return jsonify({"message": "Busque por email o por name, no ambos"}), 400
+    field = "email" if "email" in request.args else "name" if "name" in request.args else None
+    try:
+        limit = min(max(int(request.args.get("limit", USER_PAGE_SIZE)), 1), USER_PAGE_MAX)
+        deleted = request.args.get("deleted", "0") == "1"
+        users, cursor = directory_page(
+            field, request.args.get(field) if field else None, deleted, request.args.get("after"), limit
+        )
+    except ValueError as e:
+        return jsonify({"message": "Parámetros inválidos: " + str(e)}), 400
+
+    user_list = [{"user_id": user.id, "name": user.name, "email": user.email} for user in users]
+    response = jsonify(user_list)
+    response.headers["X-Total-Count"] = str(user_counts.get(deleted))
+    if cursor is not None:
+        args = request.args.to_dict()
+        args["after"] = cursor
+        response.headers["Link"] = '<%s?%s>; rel="next"' % (request.base_url, urlencode(args))
+    return response
 
 
 @user_bp.route("/<int:user_id>", methods=["GET"])
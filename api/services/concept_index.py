@@ -0,0 +1,151 @@
+import bisect
+import collections
+import datetime
+import heapq
+import threading
+from decouple import config
+from api.events.bus import bus
+from api.events.versions import event_fits, load_at_version, versions
+from api.models.concept_count import ConceptCount
+from api.utils.text import normalize_concept
+
+CONCEPT_INDEX_MAX_BYTES = config("CONCEPT_INDEX_MAX_BYTES", default=32 * 1024 * 1024, cast=int)
+# A concept used this many days ago weighs half as much as one used today
+CONCEPT_RECENCY_HALF_LIFE = config("CONCEPT_RECENCY_HALF_LIFE", default=30, cast=int)
+
+# Rough per-entry overhead of the list slot, dict entry and small objects
+ENTRY_OVERHEAD = 200
+
+
+class ConceptIndex:
+    """
+    One user's concepts as a sorted array of normalized keys.
+
+    A prefix query is two bisections plus a top-k over the matching slice.
+    """
+
+    def __init__(self):
+        self.keys = []
+        self.entries = {}
+        self.size = 0
+        # User version the index reflects, see api/events/versions.py
+        self.version = None
+
+    def add(self, key, concept, last_used, delta):
+        entry = self.entries.get(key)
+        if entry is None:
+            if delta <= 0:
+                return
+            bisect.insort(self.keys, key)
+            entry = self.entries[key] = [concept, 0, last_used]
+            self.size += ENTRY_OVERHEAD + 2 * len(key) + 2 * len(concept)
+        entry[1] += delta
+        if delta > 0:
+            entry[0] = concept
+        if delta >= 0 and last_used:
+            entry[2] = max(entry[2], last_used) if entry[2] else last_used
+
+    def suggest(self, prefix, limit, today):
+        start = bisect.bisect_left(self.keys, prefix)
+        end = bisect.bisect_left(self.keys, prefix + "\uffff", start)
+
+        def score(key):
+            concept, count, last_used = self.entries[key]
+            age = (today - last_used).days if last_used else 365
+            return count * 0.5 ** (max(age, 0) / CONCEPT_RECENCY_HALF_LIFE)
+
+        matches = (key for key in self.keys[start:end] if self.entries[key][1] > 0)
+        best = heapq.nlargest(limit, matches, key=score)
+        return [
+            {"concept": self.entries[key][0], "count": self.entries[key][1], "last_used": str(self.entries[key][2])}
+            for key in best
+        ]
+
+
+class ConceptIndexCache:
+    """Per-user indexes built on first use and LRU-evicted past max_bytes."""
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self._users = collections.OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+
+    def get(self, iduser):
+        current = versions.version(iduser)
+        with self._lock:
+            index = self._users.get(iduser)
+            if index is not None and index.version == current:
+                self._users.move_to_end(iduser)
+                return index
+
+        index, index.version = load_at_version(iduser, lambda: self._load(iduser))
+
+        with self._lock:
+            previous = self._users.pop(iduser, None)
+            if previous is not None:
+                self._size -= previous.size
+            if index.version is not None:
+                self._users[iduser] = index
+                self._size += index.size
+                self._evict()
+        return index
+
+    @staticmethod
+    def _load(iduser):
+        index = ConceptIndex()
+        for concept in ConceptCount.query.filter(ConceptCount.iduser == iduser, ConceptCount.count > 0):
+            index.add(concept.concept_key, concept.concept, concept.last_used, concept.count)
+        return index
+
+    def apply(self, event, changes):
+        """Apply an event's (concept, last_used, delta) changes to a cached index."""
+        with self._lock:
+            index = self._users.get(event["iduser"])
+            if index is None:
+                return
+            fit = event_fits(index.version, event)
+            if fit == "drop":
+                self._users.pop(event["iduser"])
+                self._size -= index.size
+                return
+            if fit == "skip":
+                return
+            before = index.size
+            for concept, last_used, delta in changes:
+                index.add(normalize_concept(concept), concept.strip(), last_used, delta)
+            index.version = event["version"]
+            self._size += index.size - before
+            self._evict()
+
+    def _evict(self):
+        while self._size > self.max_bytes and len(self._users) > 1:
+            _, index = self._users.popitem(last=False)
+            self._size -= index.size
+
+
+concept_index = ConceptIndexCache(CONCEPT_INDEX_MAX_BYTES)
+
+
+@bus.receiver
+def update_concept_index(event):
+    if event["entity"] != "expense" or event["op"] == "imported":
+        # Still moves the index to the event's version, or drops it
+        concept_index.apply(event, [])
+        return
+    fields = event.get("fields") or {}
+    previous = event.get("previous")
+    if event["op"] == "created":
+        changes = [(fields, 1)]
+    elif event["op"] == "deleted":
+        changes = [(fields, -1)]
+    elif previous and normalize_concept(previous["concept"]) != normalize_concept(fields["concept"]):
+        changes = [(previous, -1), (fields, 1)]
+    else:
+        changes = [(fields, 0)]
+
+    concept_index.apply(event, [
+        (values["concept"], datetime.date.fromisoformat(values["date"][:10]) if values.get("date") else None, delta)
+        for values, delta in changes
+        if values.get("concept")
+    ])
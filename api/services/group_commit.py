@@ -0,0 +1,160 @@
+import logging
+import os
+import queue
+import threading
+import time
+from decouple import config
+from app import app, db
+from api.services.sharding import current_shard
+from api.services.shard_directory import using_shard
+
+GROUP_COMMIT_ENABLED = config("EXPENSE_GROUP_COMMIT", default=False, cast=bool)
+GROUP_COMMIT_WAIT_MS = config("GROUP_COMMIT_WAIT_MS", default=5, cast=int)
+GROUP_COMMIT_MAX_BATCH = config("GROUP_COMMIT_MAX_BATCH", default=64, cast=int)
+GROUP_COMMIT_TIMEOUT_MS = config("GROUP_COMMIT_TIMEOUT_MS", default=1000, cast=int)
+
+logger = logging.getLogger(__name__)
+
+
+class GroupCommitTimeout(Exception):
+    pass
+
+
+class _Pending:
+    __slots__ = ("model", "values", "shard", "done", "id", "error", "state")
+
+    def __init__(self, model, values, shard):
+        self.model = model
+        self.values = values
+        self.shard = shard
+        self.done = threading.Event()
+        self.id = None
+        self.error = None
+        # queued -> flushing, or queued -> cancelled by a request that gave up
+        self.state = "queued"
+
+
+class GroupCommitter:
+    """
+    Collects inserts from concurrent requests and commits them together.
+
+    A single flusher thread per worker process waits up to wait_ms after the
+    first queued insert (or until max_batch are queued), then writes the batch
+    in one transaction. Every row goes in its own SAVEPOINT, so a bad row only
+    fails its own request and still gets a per-request error.
+
+    A request that times out cancels its row if the flusher hasn't taken it
+    yet; once taken, the row is being written and the request waits up to
+    another timeout for its ID, then gives up saying it may have been saved.
+    """
+
+    def __init__(self, wait_ms=GROUP_COMMIT_WAIT_MS, max_batch=GROUP_COMMIT_MAX_BATCH,
+                 timeout_ms=GROUP_COMMIT_TIMEOUT_MS):
+        self.wait = wait_ms / 1000.0
+        self.max_batch = max_batch
+        self.timeout = timeout_ms / 1000.0
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        # Guards _Pending.state between the requests and the flusher
+        self._state_lock = threading.Lock()
+        self._pid = None
+
+    def submit(self, model, values):
+        """Queue model(**values) for insertion and block until its ID is known."""
+        self._ensure_flusher()
+        pending = _Pending(model, values, current_shard())
+        self._queue.put(pending)
+        if not pending.done.wait(self.timeout):
+            with self._state_lock:
+                cancelled = pending.state == "queued"
+                if cancelled:
+                    pending.state = "cancelled"
+            if cancelled:
+                raise GroupCommitTimeout("Group commit did not finish in %d ms" % (self.timeout * 1000))
+            if not pending.done.wait(self.timeout):
+                raise GroupCommitTimeout(
+                    "Group commit did not finish in %d ms, the expense may have been saved" % (self.timeout * 2000)
+                )
+        if pending.error is not None:
+            raise pending.error
+        return pending.id
+
+    def _ensure_flusher(self):
+        # Threads don't survive fork(), start one per gunicorn worker
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid != os.getpid():
+                self._queue = queue.Queue()
+                threading.Thread(target=self._run, name="group-commit", daemon=True).start()
+                self._pid = os.getpid()
+
+    def _run(self):
+        while True:
+            batch = [self._queue.get()]
+            deadline = time.monotonic() + self.wait
+            while len(batch) < self.max_batch:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            with self._state_lock:
+                batch = [pending for pending in batch if pending.state == "queued"]
+                for pending in batch:
+                    pending.state = "flushing"
+            # One transaction per shard present in the batch
+            shards = {}
+            for pending in batch:
+                shards.setdefault(pending.shard, []).append(pending)
+            for shard, rows in shards.items():
+                try:
+                    self._flush(shard, rows)
+                except Exception as e:
+                    # Setting up the context failed; the thread must live on
+                    logger.exception("Group commit on shard %s failed", shard)
+                    for pending in rows:
+                        pending.id = None
+                        pending.error = e
+                finally:
+                    for pending in rows:
+                        pending.done.set()
+
+    def _flush(self, shard, batch):
+        written = []
+        with app.app_context(), using_shard(shard):
+            try:
+                for pending in batch:
+                    try:
+                        with db.session.begin_nested():
+                            row = pending.model(**pending.values)
+                            db.session.add(row)
+                        pending.id = row.id
+                        written.append(pending)
+                    except Exception as e:
+                        pending.error = e
+                db.session.commit()
+            except Exception as e:
+                db.session.rollback()
+                for pending in written:
+                    pending.id = None
+                    pending.error = e
+
+
+expense_committer = GroupCommitter()
+
+
+def in_explicit_transaction(session):
+    """
+    Whether a write now belongs to a transaction the caller commits later.
+
+    Inside an atomic /batch, or with writes not committed yet, the insert has
+    to go in the caller's transaction: the flusher's own would commit it even
+    if the caller then rolls back.
+    """
+    return bool(
+        session.info.get("hold_changes") or session.in_nested_transaction()
+        or session.new or session.dirty or session.deleted
+    )
@@ -0,0 +1,494 @@
+"""
+Bank and credit card statement import.
+
+Files are spooled to IMPORT_DIR by the upload and parsed as a stream by a
+worker thread, so only one chunk of lines is in memory at a time. Every
+line gets a fingerprint (the OFX FITID, or date + amount + concept and how
+many times that same line appeared before it in the file), checked against
+import_fingerprint per chunk; re-importing an overlapping statement only
+inserts the lines not seen before.
+
+Each chunk is one executemany INSERT, with the counters and change log
+updated once for the whole chunk and a single "imported" event.
+"""
+import collections
+import csv
+import datetime
+import decimal
+import hashlib
+import json
+import os
+import re
+import socket
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from decouple import config
+from sqlalchemy import func, insert, select, update
+from sqlalchemy.exc import IntegrityError
+from app import app, db
+from api.events.tracking import EXPENSE_FIELDS, Change, record_changes
+from api.models.expense import Expense, fingerprint as expense_fingerprint
+from api.models.import_fingerprint import ImportFingerprint
+from api.models.import_job import ImportJob
+from api.models.import_mapping import ImportMapping
+from api.services.sharding import DEFAULT_SHARD
+from api.services.shard_directory import SHARD_NAMES, using_shard
+from api.utils.money import from_cents, to_cents
+from api.utils.text import normalize_concept
+
+IMPORT_DIR = config("IMPORT_DIR", default=os.path.join(tempfile.gettempdir(), "finanzcord-imports"))
+IMPORT_MAX_BYTES = config("IMPORT_MAX_BYTES", default=20 * 1024 * 1024, cast=int)
+IMPORT_CHUNK = config("IMPORT_CHUNK", default=500, cast=int)
+IMPORT_THREADS = config("IMPORT_THREADS", default=2, cast=int)
+# A job of another host that made no progress this long is taken as orphaned
+IMPORT_STALE_SECONDS = config("IMPORT_STALE_SECONDS", default=600, cast=int)
+# Row errors kept on the job, the rest are only counted
+IMPORT_MAX_ERRORS = 20
+
+FORMATS = ("csv", "ofx")
+
+DEFAULT_MAPPING = {
+    "delimiter": ",",
+    "encoding": "utf-8-sig",
+    # Lines before the header (bank name, account number...)
+    "skip_rows": 0,
+    # Without a header, columns are given by position (0-based)
+    "header": True,
+    "date": "date",
+    "date_format": "%Y-%m-%d",
+    # Signed amount; "expenses" says which sign is spending, the other is skipped
+    "amount": "amount",
+    "expenses": "negative",
+    # Or a column holding only the spent amount; rows without one are skipped
+    "debit": None,
+    "decimal": ".",
+    "concept": "concept",
+    "description": None,
+    "idcategory": None,
+}
+
+
+class RowError(ValueError):
+    pass
+
+
+def parse_mapping(data):
+    """A stored mapping from a PUT body, over the defaults; ValueError if invalid."""
+    if not isinstance(data, dict):
+        raise ValueError("Expected a JSON object")
+    unknown = set(data) - set(DEFAULT_MAPPING)
+    if unknown:
+        raise ValueError("Unknown keys: " + ", ".join(sorted(unknown)))
+    mapping = dict(DEFAULT_MAPPING, **data)
+    if not isinstance(mapping["delimiter"], str) or len(mapping["delimiter"]) != 1:
+        raise ValueError("delimiter must be one character")
+    if mapping["decimal"] not in (".", ","):
+        raise ValueError('decimal must be "." or ","')
+    if mapping["expenses"] not in ("negative", "positive"):
+        raise ValueError('expenses must be "negative" or "positive"')
+    if not isinstance(mapping["skip_rows"], int) or mapping["skip_rows"] < 0:
+        raise ValueError("skip_rows must be a non-negative integer")
+    try:
+        "".encode(mapping["encoding"])
+    except (LookupError, TypeError):
+        raise ValueError("Unknown encoding")
+    column_type = str if mapping["header"] else int
+    for key in ("date", "concept", "debit" if mapping["debit"] is not None else "amount"):
+        if not isinstance(mapping[key], column_type):
+            raise ValueError("%s must be a column %s" % (key, "name" if mapping["header"] else "position"))
+    return mapping
+
+
+def stored_mapping(idpayment):
+    """The payment method's saved mapping, or the defaults."""
+    stored = db.session.get(ImportMapping, idpayment)
+    return json.loads(stored.mapping) if stored else dict(DEFAULT_MAPPING)
+
+
+def job_path(shard, job_id):
+    """Upload of a job; ids are per shard and the shards may share IMPORT_DIR."""
+    return os.path.join(IMPORT_DIR, "%s-%d.upload" % (shard or DEFAULT_SHARD, job_id))
+
+
+def spool(stream, shard, job_id):
+    """Copy the upload to disk in blocks; ValueError past IMPORT_MAX_BYTES."""
+    os.makedirs(IMPORT_DIR, exist_ok=True)
+    path = job_path(shard, job_id)
+    size = 0
+    with open(path, "wb") as output:
+        while True:
+            block = stream.read(64 * 1024)
+            if not block:
+                break
+            size += len(block)
+            if size > IMPORT_MAX_BYTES:
+                output.close()
+                os.unlink(path)
+                raise ValueError("The file is larger than %d bytes" % IMPORT_MAX_BYTES)
+            output.write(block)
+    return path
+
+
+def parse_amount(text, separator):
+    text = (text or "").strip().replace(" ", "").replace("$", "")
+    if not text:
+        return None
+    if separator == ",":
+        text = text.replace(".", "").replace(",", ".")
+    else:
+        text = text.replace(",", "")
+    # Accounting negatives: (12.50)
+    if text.startswith("(") and text.endswith(")"):
+        text = "-" + text[1:-1]
+    try:
+        return from_cents(to_cents(text))
+    except decimal.InvalidOperation:
+        raise RowError("Invalid amount %r" % text)
+    except ValueError as e:
+        raise RowError(str(e))
+
+
+def csv_lines(path, mapping):
+    """
+    (line number, row) per line of the file.
+
+    row is (date, amount, concept, description, key) for spending, None for
+    the lines that aren't (income, payments) or a RowError.
+    """
+    with open(path, newline="", encoding=mapping["encoding"], errors="replace") as source:
+        reader = csv.reader(source, delimiter=mapping["delimiter"])
+        for _ in range(mapping["skip_rows"]):
+            next(reader, None)
+        if mapping["header"]:
+            header = [name.strip() for name in next(reader, [])]
+            keys = ("date", "concept", "description", "amount" if mapping["debit"] is None else "debit")
+            wanted = [mapping[key] for key in keys if mapping[key] is not None]
+            missing = [name for name in wanted if name not in header]
+            if missing:
+                raise ValueError("Columns not found in the header: " + ", ".join(missing))
+            position = {name: index for index, name in enumerate(header)}
+        else:
+            position = None
+
+        def cell(row, key):
+            column = mapping[key]
+            if column is None:
+                return None
+            index = position[column] if position is not None else column
+            return row[index].strip() if index < len(row) else None
+
+        for row in reader:
+            line = reader.line_num
+            if not any(field.strip() for field in row):
+                continue
+            try:
+                try:
+                    date = datetime.datetime.strptime(cell(row, "date") or "", mapping["date_format"]).date()
+                except ValueError:
+                    raise RowError("Invalid date %r" % cell(row, "date"))
+                if mapping["debit"] is not None:
+                    amount = parse_amount(cell(row, "debit"), mapping["decimal"])
+                    amount = abs(amount) if amount else None
+                else:
+                    amount = parse_amount(cell(row, "amount"), mapping["decimal"])
+                    if amount is not None and mapping["expenses"] == "negative":
+                        amount = -amount
+                    amount = amount if amount and amount > 0 else None
+                concept = cell(row, "concept")
+                if not concept:
+                    raise RowError("Empty concept")
+            except RowError as e:
+                yield line, e
+                continue
+            if amount is None:
+                yield line, None
+                continue
+            key = "csv|%s|%s|%s" % (date.isoformat(), amount, normalize_concept(concept))
+            yield line, (date, amount, concept, cell(row, "description"), key)
+
+
+_OFX_TAG = re.compile(r"<(/?)([A-Za-z0-9.]+)>([^<]*)")
+
+
+def ofx_lines(path):
+    """
+    Same as csv_lines for an OFX file, SGML (1.x) or XML (2.x).
+
+    Tags are scanned from 64 KB blocks, so the file doesn't need line breaks
+    and is never read whole. Credits (positive TRNAMT) are skipped.
+    """
+    with open(path, encoding="latin-1") as source:
+        buffer = ""
+        transaction = None
+        number = 0
+        while True:
+            block = source.read(64 * 1024)
+            buffer += block
+            # Keep the last tag, its value may go on in the next block
+            end = buffer.rfind("<") if block else len(buffer)
+            if end < 0:
+                end = len(buffer)
+            for match in _OFX_TAG.finditer(buffer, 0, end):
+                closing, tag, value = match.group(1), match.group(2).upper(), match.group(3).strip()
+                if tag == "STMTTRN":
+                    if closing and transaction is not None:
+                        number += 1
+                        yield ofx_transaction(number, transaction)
+                        transaction = None
+                    elif not closing:
+                        transaction = {}
+                elif transaction is not None and not closing and value:
+                    transaction[tag] = value
+            buffer = buffer[end:]
+            if not block:
+                break
+
+
+def ofx_transaction(number, fields):
+    try:
+        try:
+            date = datetime.datetime.strptime(fields.get("DTPOSTED", "")[:8], "%Y%m%d").date()
+        except ValueError:
+            raise RowError("Invalid DTPOSTED %r" % fields.get("DTPOSTED"))
+        amount = parse_amount(fields.get("TRNAMT"), ".")
+        concept = fields.get("NAME") or fields.get("MEMO")
+        if not concept:
+            raise RowError("Transaction without NAME or MEMO")
+    except RowError as e:
+        return number, e
+    if amount is None or amount >= 0:
+        return number, None
+    memo = fields.get("MEMO") if fields.get("NAME") else None
+    if fields.get("FITID"):
+        key = "ofx|" + fields["FITID"]
+    else:
+        key = "ofx|%s|%s|%s" % (date.isoformat(), -amount, normalize_concept(concept))
+    return number, (date, -amount, concept, memo, key)
+
+
+def fingerprint(idpayment, key, occurrence):
+    text = "%d|%s|%d" % (idpayment, key, occurrence)
+    return hashlib.blake2b(text.encode("utf-8"), digest_size=16).hexdigest()
+
+
+def worker_id():
+    return "%s:%d" % (socket.gethostname(), os.getpid())
+
+
+def worker_alive(worker):
+    """
+    Whether the process that holds a job still runs, None if it's on another host.
+
+    Only meaningful while this process has no jobs of its own: one holding
+    our own pid belonged to an earlier process.
+    """
+    host, _, pid = (worker or "").rpartition(":")
+    if host != socket.gethostname() or not pid.isdigit():
+        return None
+    if int(pid) == os.getpid():
+        return False
+    try:
+        os.kill(int(pid), 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+class Importer:
+    """Runs import jobs on a small thread pool, one transaction per chunk."""
+
+    def __init__(self, threads):
+        self.executor = ThreadPoolExecutor(max_workers=threads, thread_name_prefix="import")
+
+    def submit(self, job_id, shard, mapping):
+        self.executor.submit(self.run, job_id, shard, mapping)
+
+    def run(self, job_id, shard, mapping):
+        with app.app_context(), using_shard(shard):
+            claimed = db.session.execute(
+                update(ImportJob)
+                .where(ImportJob.id == job_id, ImportJob.status == "queued", ImportJob.worker == worker_id())
+                .values(status="running", updated_at=datetime.datetime.utcnow())
+            ).rowcount
+            db.session.commit()
+            if not claimed:
+                # Resumed by another worker meanwhile
+                return
+            job = db.session.get(ImportJob, job_id)
+            progress = collections.Counter()
+            errors = []
+            try:
+                self.process(job, job_path(shard, job_id), mapping, progress, errors)
+                job.status = "done"
+            except Exception as e:
+                db.session.rollback()
+                job = db.session.get(ImportJob, job_id)
+                job.status = "failed"
+                errors.insert(0, str(e))
+            finally:
+                self.save_progress(job, progress, errors)
+                job.finished_at = datetime.datetime.utcnow()
+                db.session.commit()
+                try:
+                    os.unlink(job_path(shard, job_id))
+                except OSError:
+                    pass
+
+    def process(self, job, path, mapping, progress, errors):
+        lines = ofx_lines(path) if job.format == "ofx" else csv_lines(path, mapping)
+        # Occurrences of each identical line so far: the second identical
+        # coffee of the day is a new expense, unless an earlier import had two
+        occurrences = collections.Counter()
+        chunk = []
+        for number, parsed in lines:
+            progress["rows_read"] += 1
+            if isinstance(parsed, RowError):
+                progress["failed"] += 1
+                if len(errors) < IMPORT_MAX_ERRORS:
+                    errors.append("line %d: %s" % (number, parsed))
+                continue
+            if parsed is None:
+                progress["skipped"] += 1
+                continue
+            key = parsed[4]
+            occurrences[key] += 1
+            chunk.append((fingerprint(job.idpayment, key, occurrences[key]), parsed))
+            if len(chunk) >= IMPORT_CHUNK:
+                self.write_chunk(job, mapping, chunk, progress, errors)
+                chunk = []
+        self.write_chunk(job, mapping, chunk, progress, errors)
+
+    def write_chunk(self, job, mapping, chunk, progress, errors):
+        """Insert the chunk's new lines and the job's progress in one commit."""
+        for attempt in (1, 2):
+            try:
+                inserted, duplicates = self.insert_new(job, mapping, chunk)
+                progress["inserted"] += inserted
+                progress["duplicates"] += duplicates
+                self.save_progress(job, progress, errors)
+                db.session.commit()
+                return
+            except IntegrityError:
+                # Another import of the same lines committed first; the
+                # second pass sees its fingerprints and skips them
+                db.session.rollback()
+                if attempt == 2:
+                    raise
+
+    def save_progress(self, job, progress, errors):
+        for name in ("rows_read", "inserted", "duplicates", "skipped", "failed"):
+            setattr(job, name, progress[name])
+        job.errors = json.dumps(errors) if errors else None
+        job.updated_at = datetime.datetime.utcnow()
+
+    def resume_in_background(self):
+        self.executor.submit(self.resume_orphaned)
+
+    def resume_orphaned(self):
+        """
+        Requeue the jobs left queued or running by a worker that is gone.
+
+        Called as each worker starts. A job is orphaned when its worker on
+        this host no longer runs, or, on another host, when it made no
+        progress for IMPORT_STALE_SECONDS. A resumed job reads its file from
+        the start: the lines already imported are duplicates by their
+        fingerprints. One whose file isn't on this host fails.
+        """
+        stale = datetime.datetime.utcnow() - datetime.timedelta(seconds=IMPORT_STALE_SECONDS)
+        for shard in SHARD_NAMES:
+            try:
+                with app.app_context(), using_shard(shard):
+                    jobs = ImportJob.query.filter(ImportJob.status.in_(("queued", "running"))).all()
+                    for job in jobs:
+                        alive = worker_alive(job.worker)
+                        if alive or (alive is None and (job.updated_at or job.created_at) > stale):
+                            continue
+                        self.resume(job, shard)
+            except Exception as e:
+                app.logger.warning("Could not resume the imports of shard %s: %s", shard, e)
+
+    def resume(self, job, shard):
+        claimed = db.session.execute(
+            update(ImportJob)
+            .where(
+                ImportJob.id == job.id,
+                ImportJob.status == job.status,
+                ImportJob.worker.is_not_distinct_from(job.worker),
+            )
+            .values(status="queued", worker=worker_id(), updated_at=datetime.datetime.utcnow())
+        ).rowcount
+        db.session.commit()
+        if not claimed:
+            return
+        db.session.refresh(job)
+        if os.path.exists(job_path(shard, job.id)):
+            app.logger.info("Resuming import %d left by a stopped worker", job.id)
+            self.submit(job.id, shard, stored_mapping(job.idpayment))
+            return
+        job.status = "failed"
+        job.errors = json.dumps(["The worker importing this file stopped and the upload is gone, upload it again"])
+        job.finished_at = datetime.datetime.utcnow()
+        db.session.commit()
+
+    def insert_new(self, job, mapping, chunk):
+        if not chunk:
+            return 0, 0
+        known = set(db.session.execute(
+            select(ImportFingerprint.fingerprint).where(
+                ImportFingerprint.iduser == job.iduser,
+                ImportFingerprint.fingerprint.in_([print_ for print_, _ in chunk]),
+            )
+        ).scalars())
+        new = [(print_, parsed) for print_, parsed in chunk if print_ not in known]
+        if not new:
+            return 0, len(chunk)
+        rows = [
+            {
+                "concept": concept[:255],
+                "amount": amount,
+                "description": description,
+                "date": date,
+                "idcategory": mapping.get("idcategory"),
+                "idpayment": job.idpayment,
+                "iduser": job.iduser,
+                "fingerprint": expense_fingerprint(concept[:255], amount, date, job.idpayment),
+            }
+            for _, (date, amount, concept, description, _) in new
+        ]
+
+        # One executemany INSERT, without RETURNING (MySQL has none): the
+        # ids are read back by fingerprint past the user's last id, in order
+        last_id = db.session.execute(select(func.max(Expense.id)).where(Expense.iduser == job.iduser)).scalar()
+        db.session.execute(insert(Expense), rows)
+        ids = collections.defaultdict(collections.deque)
+        for id_, print_ in db.session.execute(
+            select(Expense.id, Expense.fingerprint)
+            .where(
+                Expense.iduser == job.iduser,
+                Expense.id > (last_id or 0),
+                Expense.fingerprint.in_({row["fingerprint"] for row in rows}),
+            )
+            .order_by(Expense.id)
+        ):
+            ids[print_].append(id_)
+        for row in rows:
+            row["id"] = ids[row["fingerprint"]].popleft()
+
+        # Bulk inserts skip the unit of work: the counters and change log
+        # get every row, the bus a single event for the chunk
+        record_changes(
+            db.session,
+            [Change("expense", "created", row["id"], job.iduser, None, {name: row[name] for name in EXPENSE_FIELDS})
+             for row in rows],
+            [Change("expense", "imported", None, job.iduser, None, {"ids": [row["id"] for row in rows]})],
+        )
+        db.session.execute(ImportFingerprint.__table__.insert(), [
+            {"iduser": job.iduser, "fingerprint": print_, "idexpense": row["id"]}
+            for (print_, _), row in zip(new, rows)
+        ])
+        return len(new), len(chunk) - len(new)
+
+
+importer = Importer(IMPORT_THREADS)
@@ -0,0 +1,154 @@
+import datetime
+import json
+import logging
+import os
+import queue
+import random
+import sys
+import threading
+import time
+import uuid
+from logging.handlers import QueueHandler, QueueListener
+from flask import g, has_request_context, request
+from flask.logging import default_handler
+from sqlalchemy import event, inspect
+from sqlalchemy.engine import Engine
+from decouple import config
+
+LOG_LEVEL = config("LOG_LEVEL", default="INFO")
+# Share of requests whose DEBUG records are kept (all or none per request)
+LOG_DEBUG_SAMPLE_RATE = config("LOG_DEBUG_SAMPLE_RATE", default=0.01, cast=float)
+# Requests slower than this are logged at WARNING
+LOG_SLOW_REQUEST_MS = config("LOG_SLOW_REQUEST_MS", default=1000, cast=int)
+
+logger = logging.getLogger("api.request")
+
+_RECORD_FIELDS = set(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {"message", "asctime"}
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line; `extra=` fields become top-level keys."""
+
+    def format(self, record):
+        entry = {
+            "ts": datetime.datetime.fromtimestamp(record.created, datetime.timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        for key, value in vars(record).items():
+            if key not in _RECORD_FIELDS and not key.startswith("_"):
+                entry[key] = value
+        if record.exc_text:
+            entry["exc"] = record.exc_text
+        return json.dumps(entry, default=str, ensure_ascii=False)
+
+
+class RequestQueueHandler(QueueHandler):
+    """
+    Hands records to the listener thread, so the caller never waits on I/O.
+
+    The request context is read here, in the caller's thread. The queue and
+    listener are recreated after a fork, the way the event bus rebinds its
+    socket, since gunicorn preloads the app in the master.
+    """
+
+    def __init__(self, handlers):
+        super().__init__(queue.SimpleQueue())
+        self.handlers = handlers
+        self._lock = threading.Lock()
+        self._pid = None
+        self._listener = None
+
+    def start(self):
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self.queue = queue.SimpleQueue()
+            self._listener = QueueListener(self.queue, *self.handlers, respect_handler_level=True)
+            self._listener.start()
+            self._pid = os.getpid()
+
+    def stop(self):
+        with self._lock:
+            if self._listener is not None and self._pid == os.getpid():
+                self._listener.stop()
+            self._listener = None
+            self._pid = None
+
+    def filter(self, record):
+        if has_request_context():
+            record.request_id = g.get("request_id")
+            if record.levelno <= logging.DEBUG and not g.get("log_sampled"):
+                return False
+        elif record.levelno <= logging.DEBUG and random.random() >= LOG_DEBUG_SAMPLE_RATE:
+            return False
+        return super().filter(record)
+
+    def emit(self, record):
+        if self._pid != os.getpid():
+            self.start()
+        super().emit(record)
+
+    def prepare(self, record):
+        # Keep the traceback as its own field instead of folding it into the message
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+        record = logging.makeLogRecord(vars(record))
+        record.msg = record.getMessage()
+        record.args = None
+        record.exc_info = None
+        return record
+
+
+def setup_logging(app):
+    """Route every logger through the JSON queue and log each request."""
+    stream = logging.StreamHandler(sys.stdout)
+    stream.setFormatter(JsonFormatter())
+    handler = RequestQueueHandler([stream])
+
+    root = logging.getLogger()
+    for existing in list(root.handlers):
+        root.removeHandler(existing)
+    root.addHandler(handler)
+    root.setLevel(LOG_LEVEL)
+    app.logger.removeHandler(default_handler)
+
+    @app.before_request
+    def start_request_log():
+        g.request_id = request.headers.get("X-Request-ID") or uuid.uuid4().hex
+        g.request_started = time.perf_counter()
+        g.query_count = 0
+        g.log_sampled = random.random() < LOG_DEBUG_SAMPLE_RATE
+
+    @app.after_request
+    def finish_request_log(response):
+        if "request_started" not in g:
+            return response
+        duration_ms = (time.perf_counter() - g.request_started) * 1000
+        # The identity, not user.id: the session may have been rolled back
+        user = g.get("current_user")
+        identity = inspect(user).identity if user is not None else None
+        logger.log(
+            logging.WARNING if duration_ms >= LOG_SLOW_REQUEST_MS or response.status_code >= 500 else logging.INFO,
+            "%s %s %d", request.method, request.path, response.status_code,
+            extra={
+                "method": request.method,
+                "path": request.path,
+                "endpoint": request.endpoint,
+                "status": response.status_code,
+                "duration_ms": round(duration_ms, 2),
+                "queries": g.query_count,
+                "iduser": identity[0] if identity else None,
+            },
+        )
+        response.headers["X-Request-ID"] = g.request_id
+        return response
+
+    return handler
+
+
+@event.listens_for(Engine, "before_cursor_execute")
+def count_query(connection, cursor, statement, parameters, context, executemany):
+    if has_request_context() and "query_count" in g:
+        g.query_count += 1
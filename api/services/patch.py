@@ -0,0 +1,125 @@
+"""
+PATCH as one UPDATE ... WHERE id AND iduser AND version.
+
+The row isn't loaded: the affected-row count says whether it went through,
+and only when it didn't is the row looked up to tell 404, 403 and 409 apart.
+An expense patch that changes a field the derived counters follow
+(EXPENSE_FIELDS) first reads those columns, since the change events carry
+their old values and MySQL can't return them from the UPDATE. The read takes
+no lock: the UPDATE only matches the row at the version that was read, and
+every write moves the version, so what was read is what was replaced.
+"""
+from flask import request
+from sqlalchemy import func, select, update
+from app import db
+from api.events.tracking import EXPENSE_FIELDS, Change, record_changes
+from api.models.expense import fingerprint
+
+# Fields the expense fingerprint is computed from
+FINGERPRINT_FIELDS = ("concept", "amount", "date", "idpayment")
+
+
+class PatchError(Exception):
+    """A PATCH that can't be applied, with the HTTP status to answer."""
+
+    def __init__(self, status, message, version=None):
+        super().__init__(message)
+        self.status = status
+        self.version = version
+
+
+def expected_version(data):
+    """Version the client is editing, from If-Match ("3" or 3) or the body."""
+    value = request.headers.get("If-Match")
+    if value is not None:
+        value = value.strip().removeprefix("W/").strip('"')
+    else:
+        value = data.pop("version", None)
+    if value is None:
+        raise PatchError(428, "Send the version being edited, as If-Match or a version field")
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        raise PatchError(400, "Invalid version")
+
+
+def patch_values(data, fields):
+    """
+    The columns set by a PATCH body, as {name: value}.
+
+    `fields` maps each patchable key to (parse, nullable); an explicit null
+    clears a nullable column.
+    """
+    unknown = set(data) - set(fields)
+    if unknown:
+        raise PatchError(400, "Unknown fields: " + ", ".join(sorted(unknown)))
+    values = {}
+    for name, value in data.items():
+        parse, nullable = fields[name]
+        if value is None:
+            if not nullable:
+                raise PatchError(400, "%s can't be null" % name)
+            values[name] = None
+            continue
+        try:
+            values[name] = parse(value)
+        except (TypeError, ValueError, ArithmeticError):
+            raise PatchError(400, "Invalid %s" % name)
+    return values
+
+
+def apply_patch(model, row_id, iduser, values, version):
+    """
+    Apply values to the user's row if it is still at `version`.
+
+    Returns the new version; raises PatchError with 404, 403 or 409.
+    Records the change like an ORM update would; the caller commits.
+    """
+    if not values:
+        raise PatchError(400, "Nothing to update")
+    entity = model.__tablename__
+    old = new = {}
+    if entity == "expense":
+        old = new = None
+        if any(name in EXPENSE_FIELDS for name in values):
+            columns = [getattr(model, name) for name in EXPENSE_FIELDS]
+            row = db.session.execute(
+                select(model.iduser, model.version, *columns).where(*_live(model, row_id))
+            ).first()
+            _check(row, iduser, version)
+            old = {name: getattr(row, name) for name in EXPENSE_FIELDS}
+            new = dict(old, **{name: values[name] for name in EXPENSE_FIELDS if name in values})
+            if any(name in FINGERPRINT_FIELDS for name in values):
+                # The mapper hook doesn't run for bulk UPDATEs
+                values = dict(values, fingerprint=fingerprint(*(new[name] for name in FINGERPRINT_FIELDS)))
+
+    result = db.session.execute(
+        update(model)
+        .where(*_live(model, row_id), model.iduser == iduser, model.version == version)
+        .values(dict(values, version=model.version + 1, updated_at=func.current_timestamp())),
+        execution_options={"synchronize_session": False},
+    )
+    if result.rowcount == 0:
+        row = db.session.execute(select(model.iduser, model.version).where(*_live(model, row_id))).first()
+        _check(row, iduser, version)
+        raise PatchError(409, "Modified since that version, reload it", row.version)
+
+    # None/None: none of the fields the counters and caches follow changed
+    record_changes(db.session, [Change(entity, "updated", row_id, iduser, old, new)])
+    return version + 1
+
+
+def _live(model, row_id):
+    conditions = [model.id == row_id]
+    if hasattr(model, "is_delete"):
+        conditions.append(model.is_delete == 0)
+    return conditions
+
+
+def _check(row, iduser, version):
+    if row is None:
+        raise PatchError(404, "Not found")
+    if row.iduser != iduser:
+        raise PatchError(403, "Belongs to another user")
+    if row.version != version:
+        raise PatchError(409, "Modified since that version, reload it", row.version)
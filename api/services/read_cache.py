@@ -0,0 +1,117 @@
+import collections
+import datetime
+import threading
+from functools import wraps
+from flask import current_app, request, make_response
+from decouple import config
+from api.events.versions import versions
+from api.middleware.middleware import current_user
+
+READ_CACHE_ENABLED = config("READ_CACHE_ENABLED", default=True, cast=bool)
+READ_CACHE_MAX_BYTES = config("READ_CACHE_MAX_BYTES", default=64 * 1024 * 1024, cast=int)
+# Recomputed for every response, or never shared between responses
+UNCACHED_HEADERS = frozenset(("content-length", "set-cookie", "x-cache", "x-request-id"))
+
+
+class ReadCache:
+    """
+    Responses, as (body, headers), keyed by (user, endpoint, params, day,
+    user version).
+
+    The version is the user's shared one (api/events/versions.py), read on
+    every lookup: a write to any of the user's expenses, categories or
+    payment methods moves it in every worker at commit, so old entries are
+    simply never asked for again and age out of the LRU; nothing is scanned
+    on invalidation.
+    """
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self._entries = collections.OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry
+
+    def put(self, key, body, headers):
+        size = len(body) + 200
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self._size -= len(previous[0]) + 200
+            self._entries[key] = (body, headers)
+            self._size += size
+            while self._size > self.max_bytes:
+                _, (old_body, _) = self._entries.popitem(last=False)
+                self._size -= len(old_body) + 200
+                self.evictions += 1
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "bytes": self._size,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_ratio": round(self.hits / lookups, 4) if lookups else None,
+            }
+
+
+read_cache = ReadCache(READ_CACHE_MAX_BYTES)
+
+
+def cached_read(f):
+    """
+    Serve a GET view's 200 responses from read_cache.
+
+    Goes below @jwt_required; the key covers the view, its URL arguments,
+    the query string and today's date, which the default ranges and the
+    hot/cold split of the listings (hot_start()) depend on.
+    """
+    @wraps(f)
+    def decorated(data, *args, **kwargs):
+        if not READ_CACHE_ENABLED:
+            return f(data, *args, **kwargs)
+
+        iduser = current_user().id
+        # Read the version before the data: a write committing in between
+        # moves it, so what is stored below can't be served as newer
+        key = (
+            iduser,
+            f.__name__,
+            tuple(sorted(kwargs.items())),
+            tuple(sorted(request.args.items(multi=True))),
+            datetime.date.today(),
+            versions.version(iduser),
+        )
+        entry = read_cache.get(key)
+        if entry is not None:
+            # The stored headers keep the ETag conditional writes need
+            response = current_app.response_class(entry[0], headers=entry[1])
+            response.headers["X-Cache"] = "hit"
+            return response
+
+        response = make_response(f(data, *args, **kwargs))
+        if response.status_code == 200 and not response.is_streamed:
+            headers = [(name, value) for name, value in response.headers if name.lower() not in UNCACHED_HEADERS]
+            read_cache.put(key, response.get_data(), headers)
+        response.headers["X-Cache"] = "miss"
+        return response
+
+    return decorated
@@ -0,0 +1,100 @@
+import contextlib
+import threading
+import time
+from flask import g
+from decouple import config, Csv
+from app import app, db
+from api.events.bus import bus
+from api.models.user import User
+from api.models.user_shard import UserShard
+from api.services.sharding import DEFAULT_SHARD
+
+SHARD_NAMES = [DEFAULT_SHARD] + sorted(app.config["SQLALCHEMY_BINDS"])
+# Shards that receive new users, by iduser modulo; all of them by default
+SHARD_NEW_USERS = config("SHARD_NEW_USERS", default=",".join(SHARD_NAMES), cast=Csv())
+# Directory entries are cached this long; moves also clear them through the bus
+SHARD_DIRECTORY_TTL = config("SHARD_DIRECTORY_TTL", default=5.0, cast=float)
+
+SHARDING_ENABLED = len(SHARD_NAMES) > 1
+
+
+class DirectoryCache:
+    """email -> (iduser, shard, moving), so most requests skip the lookup."""
+
+    def __init__(self, ttl):
+        self.ttl = ttl
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    def lookup(self, email):
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(email)
+        if entry is not None and entry[0] > now:
+            return entry[1]
+
+        row = db.session.execute(
+            db.select(User.id, UserShard.shard, UserShard.moving)
+            .outerjoin(UserShard, UserShard.iduser == User.id)
+            .where(User.email == email)
+        ).first()
+        placement = None
+        if row is not None:
+            placement = (row.id, row.shard or DEFAULT_SHARD, bool(row.moving))
+        with self._lock:
+            self._entries[email] = (now + self.ttl, placement)
+        return placement
+
+    def forget(self, iduser):
+        with self._lock:
+            for email, (_, placement) in list(self._entries.items()):
+                if placement is not None and placement[0] == iduser:
+                    del self._entries[email]
+
+
+directory = DirectoryCache(SHARD_DIRECTORY_TTL)
+
+
+@bus.receiver
+def forget_moved_user(event):
+    if event["entity"] == "user_shard":
+        directory.forget(event["iduser"])
+
+
+def bind_shard(email):
+    """
+    Route this request's sharded tables to the user's shard.
+
+    Returns False while the user's rows are being moved.
+    """
+    if not SHARDING_ENABLED:
+        return True
+    placement = directory.lookup(email)
+    if placement is None:
+        return True
+    _, shard, moving = placement
+    g.shard = shard
+    return not moving
+
+
+def shard_engine(shard):
+    return db.engines[None if shard in (None, DEFAULT_SHARD) else shard]
+
+
+def assign_shard(iduser):
+    """Shard for a new user."""
+    return SHARD_NEW_USERS[iduser % len(SHARD_NEW_USERS)]
+
+
+@contextlib.contextmanager
+def using_shard(shard):
+    """Route the sharded tables to `shard` inside the block (threads, commands)."""
+    previous = g.get("shard")
+    g.shard = shard
+    try:
+        yield
+    finally:
+        if previous is None:
+            g.pop("shard", None)
+        else:
+            g.shard = previous
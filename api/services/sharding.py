@@ -0,0 +1,67 @@
+"""
+Routing of the per-user tables to the user's shard.
+
+Every table below is keyed by iduser, so all of one user's rows live in a
+single database: the main one (shard "default") or one of SHARD_BINDS.
+user and user_shard (the directory) always stay in the main database.
+
+Imported by app.py before the SQLAlchemy object exists, so it must not
+import the app.
+"""
+import sqlalchemy as sa
+from flask import g, has_app_context
+from flask_sqlalchemy.session import Session
+from sqlalchemy.sql.util import find_tables
+
+DEFAULT_SHARD = "default"
+
+SHARDED_TABLES = frozenset((
+    "expense",
+    "category",
+    "payment_method",
+    "change_log",
+    "concept_count",
+    "suggestion_count",
+    "month_version",
+    "import_mapping",
+    "import_job",
+    "import_fingerprint",
+))
+
+
+def parse_binds(value):
+    """SHARD_BINDS ("name=url,name=url") as a SQLALCHEMY_BINDS dict."""
+    binds = {}
+    for item in value.split(","):
+        if item.strip():
+            name, url = item.split("=", 1)
+            binds[name.strip()] = url.strip()
+    if DEFAULT_SHARD in binds:
+        raise ValueError('"%s" is the main database, not a SHARD_BINDS entry' % DEFAULT_SHARD)
+    return binds
+
+
+def current_shard():
+    """Shard of the current app context, set by @jwt_required or using_shard()."""
+    return g.get("shard") if has_app_context() else None
+
+
+class ShardedSession(Session):
+    """db.session: statements touching a sharded table go to g.shard's engine."""
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if bind is None:
+            shard = current_shard()
+            if shard not in (None, DEFAULT_SHARD) and _touches_sharded_table(mapper, clause):
+                return self._db.engines[shard]
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+
+def _touches_sharded_table(mapper, clause):
+    if mapper is not None and sa.inspect(mapper).local_table.name in SHARDED_TABLES:
+        return True
+    if clause is None:
+        return False
+    if isinstance(clause, sa.Table):
+        return clause.name in SHARDED_TABLES
+    return any(table.name in SHARDED_TABLES for table in find_tables(clause, include_crud=True))
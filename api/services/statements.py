@@ -0,0 +1,229 @@
+"""
+Monthly statements rendered to CSV or PDF in a pool of worker processes.
+
+This module is imported by the pool processes too, so it must not import
+the app: the request gathers the rows and the workers only format them.
+"""
+import collections
+import concurrent.futures
+import concurrent.futures.process
+import csv
+import decimal
+import glob
+import io
+import multiprocessing
+import os
+import tempfile
+import threading
+from decouple import config
+
+REPORT_CACHE_DIR = config(
+    "REPORT_CACHE_DIR", default=os.path.join(tempfile.gettempdir(), "finanzcord-reports")
+)
+REPORT_PROCESSES = config("REPORT_PROCESSES", default=2, cast=int)
+
+FORMATS = {"csv": "text/csv", "pdf": "application/pdf"}
+# Bumped when the rendered files change, so the cached ones are redone
+RENDER_REVISION = 2
+
+# Spreadsheets run cells starting with these as formulas
+CSV_FORMULA_PREFIXES = ("=", "+", "-", "@", "\t", "\r")
+
+
+def cache_path(iduser, month, version, fmt):
+    """Where the statement for this data version lives; a new version is a new file."""
+    return os.path.join(REPORT_CACHE_DIR, str(iduser), "%s-v%s-r%d.%s" % (month, version, RENDER_REVISION, fmt))
+
+
+def summarize(items):
+    """Totals by category and by payment method, largest first, plus the grand total."""
+    by_category = collections.defaultdict(decimal.Decimal)
+    by_payment = collections.defaultdict(decimal.Decimal)
+    for _, _, category, payment, amount in items:
+        by_category[category] += decimal.Decimal(amount)
+        by_payment[payment] += decimal.Decimal(amount)
+
+    def ranked(totals):
+        return sorted(totals.items(), key=lambda item: item[1], reverse=True)
+
+    return ranked(by_category), ranked(by_payment), sum(by_category.values(), decimal.Decimal(0))
+
+
+def render(report, fmt, path):
+    """
+    Write report to path (atomically) and drop older versions of the month.
+
+    report is {"month", "user", "items"} with items as
+    (date, concept, category, payment method, amount) string tuples.
+    """
+    directory = os.path.dirname(path)
+    os.makedirs(directory, exist_ok=True)
+    fd, temporary = tempfile.mkstemp(dir=directory, suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as output:
+            if fmt == "csv":
+                _write_csv(report, output)
+            else:
+                _write_pdf(report, output)
+        os.replace(temporary, path)
+    except BaseException:
+        os.unlink(temporary)
+        raise
+
+    for stale in glob.glob(os.path.join(directory, "%s-v*.%s" % (report["month"], fmt))):
+        if stale != path:
+            try:
+                os.unlink(stale)
+            except FileNotFoundError:
+                pass
+    return path
+
+
+def _csv_text(value):
+    """A user-written cell, quoted with ' if a spreadsheet would run it as a formula."""
+    return "'" + value if value.startswith(CSV_FORMULA_PREFIXES) else value
+
+
+def _write_csv(report, output):
+    by_category, by_payment, total = summarize(report["items"])
+    text = io.StringIO()
+    writer = csv.writer(text)
+    writer.writerow(["Statement", report["month"], _csv_text(report["user"])])
+    writer.writerow([])
+    writer.writerow(["Category", "Total"])
+    writer.writerows([_csv_text(name), str(amount)] for name, amount in by_category)
+    writer.writerow([])
+    writer.writerow(["Payment method", "Total"])
+    writer.writerows([_csv_text(name), str(amount)] for name, amount in by_payment)
+    writer.writerow([])
+    writer.writerow(["Total", str(total)])
+    writer.writerow([])
+    writer.writerow(["Date", "Concept", "Category", "Payment method", "Amount"])
+    writer.writerows(
+        [date, _csv_text(concept), _csv_text(category), _csv_text(payment), amount]
+        for date, concept, category, payment, amount in report["items"]
+    )
+    # The BOM makes spreadsheets read the accents as UTF-8
+    output.write(text.getvalue().encode("utf-8-sig"))
+
+
+# Courier is monospaced (600/1000 em), so columns are just padded text
+PAGE_WIDTH, PAGE_HEIGHT, MARGIN = 595, 842, 50
+FONT_SIZE, LEADING = 9, 12
+LINES_PER_PAGE = (PAGE_HEIGHT - 2 * MARGIN) // LEADING
+
+
+def _statement_lines(report):
+    by_category, by_payment, total = summarize(report["items"])
+    lines = ["Statement %s - %s" % (report["month"], report["user"]), ""]
+    for title, totals in (("By category", by_category), ("By payment method", by_payment)):
+        lines.append(title)
+        lines.extend("  %-40.40s %14s" % (name, amount) for name, amount in totals)
+        lines.append("")
+    lines.extend(["  %-40.40s %14s" % ("Total", total), ""])
+    lines.append("%-10s  %-32s  %-16s  %-14s  %11s" % ("Date", "Concept", "Category", "Payment", "Amount"))
+    lines.extend(
+        "%-10.10s  %-32.32s  %-16.16s  %-14.14s  %11s" % item for item in report["items"]
+    )
+    return lines
+
+
+def _pdf_text(line):
+    text = line.encode("cp1252", errors="replace")
+    return text.replace(b"\\", b"\\\\").replace(b"(", b"\\(").replace(b")", b"\\)")
+
+
+def _write_pdf(report, output):
+    """A plain text PDF, one Courier text object per page."""
+    lines = _statement_lines(report)
+    pages = [lines[start:start + LINES_PER_PAGE] for start in range(0, len(lines), LINES_PER_PAGE)] or [[]]
+
+    objects = [
+        b"<< /Type /Catalog /Pages 2 0 R >>",
+        None,  # page tree, once the page ids are known
+        b"<< /Type /Font /Subtype /Type1 /BaseFont /Courier /Encoding /WinAnsiEncoding >>",
+    ]
+    page_ids = []
+    for page in pages:
+        stream = [b"BT /F1 %d Tf %d TL %d %d Td" % (FONT_SIZE, LEADING, MARGIN, PAGE_HEIGHT - MARGIN)]
+        stream.extend(b"(" + _pdf_text(line) + b") '" for line in page)
+        stream.append(b"ET")
+        content = b"\n".join(stream)
+        objects.append(b"<< /Length %d >>\nstream\n%s\nendstream" % (len(content), content))
+        objects.append(
+            b"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 %d %d] /Resources << /Font << /F1 3 0 R >> >> "
+            b"/Contents %d 0 R >>" % (PAGE_WIDTH, PAGE_HEIGHT, len(objects))
+        )
+        page_ids.append(len(objects))
+    kids = b" ".join(b"%d 0 R" % page_id for page_id in page_ids)
+    objects[1] = b"<< /Type /Pages /Kids [%s] /Count %d >>" % (kids, len(page_ids))
+
+    data = bytearray(b"%PDF-1.4\n")
+    offsets = []
+    for number, body in enumerate(objects, start=1):
+        offsets.append(len(data))
+        data += b"%d 0 obj\n%s\nendobj\n" % (number, body)
+    xref = len(data)
+    data += b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1)
+    data += b"".join(b"%010d 00000 n \n" % offset for offset in offsets)
+    data += b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%EOF\n" % (len(objects) + 1, xref)
+    output.write(data)
+
+
+class StatementRenderer:
+    """
+    Hands renders to a process pool, one render per file at a time.
+
+    The pool is created lazily in each (forked) worker and uses "spawn", so
+    the children don't inherit the parent's threads or connections.
+    """
+
+    def __init__(self, processes):
+        self.processes = processes
+        self._pool = None
+        self._pid = None
+        self._renders = {}
+        self._lock = threading.Lock()
+
+    def submit(self, load, fmt, path):
+        """
+        Future of the render of path, shared by concurrent requests.
+
+        load() returns the report; it only runs when no render of path is
+        in flight, so the requests polling a slow render don't query again.
+        """
+        with self._lock:
+            future = self._renders.get(path)
+        if future is not None:
+            return future
+        # Outside the lock, other users' renders don't wait for this query
+        report = load()
+        with self._lock:
+            future = self._renders.get(path)
+            if future is not None:
+                return future
+            if self._pool is None or self._pid != os.getpid():
+                self._start()
+            try:
+                future = self._pool.submit(render, report, fmt, path)
+            except concurrent.futures.process.BrokenProcessPool:
+                # A child died (e.g. OOM killed); start over with a new pool
+                self._start()
+                future = self._pool.submit(render, report, fmt, path)
+            self._renders[path] = future
+        future.add_done_callback(lambda done: self._forget(path, done))
+        return future
+
+    def _start(self):
+        context = multiprocessing.get_context("spawn")
+        self._pool = concurrent.futures.ProcessPoolExecutor(self.processes, mp_context=context)
+        self._pid = os.getpid()
+        self._renders = {}
+
+    def _forget(self, path, future):
+        with self._lock:
+            if self._renders.get(path) is future:
+                del self._renders[path]
+
+
+renderer = StatementRenderer(REPORT_PROCESSES)
@@ -0,0 +1,124 @@
+"""
+Request-scoped transactions and statement timeouts.
+
+Every request ends with its session rolled back if the view failed or
+answered 4xx/5xx, so a failed commit caught by a handler never leaks a
+broken transaction (or the connection it holds) into the next request on
+the thread. Flask-SQLAlchemy removes the session when the app context ends.
+
+Queries run under a per-request time limit: MySQL's max_execution_time
+(SELECTs only), and on SQLite a progress handler that interrupts the
+statement once its deadline has passed.
+"""
+import sqlite3
+import time
+from functools import wraps
+from flask import g, has_app_context, jsonify
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.pool import Pool
+from decouple import config
+from app import app, db
+
+# Default limit per statement of a request, in milliseconds; 0 disables it
+STATEMENT_TIMEOUT_MS = config("STATEMENT_TIMEOUT_MS", default=5000, cast=int)
+
+# ER_QUERY_TIMEOUT and ER_QUERY_INTERRUPTED
+MYSQL_TIMEOUT_ERRORS = (3024, 1317)
+# VM instructions between deadline checks on SQLite
+SQLITE_PROGRESS_STEPS = 10000
+
+
+def statement_timeout(ms):
+    """Per-endpoint statement limit; goes below @jwt_required."""
+    def decorator(f):
+        @wraps(f)
+        def decorated(*args, **kwargs):
+            g.statement_timeout_ms = ms
+            return f(*args, **kwargs)
+        return decorated
+    return decorator
+
+
+@app.before_request
+def begin_unit_of_work():
+    g.statement_timeout_ms = STATEMENT_TIMEOUT_MS
+
+
+@app.after_request
+def end_unit_of_work(response):
+    if response.status_code >= 400:
+        db.session.rollback()
+    return response
+
+
+@app.teardown_request
+def abort_unit_of_work(exc):
+    if exc is not None:
+        db.session.rollback()
+
+
+@app.errorhandler(OperationalError)
+def statement_timed_out(e):
+    if not is_timeout(e):
+        raise e
+    db.session.rollback()
+    return jsonify({"error": "The query took too long, try a smaller range"}), 503
+
+
+def is_timeout(e):
+    orig = e.orig
+    if isinstance(orig, sqlite3.OperationalError):
+        return str(orig) == "interrupted"
+    return bool(orig.args) and orig.args[0] in MYSQL_TIMEOUT_ERRORS
+
+
+def current_timeout():
+    # Threads and commands outside a request run without a limit
+    if has_app_context():
+        return g.get("statement_timeout_ms") or 0
+    return 0
+
+
+@event.listens_for(Engine, "before_cursor_execute")
+def apply_statement_timeout(connection, cursor, statement, parameters, context, executemany):
+    ms = current_timeout()
+    dialect = connection.dialect.name
+    if dialect == "mysql":
+        # Session variable, only sent when it changes on this connection
+        if connection.info.get("max_execution_time", 0) != ms:
+            cursor.execute("SET SESSION max_execution_time = %d" % ms)
+            connection.info["max_execution_time"] = ms
+    elif dialect == "sqlite":
+        deadline = connection.info.get("statement_deadline")
+        if deadline is None:
+            deadline = connection.info["statement_deadline"] = [None]
+            connection.connection.dbapi_connection.set_progress_handler(
+                lambda: deadline[0] is not None and time.monotonic() > deadline[0],
+                SQLITE_PROGRESS_STEPS,
+            )
+        # Covers fetching the rows too, until the transaction ends
+        deadline[0] = time.monotonic() + ms / 1000 if ms else None
+
+
+def clear_deadline(info):
+    deadline = info.get("statement_deadline")
+    if deadline is not None:
+        deadline[0] = None
+
+
+@event.listens_for(Engine, "commit")
+def clear_deadline_on_commit(connection):
+    clear_deadline(connection.info)
+
+
+@event.listens_for(Engine, "rollback")
+def clear_deadline_on_rollback(connection):
+    clear_deadline(connection.info)
+
+
+@event.listens_for(Pool, "checkin")
+def clear_deadline_on_checkin(dbapi_connection, connection_record):
+    if connection_record is not None:
+        clear_deadline(connection_record.info)
@@ -0,0 +1,50 @@
+from sqlalchemy import func
+from sqlalchemy.dialects.mysql import insert as mysql_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+
+
+def upsert_add(session, table, keys, counts, values=None):
+    """
+    Insert a counter row, or add `counts` to the row that already exists.
+
+    keys identify the row (its primary key); `values` are overwritten on
+    conflict. A single statement, so concurrent writers can't collide on
+    the insert.
+    """
+    values = values or {}
+    upsert_add_all(session, table, [dict(keys, **counts, **values)], list(keys), list(counts), list(values))
+
+
+def upsert_add_all(session, table, rows, keys, counts, values=(), latest=()):
+    """
+    upsert_add() for many rows at once, as one executemany.
+
+    rows are dicts holding the `keys`, `counts`, `values` and `latest`
+    columns; `latest` ones keep the greater of the stored and the new value,
+    so a write carrying an older date doesn't move them back. Sort rows by
+    key so concurrent writers lock rows in the same order.
+    """
+    if not rows:
+        return
+    dialect = session.get_bind(clause=table).dialect.name
+
+    if dialect == "mysql":
+        statement = mysql_insert(table)
+        update = {name: table.c[name] + statement.inserted[name] for name in counts}
+        update.update({name: statement.inserted[name] for name in values})
+        update.update({name: _greatest(func.greatest, table.c[name], statement.inserted[name]) for name in latest})
+        statement = statement.on_duplicate_key_update(update)
+    else:
+        statement = sqlite_insert(table)
+        update = {name: table.c[name] + statement.excluded[name] for name in counts}
+        update.update({name: statement.excluded[name] for name in values})
+        # SQLite's max() with two arguments is the scalar one
+        update.update({name: _greatest(func.max, table.c[name], statement.excluded[name]) for name in latest})
+        statement = statement.on_conflict_do_update(index_elements=list(keys), set_=update)
+
+    session.execute(statement, rows)
+
+
+def _greatest(function, stored, new):
+    # Both functions return NULL if any argument is, so NULL only wins alone
+    return function(func.coalesce(stored, new), func.coalesce(new, stored))
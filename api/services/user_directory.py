@@ -0,0 +1,90 @@
+import base64
+import json
+import threading
+import time
+from decouple import config, Csv
+from sqlalchemy import and_, func, or_, select
+from app import db
+from api.models.user import User
+
+# Users allowed to browse the directory; nobody until it is configured
+ADMIN_USER_IDS = config("ADMIN_USER_IDS", default="", cast=Csv(int))
+USER_PAGE_SIZE = config("USER_PAGE_SIZE", default=50, cast=int)
+USER_PAGE_MAX = config("USER_PAGE_MAX", default=200, cast=int)
+# How stale the total shown with each page may be
+USER_COUNT_TTL = config("USER_COUNT_TTL", default=60.0, cast=float)
+
+# Sort column per search field; each one is served by (is_delete, column, id)
+SORT_COLUMNS = {"id": User.id, "email": User.email, "name": User.name}
+
+
+class CountCache:
+    """Users per is_delete value, recounted at most every `ttl` seconds."""
+
+    def __init__(self, ttl):
+        self.ttl = ttl
+        self._counts = {}
+        self._lock = threading.Lock()
+
+    def get(self, deleted):
+        now = time.monotonic()
+        with self._lock:
+            entry = self._counts.get(deleted)
+        if entry is not None and entry[0] > now:
+            return entry[1]
+        count = db.session.execute(
+            select(func.count()).select_from(User).where(User.is_delete == deleted)
+        ).scalar()
+        with self._lock:
+            self._counts[deleted] = (now + self.ttl, count)
+        return count
+
+
+user_counts = CountCache(USER_COUNT_TTL)
+
+
+def encode_cursor(values):
+    return base64.urlsafe_b64encode(json.dumps(values).encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor):
+    """[sort value, id] from an `after` cursor; ValueError if it isn't one."""
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+    except (ValueError, TypeError):
+        raise ValueError("Invalid cursor")
+    if not isinstance(values, list) or len(values) != 2 or not isinstance(values[1], int):
+        raise ValueError("Invalid cursor")
+    return values
+
+
+def directory_page(field=None, prefix=None, deleted=False, after=None, limit=USER_PAGE_SIZE):
+    """
+    One page of users ordered by (field, id), and the cursor of the next one.
+
+    A page starts right after the `after` cursor rather than at an OFFSET, so
+    every page is one range scan of the field's index. Sorting by email or
+    name leaves out users without one.
+    """
+    field = field or "id"
+    column = SORT_COLUMNS[field]
+    query = select(User.id, User.name, User.email).where(User.is_delete == deleted)
+    if field != "id":
+        query = query.where(column.isnot(None))
+    if prefix:
+        query = query.where(column.startswith(prefix, autoescape=True))
+    if after is not None:
+        value, last_id = decode_cursor(after)
+        if field == "id":
+            query = query.where(User.id > last_id)
+        else:
+            query = query.where(or_(column > value, and_(column == value, User.id > last_id)))
+    query = query.order_by(column, User.id).limit(limit + 1)
+
+    rows = db.session.execute(query).all()
+    cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        last = rows[-1]
+        cursor = encode_cursor([getattr(last, field), last.id])
+    return rows, cursor
@@ -0,0 +1,49 @@
+import threading
+import time
+from sqlalchemy import text
+from app import app, db
+
+_ready = threading.Event()
+
+
+def is_ready():
+    return _ready.is_set()
+
+
+def reset_pools():
+    """
+    Forget the connections inherited from the gunicorn master.
+
+    Called right after fork: dispose(close=False) drops the pooled sockets
+    without closing them, since the parent still owns them.
+    """
+    _ready.clear()
+    with app.app_context():
+        for engine in db.engines.values():
+            engine.dispose(close=False)
+
+
+def warm_up(connections, retry_seconds=2.0):
+    """
+    Open `connections` pooled connections per engine, then mark ready.
+
+    Retries until the database answers, so readiness stays off while it's down.
+    """
+    while True:
+        try:
+            with app.app_context():
+                for engine in db.engines.values():
+                    opened = [engine.connect() for _ in range(connections)]
+                    for connection in opened:
+                        connection.execute(text("SELECT 1"))
+                    for connection in opened:
+                        connection.close()
+            _ready.set()
+            return
+        except Exception as e:
+            app.logger.warning("Database warm-up failed, retrying: %s", e)
+            time.sleep(retry_seconds)
+
+
+def warm_up_in_background(connections):
+    threading.Thread(target=warm_up, args=(connections,), name="db-warm-up", daemon=True).start()
@@ -0,0 +1,81 @@
+import math
+import numpy as np
+
+_BASE32 = "0123456789bcdefghjkmnpqrstuvwxyz"
+# Stored precision, cells of roughly 4.8 m x 4.8 m
+PRECISION = 9
+METERS_PER_DEGREE = 111320.0
+# Mean earth radius, the one geopy's great_circle uses
+EARTH_RADIUS = 6371009.0
+
+
+def encode(latitude, longitude, precision=PRECISION):
+    """Geohash of a point; nearby points share a prefix."""
+    lat_range, lon_range = [-90.0, 90.0], [-180.0, 180.0]
+    bits, even, chars = 0, True, []
+    for bit in range(precision * 5):
+        interval, value = (lon_range, longitude) if even else (lat_range, latitude)
+        middle = (interval[0] + interval[1]) / 2
+        bits <<= 1
+        if value >= middle:
+            bits |= 1
+            interval[0] = middle
+        else:
+            interval[1] = middle
+        even = not even
+        if bit % 5 == 4:
+            chars.append(_BASE32[bits])
+            bits = 0
+    return "".join(chars)
+
+
+def cell_size(precision):
+    """(height, width) in degrees of a cell of this precision."""
+    lon_bits = (precision * 5 + 1) // 2
+    lat_bits = precision * 5 // 2
+    return 180.0 / 2 ** lat_bits, 360.0 / 2 ** lon_bits
+
+
+def cover(latitude, longitude, radius):
+    """
+    Geohash prefixes whose cells cover the circle of `radius` meters.
+
+    Uses the finest precision whose cells are at least as large as the
+    radius, so the center cell and its eight neighbours always suffice.
+    Returns [""] (everything) when the circle is larger than any cell.
+    """
+    delta_lat = radius / METERS_PER_DEGREE
+    cos_lat = math.cos(math.radians(min(abs(latitude) + delta_lat, 89.9)))
+    delta_lon = radius / (METERS_PER_DEGREE * cos_lat)
+
+    precision = 0
+    for candidate in range(PRECISION, 0, -1):
+        height, width = cell_size(candidate)
+        if height >= delta_lat and width >= delta_lon:
+            precision = candidate
+            break
+    if not precision:
+        return [""]
+
+    height, width = cell_size(precision)
+    cells = set()
+    for step_lat in (-1, 0, 1):
+        for step_lon in (-1, 0, 1):
+            lat = max(-90.0, min(89.999999, latitude + step_lat * height))
+            lon = (longitude + step_lon * width + 180.0) % 360.0 - 180.0
+            cells.add(encode(lat, lon, precision))
+    return sorted(cells)
+
+
+def prefix_range(prefix):
+    """[low, high) bounds of the stored geohashes starting with prefix."""
+    # "~" sorts after every base32 character
+    return prefix, prefix + "~"
+
+
+def distances(latitude, longitude, latitudes, longitudes):
+    """Haversine distances in meters from a point to arrays of points, at once."""
+    lat1, lon1 = math.radians(latitude), math.radians(longitude)
+    lat2, lon2 = np.radians(latitudes), np.radians(longitudes)
+    a = np.sin((lat2 - lat1) / 2) ** 2 + math.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS * np.arcsin(np.sqrt(np.minimum(a, 1.0)))
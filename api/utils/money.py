@@ -0,0 +1,48 @@
+import decimal
+from sqlalchemy import BigInteger
+from sqlalchemy.types import TypeDecorator
+
+CENT = decimal.Decimal("0.01")
+# Range of a signed BIGINT
+MAX_CENTS = 2 ** 63 - 1
+
+
+def to_cents(amount):
+    """
+    Whole cents of an amount given as a Decimal, number or string.
+
+    Rounds half up like DECIMAL(10, 2) did; ValueError if it doesn't fit
+    in a BIGINT, decimal.InvalidOperation if it isn't a number.
+    """
+    if amount is None:
+        return None
+    cents = decimal.Decimal(str(amount)) * 100
+    if cents.is_finite() and abs(cents) > MAX_CENTS:
+        raise ValueError("Amount %s out of range" % amount)
+    return int(cents.quantize(decimal.Decimal(1), decimal.ROUND_HALF_UP))
+
+
+def from_cents(cents):
+    """Decimal with two places, 1250 -> Decimal("12.50")."""
+    if cents is None:
+        return None
+    return decimal.Decimal(int(cents)).scaleb(-2)
+
+
+class Cents(TypeDecorator):
+    """
+    Amount stored as a BIGINT of cents and handled in Python as a Decimal.
+
+    Models and queries keep working with Decimal amounts while the database
+    sums and compares integers; bind a raw column with
+    type_coerce(column, BigInteger) to read the cents themselves.
+    """
+
+    impl = BigInteger
+    cache_ok = True
+
+    def process_bind_param(self, value, dialect):
+        return to_cents(value)
+
+    def process_result_value(self, value, dialect):
+        return from_cents(value)
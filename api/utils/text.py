@@ -0,0 +1,17 @@
+import re
+import unicodedata
+
+_SPACES = re.compile(r"\s+")
+
+
+def normalize_concept(concept):
+    """
+    Key used to group concepts typed slightly differently.
+
+    "  Café  Oxxo " and "cafe oxxo" both become "cafe oxxo".
+    """
+    if not concept:
+        return ""
+    text = unicodedata.normalize("NFKD", concept)
+    text = "".join(char for char in text if not unicodedata.combining(char))
+    return _SPACES.sub(" ", text).strip().lower()[:255]
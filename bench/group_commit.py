@@ -0,0 +1,115 @@
+"""
+Commits per second vs inserts per second, per-request commit vs group commit.
+
+    python bench/group_commit.py                      # temporary SQLite file
+    DATABASE_URL=mysql://... python bench/group_commit.py
+
+Each thread plays one client inserting expenses back to back.
+
+On a local SQLite file, 200 inserts per client:
+
+    mode       concurrency    inserts/s    commits/s    p99 ms
+    per-req              1          137          137     26.42
+    group                1           66           66     24.09
+    per-req              4          124          124    510.34
+    group                4          158           39     33.29
+    per-req             16          144          144   1741.17
+    group               16          226           14     95.46
+    per-req             64          172          172   5451.96
+    group               64          434            7    206.07
+
+A lone client is about half as fast in group mode: every insert waits
+GROUP_COMMIT_WAIT_MS for company that never comes. Leave
+EXPENSE_GROUP_COMMIT off unless inserts arrive concurrently.
+"""
+import datetime
+import os
+import sys
+import tempfile
+import threading
+import time
+
+INSERTS_PER_CLIENT = 200
+CONCURRENCY = (1, 4, 16, 64)
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("SECRET_KEY", "bench")
+# One connection per client thread, plus the flusher's
+os.environ.setdefault("DATABASE_POOL_SIZE", str(max(CONCURRENCY) + 1))
+os.environ.setdefault("DATABASE_URL", "sqlite:///" + os.path.join(tempfile.mkdtemp(), "bench.db"))
+
+from sqlalchemy import event
+from app import app, db
+from api.models.expense import Expense
+from api.services.group_commit import GroupCommitter
+
+commits = 0
+
+
+def count_commit(conn):
+    global commits
+    commits += 1
+
+
+def wait_for_lock(dbapi_connection, connection_record):
+    # SQLite has one writer at a time; at high concurrency a client can wait
+    # longer than the default 5 s for it
+    dbapi_connection.execute("PRAGMA busy_timeout = 60000")
+
+
+def values(client, n):
+    return dict(concept="bench %d-%d" % (client, n), amount=12.5, date=datetime.date(2024, 1, 1), iduser=1)
+
+
+def per_request(client, latencies):
+    with app.app_context():
+        for n in range(INSERTS_PER_CLIENT):
+            start = time.perf_counter()
+            db.session.add(Expense(**values(client, n)))
+            db.session.commit()
+            latencies.append(time.perf_counter() - start)
+
+
+def grouped(committer):
+    def run(client, latencies):
+        for n in range(INSERTS_PER_CLIENT):
+            start = time.perf_counter()
+            committer.submit(Expense, values(client, n))
+            latencies.append(time.perf_counter() - start)
+    return run
+
+
+def measure(worker, clients):
+    global commits
+    latencies = []
+    threads = [threading.Thread(target=worker, args=(c, latencies)) for c in range(clients)]
+    commits = 0
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+    latencies.sort()
+    p99 = latencies[int(len(latencies) * 0.99) - 1] * 1000
+    return len(latencies) / elapsed, commits / elapsed, p99
+
+
+def main():
+    with app.app_context():
+        if db.engine.dialect.name == "sqlite":
+            event.listen(db.engine, "connect", wait_for_lock)
+            db.engine.dispose()
+        db.create_all()
+        event.listen(db.engine, "commit", count_commit)
+
+    committer = GroupCommitter(timeout_ms=30000)
+    print("%-10s %11s %12s %12s %9s" % ("mode", "concurrency", "inserts/s", "commits/s", "p99 ms"))
+    for clients in CONCURRENCY:
+        for mode, worker in (("per-req", per_request), ("group", grouped(committer))):
+            inserts, commit_rate, p99 = measure(worker, clients)
+            print("%-10s %11d %12.0f %12.0f %9.2f" % (mode, clients, inserts, commit_rate, p99))
+
+
+if __name__ == "__main__":
+    main()
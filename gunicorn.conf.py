@@ -0,0 +1,39 @@
+# Configuracion de gunicorn: gunicorn -c gunicorn.conf.py wsgi:app
+import gc
+import multiprocessing
+from decouple import config
+
+bind = config("GUNICORN_BIND", default="0.0.0.0:5000")
+
+# Load the app once in the master so workers share its pages copy-on-write
+preload_app = config("GUNICORN_PRELOAD", default=True, cast=bool)
+
+workers = config("GUNICORN_WORKERS", default=multiprocessing.cpu_count() * 2 + 1, cast=int)
+threads = config("GUNICORN_THREADS", default=4, cast=int)
+worker_class = "gthread" if threads > 1 else "sync"
+
+# Recycle workers regularly, jittered so they don't all restart at once
+max_requests = config("GUNICORN_MAX_REQUESTS", default=1000, cast=int)
+max_requests_jitter = config("GUNICORN_MAX_REQUESTS_JITTER", default=100, cast=int)
+
+timeout = config("GUNICORN_TIMEOUT", default=30, cast=int)
+graceful_timeout = config("GUNICORN_GRACEFUL_TIMEOUT", default=30, cast=int)
+keepalive = config("GUNICORN_KEEPALIVE", default=5, cast=int)
+
+accesslog = "-"
+
+
+def when_ready(server):
+    # Keep the GC from touching (and so copying) the preloaded objects
+    gc.freeze()
+
+
+def post_fork(server, worker):
+    from api.services.imports import importer
+    from api.services.warmup import reset_pools, warm_up_in_background
+
+    reset_pools()
+    # One connection per thread; /health/ready flips once they're all open
+    warm_up_in_background(threads)
+    # Imports left behind by a worker that was recycled or died
+    importer.resume_in_background()
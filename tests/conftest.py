@@ -0,0 +1,62 @@
+import os
+import sys
+import tempfile
+
+# The app reads its configuration on import
+DATA_DIR = tempfile.mkdtemp(prefix="finanzcord-tests-")
+os.environ.setdefault("SECRET_KEY", "tests-secret-key-long-enough-for-hs256")
+os.environ["DATABASE_URL"] = "sqlite:///" + os.path.join(DATA_DIR, "main.db")
+os.environ["SHARD_BINDS"] = "s1=sqlite:///" + os.path.join(DATA_DIR, "s1.db")
+os.environ["SHARD_NEW_USERS"] = "default"
+os.environ["RATELIMIT_ENABLED"] = "false"
+os.environ["EVENTS_SOCKET_DIR"] = os.path.join(DATA_DIR, "events")
+os.environ["RATELIMIT_SHM_PATH"] = os.path.join(DATA_DIR, "ratelimit")
+os.environ["IMPORT_DIR"] = os.path.join(DATA_DIR, "imports")
+os.environ["REPORT_CACHE_DIR"] = os.path.join(DATA_DIR, "reports")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import jwt
+import pytest
+from app import app as flask_app, db, SECRET_KEY
+from api.models.user import User
+from api.services.sharding import DEFAULT_SHARD
+from api.services.shard_directory import SHARD_NAMES, shard_engine
+
+
+@pytest.fixture(scope="session")
+def app():
+    with flask_app.app_context():
+        db.create_all()
+    flask_app.test_cli_runner().invoke(args=["shards", "init"])
+    return flask_app
+
+
+@pytest.fixture(autouse=True)
+def empty_database(app):
+    """Every test starts from empty tables on every shard."""
+    yield
+    with app.app_context():
+        db.session.remove()
+        for shard in SHARD_NAMES:
+            with shard_engine(shard).begin() as connection:
+                names = set(db.inspect(connection).get_table_names())
+                for table in reversed(db.metadata.sorted_tables):
+                    if table.name in names and (shard == DEFAULT_SHARD or table.name != "user"):
+                        connection.execute(table.delete())
+
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
+
+
+@pytest.fixture
+def user(app):
+    """A registered user and the Authorization header of its token."""
+    with app.app_context():
+        row = User(name="a", email="a@example.com", password="x", is_delete=False)
+        db.session.add(row)
+        db.session.commit()
+        iduser = row.id
+    token = jwt.encode({"email": "a@example.com"}, SECRET_KEY, algorithm="HS256")
+    return iduser, {"Authorization": "Bearer " + token}
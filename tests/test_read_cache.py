@@ -0,0 +1,28 @@
+def test_hit_keeps_the_headers_of_the_miss(client, user):
+    _, headers = user
+    created = client.post("/expense/", json={"concept": "Coffee", "amount": 3.5, "date": "2026-10-01"}, headers=headers)
+    expense_id = created.get_json()["id"]
+
+    miss = client.get("/expense/%d" % expense_id, headers=headers)
+    hit = client.get("/expense/%d" % expense_id, headers=headers)
+
+    assert miss.headers["X-Cache"] == "miss"
+    assert hit.headers["X-Cache"] == "hit"
+    assert hit.get_data() == miss.get_data()
+    assert hit.headers["ETag"] == miss.headers["ETag"] == '"1"'
+    assert hit.headers["Content-Type"] == miss.headers["Content-Type"]
+    assert hit.headers.get("Cache-Control") == miss.headers.get("Cache-Control")
+
+
+def test_write_is_not_served_from_cache(client, user):
+    _, headers = user
+    created = client.post("/expense/", json={"concept": "Coffee", "amount": 3.5, "date": "2026-10-01"}, headers=headers)
+    expense_id = created.get_json()["id"]
+    client.get("/expense/%d" % expense_id, headers=headers)
+
+    client.put("/expense/%d" % expense_id, json={"amount": 4}, headers=headers)
+    after = client.get("/expense/%d" % expense_id, headers=headers)
+
+    assert after.headers["X-Cache"] == "miss"
+    assert after.get_json()["amount"] == 4
+    assert after.headers["ETag"] == '"2"'
@@ -0,0 +1,75 @@
+import jwt
+from app import db, SECRET_KEY
+from api.models.user import User
+from api.models.user_shard import UserShard
+from api.services.shard_directory import directory, shard_engine
+
+
+def add_user(app, email, shard):
+    with app.app_context():
+        row = User(name=email, email=email, password="x", is_delete=False)
+        db.session.add(row)
+        db.session.flush()
+        db.session.add(UserShard(iduser=row.id, shard=shard))
+        db.session.commit()
+        iduser = row.id
+    token = jwt.encode({"email": email}, SECRET_KEY, algorithm="HS256")
+    return iduser, {"Authorization": "Bearer " + token}
+
+
+def add_expenses(client, headers, concepts):
+    category = client.post("/category/", json={"description": "food"}, headers=headers).get_json()["id"]
+    payment = client.post("/payment_method/", json={"name": "card"}, headers=headers).get_json()["id"]
+    for concept in concepts:
+        client.post("/expense/", json={
+            "concept": concept, "amount": 10, "date": "2026-10-01", "idcategory": category, "idpayment": payment,
+        }, headers=headers)
+    return category, payment
+
+
+def test_move_renumbers_ids_taken_on_the_target(app, client):
+    # Both shards start their IDs at 1, so the two users' rows collide
+    mover, mover_headers = add_user(app, "mover@example.com", "default")
+    other, other_headers = add_user(app, "other@example.com", "s1")
+    add_expenses(client, mover_headers, ["Coffee", "Taxi"])
+    old_token = client.get("/sync", headers=mover_headers).get_json()["token"]
+    add_expenses(client, other_headers, ["Rent", "Gym", "Books"])
+
+    result = app.test_cli_runner().invoke(args=["shards", "move", str(mover), "s1", "--wait", "0"])
+    assert result.exit_code == 0, result.output
+    for iduser in (mover, other):
+        directory.forget(iduser)
+
+    with app.app_context():
+        with shard_engine("default").connect() as connection:
+            assert connection.execute(db.text("SELECT COUNT(*) FROM expense")).scalar() == 0
+        with shard_engine("s1").connect() as connection:
+            categories = dict(connection.execute(db.text("SELECT id, iduser FROM category")).all())
+            payments = dict(connection.execute(db.text("SELECT id, iduser FROM payment_method")).all())
+            expenses = connection.execute(db.text("SELECT id, iduser, idcategory, idpayment FROM expense")).all()
+            labels = connection.execute(
+                db.text("SELECT target, label FROM suggestion_count WHERE iduser = :iduser"), {"iduser": mover}
+            ).all()
+
+    assert len(expenses) == len({row.id for row in expenses}) == 5
+    for row in expenses:
+        assert categories[row.idcategory] == row.iduser
+        assert payments[row.idpayment] == row.iduser
+    owned = {"category": categories, "payment": payments}
+    assert labels and all(owned[target][label] == mover for target, label in labels)
+
+    # The other user's rows are untouched
+    other_expenses = client.get("/expense/page/1", headers=other_headers).get_json()
+    assert sorted(expense["concept"] for expense in other_expenses) == ["Books", "Gym", "Rent"]
+
+    # The mover sees its expenses under the new IDs, and sync drops the old ones
+    moved = client.get("/sync", headers=mover_headers).get_json()
+    assert sorted(expense["concept"] for expense in moved["expenses"]) == ["Coffee", "Taxi"]
+    since = client.get("/sync?since=%s" % old_token, headers=mover_headers).get_json()
+    assert {expense["id"] for expense in since["expenses"]} == {expense["id"] for expense in moved["expenses"]}
+    assert since["deleted"]["expense"] == [1, 2]
+    assert since["deleted"]["category"] == [1]
+    for expense in moved["expenses"]:
+        fetched = client.get("/expense/%d" % expense["id"], headers=mover_headers)
+        assert fetched.status_code == 200
+        assert fetched.get_json()["idcategory"] == expense["idcategory"]
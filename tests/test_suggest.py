@@ -0,0 +1,16 @@
+def test_deleted_category_is_not_suggested(client, user):
+    _, headers = user
+    food = client.post("/category/", json={"description": "Food"}, headers=headers).get_json()["id"]
+    transport = client.post("/category/", json={"description": "Transport"}, headers=headers).get_json()["id"]
+    for day in (1, 2, 3):
+        expense = {"concept": "Coffee shop", "amount": 3, "date": "2026-10-0%d" % day, "idcategory": food}
+        client.post("/expense/", json=expense, headers=headers)
+    client.post("/expense/", json={"concept": "Bus ticket", "amount": 2, "date": "2026-10-04", "idcategory": transport}, headers=headers)
+
+    before = client.get("/expense/suggest-category?concept=coffee", headers=headers).get_json()
+    client.delete("/category/%d" % food, headers=headers)
+    after = client.get("/expense/suggest-category?concept=coffee", headers=headers).get_json()
+
+    assert before["idcategory"] == food
+    assert after["idcategory"] == transport
+    assert [candidate["id"] for candidate in after["categories"]] == [transport]
@@ -0,0 +1,2 @@
+# Punto de entrada de produccion: gunicorn -c gunicorn.conf.py wsgi:app
+from app import app